@@ -42,6 +42,10 @@ celery_app.conf.beat_schedule = {
         "task": "train_collaborative_filtering_model",
         "schedule": crontab(hour=0, minute=0),
     },
+    "maintain-vector-indexes-every-hour": {
+        "task": "maintain_vector_indexes",
+        "schedule": crontab(minute=30),
+    },
 }
 
 
@@ -53,7 +57,9 @@ def init_services_for_worker(**kwargs):
         return
 
     try:
-        asyncio.run(ensure_services_initialized(use_onnx=config.USE_ONNX))
+        asyncio.run(
+            ensure_services_initialized(use_onnx=config.USE_ONNX, spawn_shards=False, background_compaction=False)
+        )
         logger.info("Celery services initialized")
     except Exception as exc:
         logger.error("Celery services initialization failed: %s", exc, exc_info=True)
@@ -28,6 +28,57 @@ class Settings(BaseSettings):
     METRICS_ENABLED: bool = True
     METRICS_PATH: str = "/metrics"
 
+    VECTOR_DB_COMPACTION_MIN_TOMBSTONES: int = 1000
+    VECTOR_DB_COMPACTION_RATIO: float = 0.2
+    VECTOR_DB_TOMBSTONE_OVERFETCH_FACTOR: int = 2
+    VECTOR_DB_INDEX_TYPE: str = "hnsw"
+    VECTOR_DB_PROMOTION_THRESHOLD: int = 50000
+    VECTOR_DB_IVF_NLIST: int = 0
+    VECTOR_DB_IVF_NPROBE: int = 16
+    VECTOR_DB_HNSW_M: int = 32
+    VECTOR_DB_HNSW_EF_SEARCH: int = 64
+    VECTOR_DB_COMPRESSION: str = "none"
+    VECTOR_DB_COMPRESSION_TRAIN_SIZE: int = 1000
+    VECTOR_DB_RERANK_FACTOR: int = 4
+    RECSYS_VECTOR_DB_COMPRESSION: str = "none"
+    RECSYS_VECTOR_DB_EXACT_RERANK: bool = False
+    RECSYS_VECTOR_DB_NAMESPACE: str = "recsys_vector_db"
+    VECTOR_DB_CHECKPOINT_INTERVAL: int = 1000
+    VECTOR_DB_SNAPSHOT_DIR: str = ""
+    VECTOR_DB_SNAPSHOT_KEEP: int = 2
+    VECTOR_DB_THREADS: int = 4
+    VECTOR_DB_FILTER_EXACT_LIMIT: int = 10000
+    VECTOR_DB_SYNC_BLOCK_MS: int = 5000
+    VECTOR_DB_TEXT_CACHE_BYTES: int = 64 * 1024 * 1024
+    VECTOR_DB_SHARDS: int = 0
+    VECTOR_DB_SHARD_ADDRESSES: str = ""
+    VECTOR_DB_SHARD_CONNECTIONS: int = 4
+    VECTOR_DB_SHARD_AUTHKEY: str = ""
+    SEARCH_MODE: str = "dense"
+    SEARCH_RRF_K: int = 60
+    SEARCH_HYBRID_DEPTH: int = 4
+    SEARCH_LEXICAL_MAX_TERMS: int = 3
+    SEARCH_MMR_LAMBDA: float = 1.0
+    SEARCH_MMR_POOL_FACTOR: int = 4
+    SEARCH_DUPLICATE_THRESHOLD: float = 0.95
+    RAG_CACHE_TTL_SECONDS: int = 300
+    RAG_SEMANTIC_CACHE_THRESHOLD: float = 0.92
+    RAG_SEMANTIC_CACHE_SIZE: int = 1000
+    SINGLE_FLIGHT_LOCK_TTL_SECONDS: float = 90.0
+    SINGLE_FLIGHT_POLL_INTERVAL_MS: float = 50.0
+    EMBEDDING_BATCH_MAX_SIZE: int = 32
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = 2.0
+    EMBEDDING_BUCKET_MAX_SIZE: int = 32
+    EMBEDDING_BUCKET_MAX_TOKENS: int = 4096
+    EMBEDDING_STREAM_WINDOW: int = 1024
+    EMBEDDING_WORKERS: int = 0
+    EMBEDDING_POOL_CHUNK_SIZE: int = 256
+    EMBEDDING_BACKEND: str = "torch"
+    EMBEDDING_ONNX_DIR: str = ""
+    EMBEDDING_ONNX_MIN_COSINE: float = 0.99
+    EMBEDDING_CACHE_SIZE: int = 50000
+    EMBEDDING_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+
     LLM_BASE_URL: str = "https://openrouter.ai/api/v1"
     LLM_MODEL: str = "meta-llama/llama-3.3-8b-instruct:free"
     LLM_API_KEY: str
@@ -63,5 +114,33 @@ class Settings(BaseSettings):
             raise ValueError("JWT_EXPIRE_MINUTES must be > 0 and <= 1440")
         return value
 
+    @field_validator("SEARCH_MODE")
+    @classmethod
+    def validate_search_mode(cls, value: str) -> str:
+        if value not in ("dense", "lexical", "hybrid", "auto"):
+            raise ValueError("SEARCH_MODE must be one of: dense, lexical, hybrid, auto")
+        return value
+
+    @field_validator("EMBEDDING_BACKEND")
+    @classmethod
+    def validate_embedding_backend(cls, value: str) -> str:
+        if value not in ("torch", "onnx", "onnx_int8"):
+            raise ValueError("EMBEDDING_BACKEND must be one of: torch, onnx, onnx_int8")
+        return value
+
+    @field_validator("VECTOR_DB_INDEX_TYPE")
+    @classmethod
+    def validate_vector_db_index_type(cls, value: str) -> str:
+        if value not in ("flat", "ivf_flat", "hnsw", "ivf_pq"):
+            raise ValueError("VECTOR_DB_INDEX_TYPE must be one of: flat, ivf_flat, hnsw, ivf_pq")
+        return value
+
+    @field_validator("VECTOR_DB_COMPRESSION", "RECSYS_VECTOR_DB_COMPRESSION")
+    @classmethod
+    def validate_vector_db_compression(cls, value: str) -> str:
+        if value not in ("none", "fp16", "sq8", "pq"):
+            raise ValueError("Vector DB compression must be one of: none, fp16, sq8, pq")
+        return value
+
 
 config = Settings()
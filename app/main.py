@@ -20,6 +20,7 @@ from app.services import (
     get_llm,
     get_ner,
     get_rag,
+    get_recsys_vector_db,
     get_semantic_search,
     get_vector_db,
     ensure_services_initialized,
@@ -30,6 +31,7 @@ from app.schemas.common import PingResponse
 
 import app.db_models  # noqa: F401  # гарантируем регистрацию моделей SQLAlchemy
 
+from .ml.nlp.sharded_vector_db import ShardedVectorDB
 from .ml.nlp.tasks import reindex_tasks
 from .ml.recsys.tasks import train_collaborative_filtering_model
 
@@ -66,6 +68,10 @@ async def lifespan(app: FastAPI):
         app.state.drift_detector = get_drift_detector()
         app.state.redis_client = get_redis()
 
+        # Индексы меняются и в Celery воркерах: реплика API доигрывает их журнал изменений в фоне
+        for vector_db in (app.state.vector_db, get_recsys_vector_db()):
+            vector_db.start_following()
+
         # Запуск warmup LLM в фоне через Celery (не блокирует запуск API)
         try:
             from app.ml.nlp.tasks import warmup_llm
@@ -106,6 +112,27 @@ async def lifespan(app: FastAPI):
                 except Exception as e:
                     logger.warning(f"Ошибка при отмене задачи '{task_name}': {e}")
         
+        # Останавливаем слежение за журналами индексов до закрытия Redis
+        for vector_db in (get_vector_db(), get_recsys_vector_db()):
+            try:
+                await vector_db.stop_following()
+            except Exception as e:
+                logger.warning(f"Ошибка при остановке синхронизации индекса: {e}")
+
+        # Закрываем соединения с шардами поиска и останавливаем запущенные этим процессом
+        try:
+            vector_db = get_vector_db()
+            if isinstance(vector_db, ShardedVectorDB):
+                vector_db.close()
+        except Exception as e:
+            logger.warning(f"Ошибка при остановке шардов индекса: {e}")
+
+        # Останавливаем процессы кодирования эмбеддингов
+        try:
+            get_embedding().close()
+        except Exception as e:
+            logger.warning(f"Ошибка при остановке пула эмбеддингов: {e}")
+
         # Закрываем Redis
         logger.info("Закрытие соединения с Redis...")
         try:
@@ -185,7 +212,7 @@ async def _get_model_health(app: FastAPI) -> dict[str, dict[str, object]]:
         "vector_db": {
             "ready": vector_db_ready,
             "dimension": getattr(vector_db, "dim", None),
-            "indexed_items": len(getattr(vector_db, "ids", [])) if vector_db is not None else None,
+            "indexed_items": await vector_db.size() if vector_db is not None else None,
         },
         "semantic_search": {
             "ready": semantic_search_ready,
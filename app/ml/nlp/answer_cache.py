@@ -0,0 +1,86 @@
+"""
+Семантический кеш ответов RAG: поиск ранее отвеченных вопросов по близости эмбеддингов.
+"""
+
+from __future__ import annotations
+
+import itertools
+import time
+from typing import Any
+
+import faiss
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """Ответы RAG в маленьком точном FAISS индексе по нормализованным эмбеддингам вопросов.
+
+    Ответ отдаётся на новый вопрос, если косинусная близость к сохранённому не ниже
+    threshold, совпадает top_k, а поколение поискового индекса не менялось
+    (иначе источники могли устареть). Старейшие записи вытесняются при
+    превышении max_entries. Работает в event loop одного процесса.
+    """
+
+    def __init__(self, dim: int, threshold: float, max_entries: int, ttl: float, neighbors: int = 4) -> None:
+        self.dim = dim
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.neighbors = neighbors
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        # метка -> (ответ с источниками, top_k, поколение индекса, срок годности); порядок вставки = порядок вытеснения
+        self._entries: dict[int, tuple[dict[str, Any], int, int | None, float]] = {}
+        self._labels = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, embedding: np.ndarray, top_k: int, generation: int | None) -> dict[str, Any] | None:
+        """Вернуть ответ на самый близкий подходящий вопрос или None."""
+        if not self._entries:
+            return None
+
+        query = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        similarities, labels = self.index.search(query, min(self.neighbors, self.index.ntotal))
+        now = time.monotonic()
+        stale: list[int] = []
+        answer = None
+        for similarity, label in zip(similarities[0].tolist(), labels[0].tolist()):
+            if label < 0 or similarity < self.threshold:
+                break
+            response, entry_top_k, entry_generation, expires_at = self._entries[label]
+            if entry_generation != generation or expires_at <= now:
+                stale.append(label)
+                continue
+            if entry_top_k == top_k:
+                answer = response
+                break
+
+        self._remove(stale)
+        return answer
+
+    def store(self, embedding: np.ndarray, top_k: int, generation: int | None, response: dict[str, Any]) -> None:
+        """Запомнить ответ на вопрос; источники хранятся внутри response."""
+        if self.max_entries <= 0:
+            return
+
+        label = next(self._labels)
+        self.index.add_with_ids(
+            np.asarray(embedding, dtype=np.float32).reshape(1, -1),
+            np.array([label], dtype=np.int64),
+        )
+        self._entries[label] = (dict(response), top_k, generation, time.monotonic() + self.ttl)
+        if len(self._entries) > self.max_entries:
+            self._remove(list(itertools.islice(self._entries, len(self._entries) - self.max_entries)))
+
+    def clear(self) -> None:
+        """Сбросить все сохранённые ответы."""
+        self.index.reset()
+        self._entries.clear()
+
+    def _remove(self, labels: list[int]) -> None:
+        if not labels:
+            return
+        for label in labels:
+            del self._entries[label]
+        self.index.remove_ids(np.array(labels, dtype=np.int64))
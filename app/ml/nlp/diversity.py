@@ -0,0 +1,58 @@
+"""
+Диверсификация результатов поиска: maximal marginal relevance и схлопывание почти-дубликатов.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+
+def maximal_marginal_relevance(
+    relevance: np.ndarray,
+    vectors: np.ndarray,
+    top_k: int,
+    mmr_lambda: float = 0.7,
+    duplicate_threshold: float | None = None,
+) -> list[int]:
+    """Жадно выбрать top_k позиций кандидатов по MMR.
+
+    На каждом шаге берётся кандидат с максимумом
+    mmr_lambda * relevance - (1 - mmr_lambda) * max_sim, где max_sim — наибольшее
+    косинусное сходство с уже выбранными. Матрица сходств кандидатов считается
+    одним умножением, а max_sim обновляется одной строкой этой матрицы за шаг.
+    Кандидаты со сходством с выбранными не ниже duplicate_threshold отбрасываются
+    как почти-дубликаты, поэтому результат может быть короче top_k.
+
+    relevance — релевантность кандидатов в [0, 1], vectors — их нормализованные векторы.
+    """
+    count = len(relevance)
+    if count == 0 or top_k <= 0:
+        return []
+
+    similarities = vectors @ vectors.T
+    max_similarity = np.full(count, -np.inf, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    selected: list[int] = []
+
+    # Первый результат — самый релевантный, как и без диверсификации
+    candidate = int(np.argmax(relevance))
+    while True:
+        selected.append(candidate)
+        available[candidate] = False
+        max_similarity = np.maximum(max_similarity, similarities[candidate])
+        if duplicate_threshold is not None:
+            available &= max_similarity < duplicate_threshold
+        if len(selected) >= top_k or not available.any():
+            return selected
+
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+        candidate = int(np.argmax(np.where(available, scores, -np.inf)))
+
+
+def relevance_from_scores(scores: np.ndarray) -> np.ndarray:
+    """Привести score результатов (косинус, BM25 или RRF) к [0, 1] min-max нормировкой."""
+    scores = np.asarray(scores, dtype=np.float32)
+    spread = float(scores.max() - scores.min()) if scores.size else 0.0
+    if spread <= 0:
+        return np.ones_like(scores)
+    return (scores - scores.min()) / spread
@@ -0,0 +1,151 @@
+"""
+Двухуровневый кеш эмбеддингов текста: LRU в памяти процесса и Redis с payload в float16.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import redis.asyncio as redis
+from prometheus_client import Counter, REGISTRY
+
+
+def _get_or_create_counter(name: str, documentation: str, labelnames: list):
+    """Получить счётчик из реестра или создать, если он отсутствует."""
+    if name in REGISTRY._names_to_collectors:
+        return REGISTRY._names_to_collectors[name]
+    return Counter(name, documentation, labelnames)
+
+
+cache_requests_counter = _get_or_create_counter(
+    "ml_embedding_cache_requests_total",
+    "Embedding cache lookups by tier and result",
+    ["tier", "result"],
+)
+
+cache_evictions_counter = _get_or_create_counter(
+    "ml_embedding_cache_evictions_total",
+    "Embeddings evicted from the in-process LRU",
+    ["tier"],
+)
+
+
+class EmbeddingCache:
+    """Кеш текст -> эмбеддинг с ключом sha256(model_id, нормализованный текст).
+
+    В памяти хранится до max_entries векторов float32 в порядке LRU, в Redis —
+    сырые байты float16 с TTL. Значения из Redis поднимаются в память, промахи
+    обоих уровней заполняются через put_many. Ошибки Redis не роняют кодирование.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        dim: int,
+        max_entries: int,
+        redis_client: redis.Redis | None = None,
+        ttl: int = 7 * 24 * 3600,
+    ) -> None:
+        self.model_id = model_id
+        self.dim = dim
+        self.max_entries = max_entries
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self._entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, text: str) -> str:
+        digest = hashlib.sha256(f"{self.model_id}\0{text}".encode("utf-8")).hexdigest()
+        return f"emb:{digest}"
+
+    async def get_many(self, texts: list[str]) -> dict[str, np.ndarray]:
+        """Вернуть найденные эмбеддинги для нормализованных текстов."""
+        keys = {text: self.key(text) for text in texts}
+        found: dict[str, np.ndarray] = {}
+        with self._lock:
+            for text, key in keys.items():
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[text] = vector
+        cache_requests_counter.labels(tier="memory", result="hit").inc(len(found))
+        cache_requests_counter.labels(tier="memory", result="miss").inc(len(keys) - len(found))
+
+        missing = [text for text in keys if text not in found]
+        if self.redis_client is None or not missing:
+            return found
+
+        try:
+            payloads = await self.redis_client.mget([keys[text] for text in missing])
+        except Exception:
+            return found
+
+        restored: dict[str, np.ndarray] = {}
+        for text, payload in zip(missing, payloads):
+            if payload is None or len(payload) != self.dim * 2:
+                continue
+            vector = np.frombuffer(payload, dtype=np.float16).astype(np.float32)
+            # float16 немного сбивает норму, а индекс рассчитывает на единичные векторы
+            restored[text] = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        cache_requests_counter.labels(tier="redis", result="hit").inc(len(restored))
+        cache_requests_counter.labels(tier="redis", result="miss").inc(len(missing) - len(restored))
+
+        self._remember({keys[text]: vector for text, vector in restored.items()})
+        found.update(restored)
+        return found
+
+    def get(self, text: str) -> np.ndarray | None:
+        """Вернуть эмбеддинг нормализованного текста из памяти процесса без обращения к Redis."""
+        key = self.key(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+        cache_requests_counter.labels(tier="memory", result="miss" if vector is None else "hit").inc()
+        return vector
+
+    def put(self, text: str, vector: np.ndarray) -> None:
+        """Сохранить эмбеддинг только в памяти процесса; Redis заполняют асинхронные пути."""
+        self._remember({self.key(text): np.array(vector, dtype=np.float32, copy=True)})
+
+    async def put_many(self, embeddings: dict[str, np.ndarray]) -> None:
+        """Сохранить свежие эмбеддинги в оба уровня.
+
+        Векторы копируются: строки матрицы батча — view, и одна такая строка в LRU
+        держала бы в памяти весь батч.
+        """
+        if not embeddings:
+            return
+        keyed = {self.key(text): np.array(vector, dtype=np.float32, copy=True) for text, vector in embeddings.items()}
+        self._remember(keyed)
+        if self.redis_client is None:
+            return
+
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipeline:
+                for key, vector in keyed.items():
+                    await pipeline.setex(key, self.ttl, vector.astype(np.float16).tobytes())
+                await pipeline.execute()
+        except Exception:
+            return
+
+    def _remember(self, entries: dict[str, np.ndarray]) -> None:
+        if self.max_entries <= 0 or not entries:
+            return
+
+        evicted = 0
+        with self._lock:
+            for key, vector in entries.items():
+                self._entries[key] = vector
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted:
+            cache_evictions_counter.labels(tier="memory").inc(evicted)
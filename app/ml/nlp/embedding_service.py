@@ -4,27 +4,180 @@
 
 from __future__ import annotations
 
+import asyncio
+import itertools
+import logging
+import multiprocessing
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
 import numpy as np
+import redis.asyncio as redis
 import torch
 import time
 from sentence_transformers import SentenceTransformer
 
+from app.core import config
 from app.ml.base import BaseMLService
 from app.ml.metrics import MLMetricsCollector
+from .embedding_cache import EmbeddingCache
+from .encoder_pool import EncoderPool, resolve_workers
+from .micro_batcher import MicroBatcher
+from .onnx_text_encoder import OnnxTextEncoder, export_onnx, parity_check
+
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+ONNX_DIR = Path(__file__).parent.parent / "checkpoints"
 
 
 class EmbeddingService(BaseMLService):
-    """Сервис для получения эмбеддингов текста."""
+    """Сервис для получения эмбеддингов текста.
+
+    backend: torch — SentenceTransformer, onnx — экспортированный трансформер в
+    onnxruntime, onnx_int8 — то же с динамической int8 квантизацией весов.
+    Асинхронные методы сначала смотрят в кеш эмбеддингов (память + Redis), а
+    промахи при workers != 0 кодируют в пуле процессов вместо потока API.
+    Синхронный encode_one пользуется только памятью того же кеша.
+    """
 
-    def __init__(self) -> None:
-        self.metrics = MLMetricsCollector(self.__class__.__name__)
+    def __init__(
+        self,
+        backend: str | None = None,
+        redis_client: redis.Redis | None = None,
+        workers: int | None = None,
+    ) -> None:
+        self.backend = backend or config.EMBEDDING_BACKEND
+        self.metrics = MLMetricsCollector(f"{self.__class__.__name__}[{self.backend}]")
         load_start = time.perf_counter()
         self.model: SentenceTransformer = SentenceTransformer(
-            "sentence-transformers/all-MiniLM-L6-v2",
+            MODEL_NAME,
             device="cuda" if torch.cuda.is_available() else "cpu",
         )
+        self.onnx_encoder: OnnxTextEncoder | None = None
+        if self.backend != "torch":
+            self.onnx_encoder = self._load_onnx_encoder()
         self.metrics.record_load_time(time.perf_counter() - load_start)
         self.dimension = self.model.get_sentence_embedding_dimension() # Получаем размерность эмбеддингов модели (384 для all-MiniLM-L6-v2)
+        self.pool = self._start_pool(resolve_workers(config.EMBEDDING_WORKERS if workers is None else workers))
+        self.batcher = MicroBatcher(
+            self.pool.encode if self.pool else self.encode_batch,
+            max_batch_size=config.EMBEDDING_BATCH_MAX_SIZE,
+            max_wait_ms=config.EMBEDDING_BATCH_MAX_WAIT_MS,
+            model_name=self.__class__.__name__,
+        )
+        # Бэкенд входит в ключ: эмбеддинги torch и int8 близки, но не совпадают
+        self.cache = EmbeddingCache(
+            f"{MODEL_NAME}:{self.backend}",
+            self.dimension,
+            max_entries=config.EMBEDDING_CACHE_SIZE,
+            redis_client=redis_client,
+            ttl=config.EMBEDDING_CACHE_TTL_SECONDS,
+        )
+
+    def _start_pool(self, workers: int) -> EncoderPool | None:
+        if workers <= 0:
+            return None
+        if multiprocessing.current_process().daemon:
+            # Дочерние процессы Celery prefork демонические и не могут порождать свои процессы
+            logger.info("Embedding worker pool is disabled in daemonic process %s", multiprocessing.current_process().name)
+            return None
+
+        logger.info("Starting %d embedding worker processes", workers)
+        return EncoderPool(workers, self.dimension, self.backend, chunk_size=config.EMBEDDING_POOL_CHUNK_SIZE)
+
+    def close(self) -> None:
+        """Остановить пул процессов кодирования, если он запущен."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def _load_onnx_encoder(self) -> OnnxTextEncoder | None:
+        """Экспортировать модель при первом запуске и сверить эмбеддинги с torch.
+
+        При ошибке экспорта или расхождении ниже EMBEDDING_ONNX_MIN_COSINE сервис
+        остаётся на torch.
+        """
+        onnx_dir = Path(config.EMBEDDING_ONNX_DIR) if config.EMBEDDING_ONNX_DIR else ONNX_DIR
+        fp32_path = onnx_dir / f"{MODEL_NAME.rsplit('/', 1)[-1]}.onnx"
+        int8_path = fp32_path.with_name(f"{fp32_path.stem}-int8.onnx") if self.backend == "onnx_int8" else None
+        try:
+            model_path = export_onnx(self.model, fp32_path, int8_path)
+            encoder = OnnxTextEncoder(model_path, self.model.tokenizer, self.model.max_seq_length)
+            min_cosine = parity_check(self.model, encoder)
+        except Exception as exc:
+            logger.error("ONNX text encoder is unavailable, falling back to torch: %s", exc, exc_info=True)
+            self.backend = "torch"
+            return None
+
+        if min_cosine < config.EMBEDDING_ONNX_MIN_COSINE:
+            logger.error(
+                "ONNX text encoder parity check failed (min cosine %.4f < %.4f), falling back to torch",
+                min_cosine,
+                config.EMBEDDING_ONNX_MIN_COSINE,
+            )
+            self.backend = "torch"
+            return None
+
+        logger.info("Using %s text encoder %s (min cosine vs torch %.4f)", self.backend, model_path, min_cosine)
+        return encoder
+
+    def _encode(self, texts: str | list[str]) -> np.ndarray:
+        if self.onnx_encoder is None:
+            return np.asarray(
+                self.model.encode(
+                    texts,
+                    batch_size=1 if isinstance(texts, str) else len(texts),
+                    convert_to_numpy=True,
+                    normalize_embeddings=True,
+                ),
+                dtype=np.float32,
+            )
+        if isinstance(texts, str):
+            return self.onnx_encoder.encode([texts])[0]
+        return self.onnx_encoder.encode(texts)
+
+    def _token_lengths(self, texts: list[str]) -> np.ndarray:
+        input_ids = self.model.tokenizer(
+            texts,
+            truncation=True,
+            max_length=self.model.max_seq_length,
+        )["input_ids"]
+        return np.fromiter((len(ids) for ids in input_ids), dtype=np.int64, count=len(texts))
+
+    @staticmethod
+    def _length_buckets(lengths: np.ndarray, max_size: int, max_tokens: int) -> list[list[int]]:
+        """Сгруппировать позиции текстов по возрастанию длины в батчи.
+
+        Батч закрывается, когда в нём max_size текстов или когда текст с паддингом
+        до самого длинного (последнего) превысил бы max_tokens токенов.
+        """
+        buckets: list[list[int]] = []
+        bucket: list[int] = []
+        for position in np.argsort(lengths, kind="stable").tolist():
+            if bucket and (len(bucket) >= max_size or (len(bucket) + 1) * lengths[position] > max_tokens):
+                buckets.append(bucket)
+                bucket = []
+            bucket.append(position)
+        if bucket:
+            buckets.append(bucket)
+        return buckets
+
+    def _encode_bucketed(self, texts: list[str]) -> np.ndarray:
+        """Закодировать тексты батчами близкой длины и вернуть эмбеддинги в исходном порядке."""
+        if len(texts) == 1:
+            return self._encode(texts)
+
+        result = np.empty((len(texts), self.dimension), dtype=np.float32)
+        buckets = self._length_buckets(
+            self._token_lengths(texts),
+            config.EMBEDDING_BUCKET_MAX_SIZE,
+            config.EMBEDDING_BUCKET_MAX_TOKENS,
+        )
+        for bucket in buckets:
+            result[bucket] = self._encode([texts[position] for position in bucket])
+        return result
 
     @staticmethod
     def _normalize_text(text: str) -> str:
@@ -38,45 +191,74 @@ class EmbeddingService(BaseMLService):
         return normalized_text
 
     def encode_one(self, text: str) -> np.ndarray:
-        """Получить эмбеддинг для одного текста."""
+        """Получить эмбеддинг для одного текста, сначала из памяти кеша эмбеддингов."""
         try:
+            normalized_text = self._normalize_text(text)
+            cached = self.cache.get(normalized_text)
+            if cached is not None:
+                return cached
             with self.metrics.time_inference():
-                normalized_text = self._normalize_text(text)
-                result = np.asarray(
-                    self.model.encode(
-                        normalized_text,
-                        convert_to_numpy=True,
-                        normalize_embeddings=True,
-                    ),
-                    dtype=np.float32,
-                )
+                result = self._encode(normalized_text)
             self.metrics.record_success()
-            return result
         except Exception as e:
             self.metrics.record_error(type(e).__name__)
             raise
+        self.cache.put(normalized_text, result)
+        return result
 
-    def encode_batch(self, texts: list[str]) -> np.ndarray:
-        """Получить эмбеддинги для списка текстов."""
-        try:
-            with self.metrics.time_inference():
-                if not texts:
-                    raise ValueError("Список текстов не может быть пустым")
-
-                normalized_texts = [self._normalize_text(text) for text in texts]
-                result = np.asarray(
-                    self.model.encode(
-                        normalized_texts,
-                        convert_to_numpy=True,
-                        normalize_embeddings=True,
-                    ),
-                    dtype=np.float32,
-                )
-            self.metrics.record_success()
-            return result
-        except Exception as e:
-            self.metrics.record_error(type(e).__name__)
-            raise
+    async def encode_one_async(self, text: str) -> np.ndarray:
+        """Получить эмбеддинг для одного текста из кеша или через микробатчер, не блокируя event loop."""
+        # Ошибка валидации должна достаться только своему запросу, а не всему батчу
+        normalized_text = self._normalize_text(text)
+        cached = await self.cache.get_many([normalized_text])
+        if normalized_text in cached:
+            return cached[normalized_text]
+
+        result = await self.batcher.submit(normalized_text)
+        await self.cache.put_many({normalized_text: result})
+        return result
+
+    async def encode_batch_async(self, texts: list[str]) -> np.ndarray:
+        """Получить эмбеддинги для списка текстов, кодируя в потоке только промахи кеша."""
+        if not texts:
+            raise ValueError("Список текстов не может быть пустым")
+
+        normalized_texts = [self._normalize_text(text) for text in texts]
+        found = await self.cache.get_many(list(dict.fromkeys(normalized_texts)))
+        missing = [text for text in dict.fromkeys(normalized_texts) if text not in found]
+        if missing:
+            encode = self.pool.encode if self.pool else self.encode_batch
+            encoded = dict(zip(missing, await asyncio.to_thread(encode, missing)))
+            await self.cache.put_many(encoded)
+            found.update(encoded)
+        return np.stack([found[text] for text in normalized_texts])
+
+    def encode_batch(self, texts: Iterable[str]) -> np.ndarray:
+        """Получить эмбеддинги для списка или генератора текстов в исходном порядке."""
+        chunks = list(self.encode_stream(texts))
+        if not chunks:
+            self.metrics.record_error(ValueError.__name__)
+            raise ValueError("Список текстов не может быть пустым")
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+    def encode_stream(self, texts: Iterable[str], window: int | None = None) -> Iterator[np.ndarray]:
+        """Кодировать тексты окнами по window штук, отдавая эмбеддинги каждого окна по порядку.
+
+        Из источника читается только текущее окно, поэтому генератор любой длины
+        обрабатывается с ограниченной памятью.
+        """
+        iterator = iter(texts)
+        window = window or config.EMBEDDING_STREAM_WINDOW
+        while chunk := list(itertools.islice(iterator, window)):
+            try:
+                with self.metrics.time_inference():
+                    normalized_texts = [self._normalize_text(text) for text in chunk]
+                    result = self._encode_bucketed(normalized_texts)
+                self.metrics.record_success()
+            except Exception as e:
+                self.metrics.record_error(type(e).__name__)
+                raise
+            yield result
 
     def similarity(self, vec1: np.ndarray, vec2: np.ndarray) -> float:
         """Вычислить косинусное сходство между двумя векторами."""
@@ -0,0 +1,186 @@
+"""
+Пул процессов для кодирования текстов вне GIL процесса API.
+"""
+
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# Состояние процесса-воркера: свой EmbeddingService и подключённые сегменты общей памяти
+_worker_service = None
+_worker_segments: dict[str, SharedMemory] = {}
+
+
+def resolve_workers(workers: int) -> int:
+    """Число воркеров пула: отрицательное значение означает по одному на ядро."""
+    return (os.cpu_count() or 1) if workers < 0 else workers
+
+
+def _embedding_service(backend: str) -> Any:
+    import torch
+
+    from .embedding_service import EmbeddingService
+
+    # Параллелизм даёт число процессов, внутри процесса потоки только толкаются за ядра
+    torch.set_num_threads(1)
+    return EmbeddingService(backend=backend, workers=0)
+
+
+def _init_worker(backend: str, factory: Callable[[str], Any]) -> None:
+    global _worker_service
+    _worker_service = factory(backend)
+
+
+def _encode_into(slot_name: str, texts: list[str]) -> int:
+    """Закодировать тексты и записать эмбеддинги в сегмент общей памяти слота."""
+    segment = _worker_segments.get(slot_name)
+    if segment is None:
+        segment = _worker_segments[slot_name] = SharedMemory(name=slot_name)
+    embeddings = _worker_service.encode_batch(texts)
+    np.ndarray(embeddings.shape, dtype=np.float32, buffer=segment.buf)[:] = embeddings
+    return len(texts)
+
+
+class EncoderPool:
+    """Пул spawn-процессов, каждый со своей копией модели.
+
+    Тексты уходят воркерам через pickle, а эмбеддинги возвращаются через
+    заранее выделенные слоты общей памяти на chunk_size строк, без
+    сериализации массивов. Слотов вдвое больше, чем воркеров: пока один
+    батч копируется из слота, воркер уже пишет следующий. Большой батч
+    режется на чанки и считается всеми воркерами параллельно.
+
+    Методы потокобезопасны и блокируют вызывающий поток, поэтому из
+    event loop их вызывают через asyncio.to_thread.
+
+    Если воркер умирает (OOM, segfault), ProcessPoolExecutor ломается целиком:
+    пул пересоздаётся, а батч повторяется один раз. factory создаёт в воркере
+    объект с encode_batch, по умолчанию EmbeddingService без своего пула.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        dim: int,
+        backend: str,
+        chunk_size: int = 256,
+        factory: Callable[[str], Any] = _embedding_service,
+    ) -> None:
+        self.workers = workers
+        self.dim = dim
+        self.chunk_size = chunk_size
+        self._backend = backend
+        self._factory = factory
+        self._restart_lock = threading.Lock()
+        self._executor = self._start_executor()
+        self._segments = [
+            SharedMemory(create=True, size=chunk_size * dim * np.dtype(np.float32).itemsize)
+            for _ in range(workers * 2)
+        ]
+        self._free_slots: queue.Queue[SharedMemory] = queue.Queue()
+        for segment in self._segments:
+            self._free_slots.put(segment)
+
+    def _start_executor(self) -> ProcessPoolExecutor:
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self._backend, self._factory),
+        )
+        # Запускаем воркеры сразу: загрузка модели занимает секунды и не должна достаться первым запросам
+        for _ in range(self.workers):
+            executor.submit(os.getpid)
+        return executor
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        """Заменить сломанный пул новым, если другой поток ещё не успел это сделать."""
+        with self._restart_lock:
+            if self._executor is not broken:
+                return
+            logger.warning("Embedding worker pool is broken, restarting %d workers", self.workers)
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._start_executor()
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Получить эмбеддинги нормализованных текстов в исходном порядке."""
+        executor = self._executor
+        try:
+            return self._encode(executor, texts)
+        except BrokenProcessPool:
+            self._restart(executor)
+
+        # Повторяем один раз: если батч снова уронит воркер, ошибка уйдёт вызывающему, а пул останется рабочим
+        executor = self._executor
+        try:
+            return self._encode(executor, texts)
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+
+    def _encode(self, executor: ProcessPoolExecutor, texts: list[str]) -> np.ndarray:
+        result = np.empty((len(texts), self.dim), dtype=np.float32)
+        if not texts:
+            return result
+        offsets = range(0, len(texts), self.chunk_size)
+        done = threading.Event()
+        pending = [len(offsets)]
+        errors: list[BaseException] = []
+        lock = threading.Lock()
+
+        def finish(chunks: int = 1) -> None:
+            with lock:
+                pending[0] -= chunks
+                if not pending[0]:
+                    done.set()
+
+        def collect(offset: int, slot: SharedMemory, future: Future) -> None:
+            # Колбэк копирует результат и сразу возвращает слот, иначе большой батч занял бы все слоты
+            try:
+                count = future.result()
+                result[offset:offset + count] = np.ndarray((count, self.dim), dtype=np.float32, buffer=slot.buf)
+            except BaseException as exc:
+                errors.append(exc)
+            finally:
+                self._free_slots.put(slot)
+                finish()
+
+        for position, offset in enumerate(offsets):
+            slot = self._free_slots.get()
+            try:
+                future = executor.submit(_encode_into, slot.name, texts[offset:offset + self.chunk_size])
+            except BaseException as exc:
+                # Пул уже сломан: неотправленные чанки сразу считаются завершёнными
+                errors.append(exc)
+                self._free_slots.put(slot)
+                finish(len(offsets) - position)
+                break
+            future.add_done_callback(lambda future, offset=offset, slot=slot: collect(offset, slot, future))
+
+        done.wait()
+        if errors:
+            raise errors[0]
+        return result
+
+    def close(self) -> None:
+        """Остановить воркеры и освободить общую память."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        for segment in self._segments:
+            segment.close()
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
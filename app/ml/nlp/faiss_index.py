@@ -0,0 +1,135 @@
+"""
+Фабрика FAISS индексов для VectorDB.
+"""
+
+from __future__ import annotations
+
+import math
+
+import faiss
+
+from app.core import config
+
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+COMPRESSIONS = ("none", "fp16", "sq8", "pq")
+
+
+def _ivf_nlist(n_train: int) -> int:
+    """Подобрать число кластеров IVF по размеру обучающей выборки."""
+    if config.VECTOR_DB_IVF_NLIST > 0:
+        return config.VECTOR_DB_IVF_NLIST
+    # Эвристика FAISS: ~4*sqrt(N) кластеров, но не меньше ~39 точек на кластер
+    return max(1, min(int(4 * math.sqrt(n_train)), n_train // 39))
+
+
+def _pq_subquantizers(dim: int) -> int:
+    """Подобрать число субквантизаторов PQ (~8 измерений на код)."""
+    for m in range(dim // 8, 0, -1):
+        if dim % m == 0:
+            return m
+    raise ValueError(f"Размерность {dim} слишком мала для IVF-PQ индекса")
+
+
+def _encoding(compression: str, dim: int) -> str:
+    """Формат хранения векторов: float32, float16, 8-битная скалярная или продуктовая квантизация."""
+    if compression == "none":
+        return "Flat"
+    if compression == "fp16":
+        return "SQfp16"
+    if compression == "sq8":
+        return "SQ8"
+    if compression == "pq":
+        return f"PQ{_pq_subquantizers(dim)}"
+    raise ValueError(f"Неизвестный режим сжатия: {compression}. Доступны: {', '.join(COMPRESSIONS)}")
+
+
+def requires_training(compression: str) -> bool:
+    """Нужна ли обучающая выборка для кодирования векторов в плоском индексе."""
+    return compression in ("sq8", "pq")
+
+
+def index_description(index_type: str, dim: int, n_train: int = 0, compression: str = "none") -> str:
+    """Собрать строку для faiss.index_factory."""
+    encoding = _encoding(compression, dim)
+    if index_type == "flat":
+        return encoding
+    if index_type == "hnsw":
+        return f"HNSW{config.VECTOR_DB_HNSW_M},{encoding}"
+    if index_type == "ivf_flat":
+        return f"IVF{_ivf_nlist(n_train)},{encoding}"
+    if index_type == "ivf_pq":
+        return f"IVF{_ivf_nlist(n_train)},PQ{_pq_subquantizers(dim)}"
+    raise ValueError(f"Неизвестный тип индекса: {index_type}. Доступны: {', '.join(INDEX_TYPES)}")
+
+
+def build_index(
+    index_type: str,
+    dim: int,
+    n_train: int = 0,
+    compression: str = "none",
+) -> faiss.IndexIDMap2:
+    """Создать пустой индекс со стабильными int64-метками для косинусной близости."""
+    index = faiss.index_factory(
+        dim,
+        f"IDMap2,{index_description(index_type, dim, n_train, compression)}",
+        faiss.METRIC_INNER_PRODUCT,
+    )
+
+    base = faiss.downcast_index(index.index)
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = config.VECTOR_DB_HNSW_EF_SEARCH
+    elif isinstance(base, faiss.IndexIVF):
+        base.nprobe = config.VECTOR_DB_IVF_NPROBE
+    for component in (base, getattr(base, "storage", None)):
+        component = faiss.downcast_index(component) if component is not None else None
+        if isinstance(component, (faiss.IndexIVFPQ, faiss.IndexPQ)):
+            # Полисемантическое обучение нужно только для поиска по Хэммингу и очень медленное
+            component.do_polysemous_training = False
+
+    return index
+
+
+def train_index(index: faiss.IndexIDMap2, vectors) -> None:
+    """Обучить индекс (для IVF) и включить прямой маппинг для reconstruct."""
+    if not index.is_trained:
+        index.train(vectors)
+
+    base = faiss.downcast_index(index.index)
+    if isinstance(base, faiss.IndexIVF):
+        base.make_direct_map()
+
+
+def supports_remove(index: faiss.IndexIDMap2) -> bool:
+    """Поддерживает ли индекс корректное удаление через IndexIDMap2.remove_ids."""
+    return isinstance(faiss.downcast_index(index.index), faiss.IndexFlatCodes)
+
+
+def read_index_mmap(path: str) -> faiss.IndexIDMap2:
+    """Открыть снапшот индекса через mmap: страницы файла разделяются между процессами узла."""
+    try:
+        # Коды плоских и HNSW индексов читаются прямо из отображённого файла без копирования
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        # Списки IVF отображаются только через OnDiskInvertedLists
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+
+def search_parameters(
+    index: faiss.IndexIDMap2,
+    nprobe: int | None = None,
+    ef_search: int | None = None,
+    selector: faiss.IDSelector | None = None,
+) -> faiss.SearchParameters | None:
+    """Параметры поиска для одного запроса: nprobe для IVF, efSearch для HNSW и фильтр по меткам."""
+    base = faiss.downcast_index(index.index)
+    params = None
+    if isinstance(base, faiss.IndexIVF) and (nprobe is not None or selector is not None):
+        params = faiss.SearchParametersIVF(nprobe=nprobe or base.nprobe)
+    elif isinstance(base, faiss.IndexHNSW) and (ef_search is not None or selector is not None):
+        params = faiss.SearchParametersHNSW(efSearch=ef_search or base.hnsw.efSearch)
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    if params is not None and selector is not None:
+        params.sel = selector
+    return params
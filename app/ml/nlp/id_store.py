@@ -0,0 +1,353 @@
+"""
+Компактное хранилище соответствия item_id <-> int64-метка FAISS для VectorDB.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+
+_EMPTY = -1 # Свободная ячейка хеш-таблицы
+_DELETED = -2 # Ячейка удалённого ключа: поиск проходит её, вставка может переиспользовать
+_MIN_CAPACITY = 1024
+_MAX_LOAD = 0.7
+_HEADER_FIELDS = 5
+_FNV_OFFSET = 0xCBF29CE484222325
+_FNV_PRIME = 0x100000001B3
+_UINT64_MASK = (1 << 64) - 1
+
+
+def _hash_id(item_id: str) -> int:
+    """Стабильный между процессами 64-битный FNV-1a хеш item_id (встроенный hash() солится)."""
+    value = _FNV_OFFSET
+    for byte in item_id.encode("utf-8"):
+        value = ((value ^ byte) * _FNV_PRIME) & _UINT64_MASK
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _encode(item_ids: list[str]) -> tuple[list[bytes], np.ndarray]:
+    """UTF-8 байты item_id и их длины."""
+    encoded = [item_id.encode("utf-8") for item_id in item_ids]
+    return encoded, np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+
+
+def _hash_ids(encoded: list[bytes], lengths: np.ndarray) -> np.ndarray:
+    """Тот же FNV-1a хеш для пачки item_id: цикл идёт по позициям байт, а не по ключам."""
+    width = int(lengths.max()) if lengths.size else 0
+    matrix = np.array(encoded, dtype=f"S{max(width, 1)}").view(np.uint8).reshape(len(encoded), -1)
+
+    hashes = np.full(len(encoded), _FNV_OFFSET, dtype=np.uint64)
+    prime = np.uint64(_FNV_PRIME)
+    for column in range(width):
+        active = lengths > column
+        hashes[active] = (hashes[active] ^ matrix[active, column]) * prime
+    return hashes.view(np.int64)
+
+
+def _capacity_for(size: int) -> int:
+    """Степень двойки, при которой таблица заполнена не больше чем наполовину."""
+    capacity = _MIN_CAPACITY
+    while capacity < size * 2:
+        capacity *= 2
+    return capacity
+
+
+class IdStore:
+    """Соответствие item_id <-> метка на int64 массивах numpy вместо словарей Python.
+
+    item_id -> метка: хеш-таблица с открытой адресацией (массивы хешей и меток),
+    проверка принадлежности за O(1). Метка -> item_id: массивы смещений и длин
+    в общем буфере UTF-8 байт. Всё хранилище сериализуется в один блоб, а
+    from_bytes открывает его без копирования; копия делается при первом изменении.
+    """
+
+    def __init__(self) -> None:
+        self._hashes = np.zeros(_MIN_CAPACITY, dtype=np.int64)
+        self._slots = np.full(_MIN_CAPACITY, _EMPTY, dtype=np.int64) # Метка в ячейке хеш-таблицы
+        self._used = 0 # Занятые ячейки, включая удалённые
+        self._size = 0 # Живые ключи
+        self._starts = np.zeros(0, dtype=np.int64) # Смещение item_id метки в буфере
+        self._lengths = np.zeros(0, dtype=np.int32) # Длина item_id метки в байтах, -1 — метка не занята
+        self._data: bytearray | memoryview = bytearray()
+        self._writable = True
+
+    @classmethod
+    def from_mapping(cls, label_to_id: dict[int, str]) -> IdStore:
+        """Построить хранилище из словаря метка -> item_id (старый формат метаданных)."""
+        store = cls()
+        store.set_many([str(item_id) for item_id in label_to_id.values()], list(label_to_id))
+        return store
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, item_id: object) -> bool:
+        return self.get(str(item_id)) is not None
+
+    def get(self, item_id: str) -> int | None:
+        """Метка документа или None."""
+        slot, found = self._probe(_hash_id(item_id), item_id)
+        return int(self._slots[slot]) if found else None
+
+    def id_of(self, label: int) -> str | None:
+        """item_id по метке или None, если метка удалена."""
+        if label < 0 or label >= self._lengths.size or self._lengths[label] < 0:
+            return None
+        return self._id_at(label)
+
+    def ids_of(self, labels) -> list[str]:
+        """item_id для списка живых меток."""
+        return [self._id_at(int(label)) for label in labels]
+
+    def alive_mask(self, labels: np.ndarray) -> np.ndarray:
+        """Векторная проверка, какие метки (включая -1 из FAISS) принадлежат живым документам."""
+        labels = np.asarray(labels, dtype=np.int64)
+        valid = (labels >= 0) & (labels < self._lengths.size)
+        mask = np.zeros(labels.shape, dtype=bool)
+        mask[valid] = self._lengths[labels[valid]] >= 0
+        return mask
+
+    def live_labels(self) -> np.ndarray:
+        """Метки всех живых документов по возрастанию."""
+        return np.flatnonzero(self._lengths >= 0).astype(np.int64)
+
+    def ids(self) -> list[str]:
+        """Все живые item_id в порядке меток."""
+        return self.ids_of(self.live_labels())
+
+    def set(self, item_id: str, label: int) -> int | None:
+        """Назначить документу метку; вернуть предыдущую метку, если документ уже был."""
+        self._ensure_writable()
+        key_hash = _hash_id(item_id)
+        slot, found = self._probe(key_hash, item_id)
+        previous_label = None
+        if found:
+            previous_label = int(self._slots[slot])
+            self._lengths[previous_label] = -1
+        else:
+            if self._slots[slot] == _EMPTY:
+                self._used += 1
+            self._size += 1
+            self._hashes[slot] = key_hash
+
+        self._slots[slot] = label
+        self._store_ids(np.array([label], dtype=np.int64), *_encode([item_id]))
+        if self._used > len(self._slots) * _MAX_LOAD:
+            self._rehash(_capacity_for(self._size))
+        return previous_label
+
+    def set_many(self, item_ids: list[str], labels) -> list[int]:
+        """Назначить метки пачке документов векторно; вернуть заменённые метки."""
+        if len(set(item_ids)) != len(item_ids):
+            # Повтор item_id внутри пачки: последовательная вставка сохраняет порядок замен
+            previous = (self.set(item_id, int(label)) for item_id, label in zip(item_ids, labels))
+            return [label for label in previous if label is not None]
+
+        self._ensure_writable()
+        labels = np.asarray(labels, dtype=np.int64)
+        encoded, lengths = _encode(item_ids)
+        hashes = _hash_ids(encoded, lengths)
+        found_slots = self._lookup_many(hashes)
+
+        replaced: list[int] = []
+        existing = np.flatnonzero(found_slots >= 0)
+        for position in existing.tolist():
+            slot = int(found_slots[position])
+            previous_label = int(self._slots[slot])
+            if self._id_at(previous_label) != item_ids[position]:
+                # Коллизия 64-битных хешей: обрабатываем ключ обычным пробированием
+                previous_label = self.set(item_ids[position], int(labels[position]))
+                if previous_label is not None:
+                    replaced.append(previous_label)
+                continue
+            self._lengths[previous_label] = -1
+            self._slots[slot] = labels[position]
+            replaced.append(previous_label)
+
+        new = np.flatnonzero(found_slots < 0)
+        if new.size:
+            if self._used + new.size > len(self._slots) * _MAX_LOAD:
+                self._rehash(_capacity_for(self._size + new.size))
+            self._insert_many(hashes[new], labels[new])
+        self._store_ids(labels, encoded, lengths)
+        return replaced
+
+    def pop(self, item_id: str) -> int | None:
+        """Удалить документ; вернуть его метку или None."""
+        slot, found = self._probe(_hash_id(item_id), item_id)
+        if not found:
+            return None
+
+        self._ensure_writable()
+        label = int(self._slots[slot])
+        self._slots[slot] = _DELETED
+        self._lengths[label] = -1
+        self._size -= 1
+        return label
+
+    def compact(self) -> bool:
+        """Убрать из буфера байты удалённых и заменённых item_id, если их накопилось больше живых."""
+        if len(self._data) <= 2 * int(self._lengths[self._lengths > 0].sum()) + 4096:
+            return False
+        self._compact_data()
+        return True
+
+    def to_bytes(self) -> bytes:
+        """Сериализовать хранилище в один блоб: заголовок и сырые буферы массивов."""
+        header = np.array(
+            [len(self._slots), self._used, self._size, self._lengths.size, len(self._data)],
+            dtype=np.int64,
+        )
+        return b"".join(
+            [
+                header.tobytes(),
+                self._hashes.tobytes(),
+                self._slots.tobytes(),
+                self._starts.tobytes(),
+                self._lengths.tobytes(),
+                bytes(self._data),
+            ]
+        )
+
+    @classmethod
+    def from_bytes(cls, payload: bytes) -> IdStore:
+        """Открыть сериализованное хранилище без копирования массивов."""
+        capacity, used, size, n_labels, data_length = np.frombuffer(payload, dtype=np.int64, count=_HEADER_FIELDS).tolist()
+        offset = _HEADER_FIELDS * 8
+
+        def view(dtype, count: int) -> np.ndarray:
+            nonlocal offset
+            array = np.frombuffer(payload, dtype=dtype, count=count, offset=offset)
+            offset += array.nbytes
+            return array
+
+        store = cls.__new__(cls)
+        store._hashes = view(np.int64, capacity)
+        store._slots = view(np.int64, capacity)
+        store._starts = view(np.int64, n_labels)
+        store._lengths = view(np.int32, n_labels)
+        store._data = memoryview(payload)[offset:offset + data_length]
+        store._used = used
+        store._size = size
+        store._writable = False
+        return store
+
+    def _ensure_writable(self) -> None:
+        """Скопировать массивы, открытые из блоба только для чтения, перед первым изменением."""
+        if self._writable:
+            return
+        self._hashes = self._hashes.copy()
+        self._slots = self._slots.copy()
+        self._starts = self._starts.copy()
+        self._lengths = self._lengths.copy()
+        self._data = bytearray(self._data)
+        self._writable = True
+
+    def _id_at(self, label: int) -> str:
+        start = int(self._starts[label])
+        return bytes(self._data[start:start + int(self._lengths[label])]).decode("utf-8")
+
+    def _probe(self, key_hash: int, item_id: str) -> tuple[int, bool]:
+        """Найти ячейку ключа линейным пробированием; иначе вернуть ячейку для вставки."""
+        mask = len(self._slots) - 1
+        slot = key_hash & mask
+        first_deleted = -1
+        while True:
+            label = int(self._slots[slot])
+            if label == _EMPTY:
+                return (first_deleted if first_deleted >= 0 else slot), False
+            if label == _DELETED:
+                if first_deleted < 0:
+                    first_deleted = slot
+            elif self._hashes[slot] == key_hash and self._id_at(label) == item_id:
+                return slot, True
+            slot = (slot + 1) & mask
+
+    def _lookup_many(self, hashes: np.ndarray) -> np.ndarray:
+        """Ячейки ключей с заданными хешами или -1; все ключи пробируются одновременно."""
+        mask = len(self._slots) - 1
+        result = np.full(hashes.size, -1, dtype=np.int64)
+        positions = hashes & mask
+        pending = np.arange(hashes.size)
+        while pending.size:
+            candidate_slots = positions[pending]
+            labels = self._slots[candidate_slots]
+            hit = (labels >= 0) & (self._hashes[candidate_slots] == hashes[pending])
+            result[pending[hit]] = candidate_slots[hit]
+            pending = pending[~(hit | (labels == _EMPTY))]
+            positions[pending] = (positions[pending] + 1) & mask
+        return result
+
+    def _insert_many(self, hashes: np.ndarray, labels: np.ndarray) -> None:
+        """Вставить новые ключи в свободные и удалённые ячейки раундами линейного пробирования."""
+        mask = len(self._slots) - 1
+        positions = hashes & mask
+        pending = np.arange(hashes.size)
+        while pending.size:
+            candidate_slots = positions[pending]
+            free = self._slots[candidate_slots] < 0
+            # В каждую свободную ячейку за раунд попадает первый претендент, остальные сдвигаются дальше
+            taken_slots, first = np.unique(candidate_slots[free], return_index=True)
+            winners = pending[free][first]
+            self._used += int((self._slots[taken_slots] == _EMPTY).sum())
+            self._slots[taken_slots] = labels[winners]
+            self._hashes[taken_slots] = hashes[winners]
+
+            placed = np.zeros(hashes.size, dtype=bool)
+            placed[winners] = True
+            pending = pending[~placed[pending]]
+            positions[pending] = (positions[pending] + 1) & mask
+        self._size += hashes.size
+
+    def _store_ids(self, labels: np.ndarray, encoded: list[bytes], lengths: np.ndarray) -> None:
+        """Дописать item_id в буфер и запомнить их смещения по меткам."""
+        max_label = int(labels.max())
+        if max_label >= self._lengths.size:
+            size = max(max_label + 1, 2 * self._lengths.size, _MIN_CAPACITY)
+            self._starts = np.concatenate([self._starts, np.zeros(size - self._starts.size, dtype=np.int64)])
+            self._lengths = np.concatenate([self._lengths, np.full(size - self._lengths.size, -1, dtype=np.int32)])
+
+        self._starts[labels] = len(self._data) + np.cumsum(lengths) - lengths
+        self._lengths[labels] = lengths
+        self._data += b"".join(encoded)
+
+    def _rehash(self, capacity: int) -> None:
+        """Перестроить хеш-таблицу без удалённых ячеек, вставляя все ключи векторно."""
+        live = self._slots >= 0
+        hashes = self._hashes[live]
+        labels = self._slots[live]
+        mask = capacity - 1
+
+        new_hashes = np.zeros(capacity, dtype=np.int64)
+        new_slots = np.full(capacity, _EMPTY, dtype=np.int64)
+        positions = hashes & mask
+        pending = np.arange(hashes.size)
+        while pending.size:
+            candidate_slots = positions[pending]
+            free = new_slots[candidate_slots] == _EMPTY
+            # В каждую свободную ячейку за раунд попадает первый претендент, остальные сдвигаются дальше
+            taken_slots, first = np.unique(candidate_slots[free], return_index=True)
+            winners = pending[free][first]
+            new_slots[taken_slots] = labels[winners]
+            new_hashes[taken_slots] = hashes[winners]
+
+            placed = np.zeros(hashes.size, dtype=bool)
+            placed[winners] = True
+            pending = pending[~placed[pending]]
+            positions[pending] = (positions[pending] + 1) & mask
+
+        self._hashes = new_hashes
+        self._slots = new_slots
+        self._used = int(live.sum())
+
+    def _compact_data(self) -> None:
+        """Убрать из буфера байты удалённых и заменённых item_id."""
+        self._ensure_writable()
+        live = np.flatnonzero(self._lengths >= 0)
+        lengths = self._lengths[live].astype(np.int64)
+        new_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]) if live.size else np.zeros(0, dtype=np.int64)
+        data = np.frombuffer(bytes(self._data), dtype=np.uint8)
+        # Индексы всех живых байт: начало каждого item_id плюс смещение внутри него
+        byte_index = np.repeat(self._starts[live] - new_starts, lengths) + np.arange(int(lengths.sum()))
+        self._data = bytearray(data[byte_index].tobytes())
+        self._starts[live] = new_starts
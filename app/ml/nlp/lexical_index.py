@@ -0,0 +1,109 @@
+"""
+Инвертированный индекс BM25 для лексического поиска рядом с VectorDB.
+"""
+
+from __future__ import annotations
+
+import heapq
+import math
+import re
+from collections import Counter
+from collections.abc import Iterable
+from operator import itemgetter
+
+
+# Слова с технологическими суффиксами остаются одним термом: "c++", "c#", "node.js", "asp.net"
+TOKEN_PATTERN = re.compile(r"[0-9a-zа-яё][0-9a-zа-яё_+#.\-]*")
+
+
+def tokenize(text: str) -> list[str]:
+    """Разбить текст на термы в нижнем регистре без завершающих точек и дефисов."""
+    return [token.rstrip(".-") for token in TOKEN_PATTERN.findall(text.lower())]
+
+
+class LexicalIndex:
+    """BM25 по документам VectorDB, ключ документа — item_id.
+
+    Изменяется под write-локом VectorDB, читается под read-локом.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self._postings: dict[str, dict[str, int]] = {} # терм -> item_id -> частота терма
+        self._documents: dict[str, dict[str, int]] = {} # item_id -> частоты термов документа
+        self._lengths: dict[str, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def __contains__(self, term: object) -> bool:
+        return term in self._postings
+
+    def has_document(self, item_id: str) -> bool:
+        return item_id in self._documents
+
+    def add(self, item_id: str, text: str) -> None:
+        """Проиндексировать текст документа, заменив прежнюю версию."""
+        self.remove(item_id)
+        frequencies = Counter(tokenize(text))
+        if not frequencies:
+            return
+
+        for term, frequency in frequencies.items():
+            self._postings.setdefault(term, {})[item_id] = frequency
+        self._documents[item_id] = dict(frequencies)
+        length = sum(frequencies.values())
+        self._lengths[item_id] = length
+        self._total_length += length
+
+    def remove(self, item_id: str) -> None:
+        """Убрать документ из индекса."""
+        frequencies = self._documents.pop(item_id, None)
+        if frequencies is None:
+            return
+
+        for term in frequencies:
+            postings = self._postings[term]
+            del postings[item_id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(item_id)
+
+    def search(self, query: str, top_k: int, allowed: Iterable[str] | None = None) -> list[tuple[str, float]]:
+        """Вернуть top_k пар (item_id, BM25) по термам запроса; allowed ограничивает документы."""
+        if not self._documents:
+            return []
+
+        allowed = set(allowed) if allowed is not None else None
+        total = len(self._documents)
+        average_length = self._total_length / total
+        scores: dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for item_id, frequency in postings.items():
+                if allowed is not None and item_id not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[item_id] / average_length)
+                scores[item_id] = scores.get(item_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return heapq.nlargest(top_k, scores.items(), key=itemgetter(1))
+
+    def to_state(self) -> dict[str, dict[str, int]]:
+        """Частоты термов по документам для снапшота VectorDB."""
+        return self._documents
+
+    @classmethod
+    def from_state(cls, documents: dict[str, dict[str, int]]) -> LexicalIndex:
+        index = cls()
+        for item_id, frequencies in documents.items():
+            for term, frequency in frequencies.items():
+                index._postings.setdefault(term, {})[item_id] = frequency
+            index._documents[item_id] = frequencies
+            length = sum(frequencies.values())
+            index._lengths[item_id] = length
+            index._total_length += length
+        return index
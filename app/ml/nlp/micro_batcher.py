@@ -0,0 +1,130 @@
+"""
+Динамический микробатчинг одиночных запросов к энкодеру.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections.abc import Callable
+
+import numpy as np
+from prometheus_client import Histogram, REGISTRY
+
+
+def _get_or_create_histogram(name: str, documentation: str, labelnames: list, buckets: list):
+    """Получить гистограмму из реестра или создать, если она отсутствует."""
+    if name in REGISTRY._names_to_collectors:
+        return REGISTRY._names_to_collectors[name]
+    return Histogram(name, documentation, labelnames, buckets=buckets)
+
+
+batch_size_histogram = _get_or_create_histogram(
+    "ml_micro_batch_size",
+    "Number of requests merged into one micro-batch",
+    ["model"],
+    buckets=[1, 2, 4, 8, 16, 32, 64, 128],
+)
+
+queue_wait_histogram = _get_or_create_histogram(
+    "ml_micro_batch_queue_wait_seconds",
+    "Time a request waits in the micro-batch queue before inference starts",
+    ["model"],
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1],
+)
+
+
+class MicroBatcher:
+    """Собирает конкурентные запросы в батч и выполняет один вызов encode_batch.
+
+    Батч отправляется, когда набралось max_batch_size запросов или с момента
+    первого из них прошло max_wait_ms. Пока батч считается в потоке, новые
+    запросы копятся в очереди и уходят следующим батчем. Очередь и воркер
+    привязаны к event loop, в котором был первый запрос.
+    """
+
+    def __init__(
+        self,
+        encode_batch: Callable[[list[str]], np.ndarray],
+        max_batch_size: int,
+        max_wait_ms: float,
+        model_name: str = "default",
+    ) -> None:
+        self.encode_batch = encode_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.model_name = model_name
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+
+    async def submit(self, text: str) -> np.ndarray:
+        """Поставить текст в очередь и дождаться его эмбеддинга."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        self._queue.put_nowait((text, future, time.perf_counter()))
+        return await future
+
+    async def close(self) -> None:
+        """Остановить воркер; запросы из очереди получают CancelledError."""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        while self._queue is not None and not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            future.cancel()
+        self._worker = None
+
+    async def _collect(self) -> list[tuple[str, asyncio.Future, float]]:
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            # Запросы, отменённые клиентом во время ожидания, не занимают место в батче
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                queue_wait_histogram.labels(model=self.model_name).observe(started - enqueued)
+            batch_size_histogram.labels(model=self.model_name).observe(len(batch))
+
+            try:
+                embeddings = await asyncio.to_thread(self.encode_batch, [text for text, _, _ in batch])
+            except asyncio.CancelledError:
+                for _, future, _ in batch:
+                    future.cancel()
+                raise
+            except Exception as exc:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+
+            for (_, future, _), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
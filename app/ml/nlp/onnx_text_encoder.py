@@ -0,0 +1,159 @@
+"""
+ONNX Runtime бэкенд текстового энкодера: экспорт трансформера SentenceTransformer,
+динамическая int8 квантизация и инференс с тем же mean pooling и нормализацией.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import onnxruntime as ort
+import torch
+from sentence_transformers import SentenceTransformer
+
+
+logger = logging.getLogger(__name__)
+
+INPUT_NAMES = ("input_ids", "attention_mask", "token_type_ids")
+PARITY_PROBE_TEXTS = (
+    "Подготовить отчёт по продажам за квартал",
+    "Fix the login redirect bug in the FastAPI auth router",
+    "Настроить резервное копирование PostgreSQL и проверить восстановление",
+    "Обновить зависимости Celery и Redis",
+)
+
+
+class _TransformerOutput(torch.nn.Module):
+    """Обёртка, возвращающая только last_hidden_state: pooling делается в numpy."""
+
+    def __init__(self, transformer: torch.nn.Module) -> None:
+        super().__init__()
+        self.transformer = transformer
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return self.transformer(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids,
+        )[0]
+
+
+def _write_atomically(path: Path, write: Callable[[str], None]) -> None:
+    """Записать файл через временный в той же директории и переименовать его в path.
+
+    Упавший или параллельный экспорт не оставляет по итоговому пути недописанную
+    модель, которую другой процесс принял бы за готовую.
+    """
+    descriptor, temporary_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(descriptor)
+    try:
+        write(temporary_path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.unlink(temporary_path)
+        raise
+
+
+def export_onnx(model: SentenceTransformer, fp32_path: Path | str, int8_path: Path | str | None = None) -> Path:
+    """Экспортировать трансформер модели в ONNX; с int8_path дополнительно квантизовать веса в int8.
+
+    Уже существующие файлы не пересоздаются, новые появляются по итоговому пути
+    только целиком. Возвращает путь к итоговой модели.
+    """
+    fp32_path = Path(fp32_path)
+    fp32_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if not fp32_path.exists():
+        transformer = model[0].auto_model.to("cpu").eval()
+        dummy = model.tokenizer(["onnx export"], return_tensors="pt")
+        inputs = tuple(dummy.get(name, torch.zeros_like(dummy["input_ids"])) for name in INPUT_NAMES)
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in (*INPUT_NAMES, "last_hidden_state")}
+
+        def export(path: str) -> None:
+            with torch.no_grad():
+                torch.onnx.export(
+                    _TransformerOutput(transformer),
+                    inputs,
+                    path,
+                    input_names=list(INPUT_NAMES),
+                    output_names=["last_hidden_state"],
+                    dynamic_axes=dynamic_axes,
+                    opset_version=17,
+                    dynamo=False,
+                )
+
+        _write_atomically(fp32_path, export)
+        logger.info("Exported text encoder to %s", fp32_path)
+
+    if int8_path is None:
+        return fp32_path
+
+    int8_path = Path(int8_path)
+    if not int8_path.exists():
+        # Импорт здесь: квантизации нужен пакет onnx, а для инференса хватает onnxruntime
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path.parent.mkdir(parents=True, exist_ok=True)
+        _write_atomically(
+            int8_path, lambda path: quantize_dynamic(str(fp32_path), path, weight_type=QuantType.QInt8)
+        )
+        logger.info("Quantized text encoder to %s", int8_path)
+    return int8_path
+
+
+class OnnxTextEncoder:
+    """Инференс трансформера через onnxruntime с mean pooling и L2 нормализацией, как у SentenceTransformer."""
+
+    def __init__(self, model_path: Path | str, tokenizer, max_seq_length: int, batch_size: int = 32) -> None:
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        self.tokenizer = tokenizer
+        self.max_seq_length = max_seq_length
+        self.batch_size = batch_size
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Получить нормализованные эмбеддинги float32 формы (len(texts), dim)."""
+        chunks = [self._encode_chunk(texts[offset:offset + self.batch_size]) for offset in range(0, len(texts), self.batch_size)]
+        return np.concatenate(chunks, axis=0)
+
+    def _encode_chunk(self, texts: list[str]) -> np.ndarray:
+        encoded = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_tensors="np",
+        )
+        attention_mask = encoded["attention_mask"].astype(np.int64)
+        feeds = {
+            name: encoded[name].astype(np.int64) if name in encoded else np.zeros_like(attention_mask)
+            for name in self.input_names
+        }
+        hidden = self.session.run(None, feeds)[0]
+
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+def parity_check(
+    model: SentenceTransformer,
+    encoder: OnnxTextEncoder,
+    texts: tuple[str, ...] | list[str] = PARITY_PROBE_TEXTS,
+) -> float:
+    """Минимальное косинусное сходство между эмбеддингами torch и ONNX на проверочных текстах."""
+    reference = np.asarray(
+        model.encode(list(texts), convert_to_numpy=True, normalize_embeddings=True),
+        dtype=np.float32,
+    )
+    candidate = encoder.encode(list(texts))
+    return float(np.min(np.sum(reference * candidate, axis=1)))
@@ -4,9 +4,14 @@
 
 import hashlib
 import json
+from functools import partial
 from typing import TYPE_CHECKING, Any, Dict, List
 
+from prometheus_client import Counter, REGISTRY
+
 from app.core import config
+from .answer_cache import SemanticAnswerCache
+from .single_flight import SingleFlight
 
 if TYPE_CHECKING:
     from redis.asyncio import Redis as AsyncRedis
@@ -20,6 +25,26 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def _get_or_create_counter(name: str, documentation: str, labelnames: list):
+    """Получить счётчик из реестра или создать, если он отсутствует."""
+    if name in REGISTRY._names_to_collectors:
+        return REGISTRY._names_to_collectors[name]
+    return Counter(name, documentation, labelnames)
+
+
+rag_cache_requests_counter = _get_or_create_counter(
+    "rag_cache_requests_total",
+    "RAG answer cache lookups by cache tier and result",
+    ["cache", "result"],
+)
+
+rag_llm_calls_avoided_counter = _get_or_create_counter(
+    "rag_llm_calls_avoided_total",
+    "LLM calls avoided by serving RAG answers from cache",
+    ["cache"],
+)
+
+
 class RAGService:
     """Сервис для Retrieval-Augmented Generation (RAG)"""
     
@@ -32,6 +57,18 @@ class RAGService:
         self.llm_service = llm_service
         self.semantic_search_service = semantic_search_service
         self.redis_client = redis
+        self.answer_cache = SemanticAnswerCache(
+            dim=semantic_search_service.embedding_service.dimension,
+            threshold=config.RAG_SEMANTIC_CACHE_THRESHOLD,
+            max_entries=config.RAG_SEMANTIC_CACHE_SIZE,
+            ttl=config.RAG_CACHE_TTL_SECONDS,
+        )
+        self._single_flight = SingleFlight(
+            "rag",
+            redis_client=redis,
+            lock_ttl=config.SINGLE_FLIGHT_LOCK_TTL_SECONDS,
+            poll_interval=config.SINGLE_FLIGHT_POLL_INTERVAL_MS / 1000,
+        )
         
         
     def _format_tasks(self, tasks: List[dict]) -> str:
@@ -39,8 +76,14 @@ class RAGService:
         result = []
         for i, task in enumerate(tasks, 1):
             task_ref = task.get("task_id", task.get("text_id"))
+            # Найденные только по ключевым словам задачи не имеют косинусной похожести
+            relevance = (
+                f"похожесть: {task['similarity']:.2f}"
+                if task.get("similarity") is not None
+                else "совпадение по ключевым словам"
+            )
             result.append(
-                f"""--- ЗАДАЧА {i} (похожесть: {task['similarity']:.2f}) ---
+                f"""--- ЗАДАЧА {i} ({relevance}) ---
 Название: {task.get('title', 'Без названия')}
 Описание: {task.get('description', 'Нет описания')}
 Технологии: {task.get('tags', 'не указаны')}
@@ -63,16 +106,27 @@ ID: {task_ref}"""
         
         
     def _calculate_confidence(self, tasks: List[dict]) -> float:
-        """Возвращает среднюю похожесть найденных задач."""
+        """Возвращает среднюю косинусную похожесть найденных задач (без неё задача считается за 0)."""
         if not tasks:
             return 0
-        return sum(task.get("similarity", 0) for task in tasks) / len(tasks)
+        return sum(task.get("similarity") or 0 for task in tasks) / len(tasks)
 
 
     @staticmethod
     def _get_cache_key(query: str, top_k: int) -> str:
         """Генерирует ключ для кэша."""
         return f"rag:{hashlib.md5(query.encode()).hexdigest()}:{top_k}"
+
+    async def _get_cached(self, cache_key: str) -> Dict[str, Any] | None:
+        """Прочитать готовый ответ из Redis по точному ключу запроса."""
+        cached_response = await self.redis_client.get(cache_key)
+        if not cached_response:
+            return None
+        if isinstance(cached_response, bytes):
+            cached_response = cached_response.decode("utf-8")
+        response = json.loads(cached_response)
+        response["cached"] = True
+        return response
     
     
     async def ask(
@@ -82,24 +136,60 @@ ID: {task_ref}"""
         top_k: int = config.DEFAULT_TOP_K,
         use_cache: bool = True
     ) -> Dict[str, Any]:
-        """Получение ответа на вопрос с помощью RAG"""
-        
+        """Получение ответа на вопрос с помощью RAG.
+
+        Кеш проверяется в два этапа: точное совпадение строки запроса в Redis, затем
+        семантический кеш по близости эмбеддинга вопроса к уже отвеченным. Одинаковые
+        одновременные вопросы при промахе считаются один раз на все процессы.
+        """
+        # Тот же текст, что ищет поиск: эмбеддинг из семантического кеша переиспользуется им через кеш эмбеддингов
+        query = self.semantic_search_service._normalize_text(query, "Запрос")
         cache_key = self._get_cache_key(query, top_k)
 
-        if use_cache and self.redis_client:
-            cached_response = await self.redis_client.get(cache_key)
+        if not use_cache:
+            return await self._answer(query, session, top_k, use_cache, cache_key)
+
+        fetch = None
+        if self.redis_client:
+            cached_response = await self._get_cached(cache_key)
+            if cached_response:
+                rag_cache_requests_counter.labels(cache="exact", result="hit").inc()
+                rag_llm_calls_avoided_counter.labels(cache="exact").inc()
+                return cached_response
+            rag_cache_requests_counter.labels(cache="exact", result="miss").inc()
+            fetch = partial(self._get_cached, cache_key)
+
+        response = await self._single_flight.run(
+            cache_key, partial(self._answer, query, session, top_k, use_cache, cache_key), fetch=fetch
+        )
+        return dict(response)
 
+    async def _answer(
+        self,
+        query: str,
+        session: "AsyncSession",
+        top_k: int,
+        use_cache: bool,
+        cache_key: str,
+    ) -> Dict[str, Any]:
+        """Ответить на вопрос после промаха точного кеша: семантический кеш, поиск и LLM."""
+        query_embedding = generation = None
+        if use_cache and self.answer_cache.threshold < 1:
+            # Эмбеддинг запроса попадает в кеш эмбеддингов и переиспользуется поиском ниже
+            query_embedding = await self.semantic_search_service.embedding_service.encode_one_async(query)
+            generation = await self.semantic_search_service.vector_db.get_generation()
+            cached_response = self.answer_cache.lookup(query_embedding, top_k, generation)
+            rag_cache_requests_counter.labels(cache="semantic", result="hit" if cached_response else "miss").inc()
             if cached_response:
-                if isinstance(cached_response, bytes):
-                    cached_response = cached_response.decode("utf-8")
-                response = json.loads(cached_response)
-                response["cached"] = True
-                return response
+                rag_llm_calls_avoided_counter.labels(cache="semantic").inc()
+                return {**cached_response, "cached": True}
             
         tasks = await self.semantic_search_service.search(query, session, top_k)
         
+        generated = True
         if not tasks:
-            return {
+            # Ответ без источников кладём только в семантический кеш: его записи привязаны к поколению индекса
+            response = {
                 "answer": (
                     "У меня нет информации об этом в ваших задачах. "
                     "Попробуйте переформулировать вопрос или создать задачу по этой теме."
@@ -108,7 +198,26 @@ ID: {task_ref}"""
                 "confidence": 0,
                 "cached": False,
             }
+        else:
+            response, generated = await self._generate(query, tasks)
+
+        # Ответ-заглушку после ошибки LLM в семантический кеш не кладём: он достался бы похожим вопросам
+        if query_embedding is not None and generated:
+            self.answer_cache.store(query_embedding, top_k, generation, response)
+        
+        # Кэшируем; точный ключ не знает поколения индекса, поэтому пустой ответ в него не пишем
+        if use_cache and self.redis_client and tasks:
+            await self.redis_client.setex(
+                cache_key,
+                config.RAG_CACHE_TTL_SECONDS,
+                json.dumps(response, ensure_ascii=False)
+            )
             
+        return response
+
+
+    async def _generate(self, query: str, tasks: List[dict]) -> tuple[Dict[str, Any], bool]:
+        """Сгенерировать ответ LLM по найденным задачам; False вторым элементом — заглушка после ошибки LLM."""
         formatted_tasks = self._format_tasks(tasks)
         sources = self._build_sources(tasks)
         confidence = self._calculate_confidence(tasks)
@@ -117,6 +226,7 @@ ID: {task_ref}"""
 
         user_prompt = config.USER_PROMPT.format(formatted_tasks, query)
         
+        generated = True
         try:
 
             answer = await self.llm_service.generate(
@@ -126,6 +236,7 @@ ID: {task_ref}"""
             
         except Exception as exc:
             logger.error(f"Ошибка при генерации ответа в RAG: {exc}", exc_info=True)
+            generated = False
             answer = (
                 "Произошла ошибка при генерации ответа. "
                 "Попробуйте переформулировать вопрос или создать задачу по этой теме."
@@ -137,16 +248,7 @@ ID: {task_ref}"""
             "confidence": confidence,
             "cached": False,
         }
-        
-        # Кэшируем
-        if use_cache and self.redis_client:
-            await self.redis_client.setex(
-                cache_key,
-                300,
-                json.dumps(response, ensure_ascii=False)
-            )
-            
-        return response
+        return response, generated
 
 
     async def ask_stream(
@@ -0,0 +1,56 @@
+"""
+Асинхронный лок читателей-писателей для VectorDB.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+
+class AsyncRWLock:
+    """Лок, при котором чтения идут параллельно, а запись эксклюзивна.
+
+    Ожидающий писатель не пропускает новых читателей, поэтому поток
+    поисковых запросов не может откладывать изменения индекса бесконечно.
+    """
+
+    def __init__(self) -> None:
+        self._condition = asyncio.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[None]:
+        """Разделяемый доступ для поиска."""
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writer and not self._writers_waiting)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[None]:
+        """Эксклюзивный доступ для изменения индекса."""
+        async with self._condition:
+            self._writers_waiting += 1
+            try:
+                await self._condition.wait_for(lambda: not self._writer and not self._readers)
+            finally:
+                self._writers_waiting -= 1
+                # Отменённый писатель не должен оставлять читателей в ожидании
+                self._condition.notify_all()
+            self._writer = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._writer = False
+                self._condition.notify_all()
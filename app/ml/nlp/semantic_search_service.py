@@ -4,14 +4,66 @@
 
 from __future__ import annotations
 
+import time
+from functools import partial
+
+import numpy as np
 import redis.asyncio as redis
+from prometheus_client import Counter, REGISTRY
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core import config
+from .diversity import maximal_marginal_relevance, relevance_from_scores
 from .embedding_service import EmbeddingService
+from .lexical_index import tokenize
+from .single_flight import SingleFlight
 from .vector_db import VectorDB
 
 
+SEARCH_MODES = ("dense", "lexical", "hybrid", "auto")
+# Вес нового замера в скользящей оценке стоимости промаха кеша
+MISS_LATENCY_DECAY = 0.1
+
+
+def _get_or_create_counter(name: str, documentation: str, labelnames: list):
+    """Получить счётчик из реестра или создать, если он отсутствует."""
+    if name in REGISTRY._names_to_collectors:
+        return REGISTRY._names_to_collectors[name]
+    return Counter(name, documentation, labelnames)
+
+
+search_cache_requests_counter = _get_or_create_counter(
+    "semantic_search_result_cache_requests_total",
+    "Search result cache lookups done before running BM25, the encoder and the index",
+    ["result"],
+)
+
+search_cache_saved_seconds_counter = _get_or_create_counter(
+    "semantic_search_result_cache_saved_seconds_total",
+    "Estimated BM25, encoder and index time saved by result cache hits",
+    [],
+)
+
+
+def reciprocal_rank_fusion(rankings: list[list[dict]], top_k: int, k: int = config.SEARCH_RRF_K) -> list[dict]:
+    """Слить ранжированные списки результатов: score документа — сумма 1 / (k + позиция).
+
+    Поля документа берутся из первого списка, где он встретился, поэтому при
+    передаче плотных результатов первыми similarity остаётся косинусной.
+    lexical_score документа переносится из любого списка, где он есть.
+    """
+    documents: dict[str, dict] = {}
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            document = documents.setdefault(item["text_id"], dict(item))
+            if item.get("lexical_score") is not None:
+                document["lexical_score"] = item["lexical_score"]
+            scores[item["text_id"]] = scores.get(item["text_id"], 0.0) + 1.0 / (k + rank)
+    ordered = sorted(scores, key=scores.__getitem__, reverse=True)[:top_k]
+    return [{**documents[text_id], "score": scores[text_id]} for text_id in ordered]
+
+
 class SemanticSearchService:
     """Сервис для семантического поиска по эмбеддингам с кешированием в Redis."""
 
@@ -24,7 +76,10 @@ class SemanticSearchService:
         
         self.embedding_service = embedding_service
         self.redis_client = redis_client
-        self.vector_db = vector_db or VectorDB(dim=embedding_service.dimension, redis_client=redis_client)
+        self.vector_db = vector_db if vector_db is not None else VectorDB(dim=embedding_service.dimension, redis_client=redis_client)
+        self._miss_seconds: float | None = None # скользящая оценка стоимости одного промаха (энкодер + индекс)
+        # Только внутри процесса: поиск дешевле обращения к общей блокировке, а кеш результатов и так в Redis
+        self._single_flight = SingleFlight("search")
 
     @staticmethod
     def _normalize_text(text: str, field_name: str) -> str:
@@ -42,43 +97,280 @@ class SemanticSearchService:
         
         normalized_text = self._normalize_text(text, "Текст для индексирования")
         
-        embedding = self.embedding_service.encode_one(normalized_text)
+        embedding = await self.embedding_service.encode_one_async(normalized_text)
         
-        resolved_item_id = await self.vector_db.add(
-            embedding, session=session, item_id=item_id, text=normalized_text
-        )
+        if item_id is None:
+            resolved_item_id = await self.vector_db.add(embedding, session=session, text=normalized_text)
+        else:
+            # Повторная индексация отредактированной задачи заменяет вектор и текст
+            resolved_item_id = await self.vector_db.upsert(
+                str(item_id), embedding, session=session, text=normalized_text
+            )
         
-        await self.vector_db.save_to_redis()
-        await self.clear_cache()
+        # Кеш поиска инвалидируется при записи в VectorDB сменой поколения индекса
+        await self.vector_db.maybe_checkpoint()
         
         return str(resolved_item_id)
+
+    async def index_many(
+        self,
+        texts: list[str],
+        session: AsyncSession,
+        item_ids: list[str | int] | None = None,
+    ) -> list[str]:
+        """Индексировать батч текстов: один encode_batch, одна запись в VectorDB и один INSERT.
+
+        С item_ids документы заменяются на месте, как в index. Коммит сессии — за вызывающим.
+        """
+        if not texts:
+            raise ValueError("Список текстов для индексирования не может быть пустым")
+        if item_ids is not None and len(item_ids) != len(texts):
+            raise ValueError(f"Длина item_ids ({len(item_ids)}) не совпадает с количеством текстов ({len(texts)})")
+
+        normalized_texts = [self._normalize_text(text, "Текст для индексирования") for text in texts]
+        embeddings = await self.embedding_service.encode_batch_async(normalized_texts)
+
+        if item_ids is None:
+            resolved_item_ids = await self.vector_db.add(embeddings, session=session, text=normalized_texts)
+            resolved_item_ids = [resolved_item_ids] if isinstance(resolved_item_ids, str) else resolved_item_ids
+        else:
+            resolved_item_ids = await self.vector_db.upsert_many(
+                [str(item_id) for item_id in item_ids], embeddings, session=session, texts=normalized_texts
+            )
+
+        # Одна смена поколения кеша поиска на батч происходит внутри записи в VectorDB
+        await self.vector_db.maybe_checkpoint()
+
+        return [str(item_id) for item_id in resolved_item_ids]
     
-    async def search(self, query: str, session: AsyncSession, top_k: int = config.DEFAULT_TOP_K) -> list[dict]:
-        """Искать документы, наиболее похожие на запрос."""
+    @staticmethod
+    def _resolve_mode(mode: str | None) -> str:
+        mode = mode or config.SEARCH_MODE
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Неизвестный режим поиска: {mode}. Доступны: {', '.join(SEARCH_MODES)}")
+        return mode
+
+    @staticmethod
+    def _resolve_mmr_lambda(mmr_lambda: float | None) -> float:
+        mmr_lambda = config.SEARCH_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+        if not 0 <= mmr_lambda <= 1:
+            raise ValueError("mmr_lambda должен быть в диапазоне [0, 1]")
+        return mmr_lambda
+
+    async def _diversify_many(self, rows: list[list[dict]], top_k: int, mmr_lambda: float) -> list[list[dict]]:
+        """Переранжировать пулы кандидатов по MMR и схлопнуть почти-дубликаты.
+
+        При mmr_lambda == 1 остаётся обычный top_k. Векторы всех кандидатов
+        восстанавливаются из индекса одним запросом.
+        """
+        if mmr_lambda >= 1 or all(len(row) <= 1 for row in rows):
+            return [row[:top_k] for row in rows]
+
+        item_ids = list(dict.fromkeys(item["text_id"] for row in rows for item in row))
+        vectors = await self.vector_db.get_vectors(item_ids)
+        position_of = {item_id: position for position, item_id in enumerate(item_ids)}
+
+        diversified: list[list[dict]] = []
+        for row in rows:
+            if len(row) <= 1:
+                diversified.append(row)
+                continue
+            order = maximal_marginal_relevance(
+                relevance_from_scores(np.array([item["score"] for item in row])),
+                vectors[[position_of[item["text_id"]] for item in row]],
+                top_k,
+                mmr_lambda=mmr_lambda,
+                duplicate_threshold=config.SEARCH_DUPLICATE_THRESHOLD,
+            )
+            diversified.append([row[position] for position in order])
+        return diversified
+
+    @staticmethod
+    def _lexical_is_enough(query: str, lexical_results: list[dict], top_k: int) -> bool:
+        """Короткий запрос из ключевых слов, по которому BM25 уже набрал top_k документов."""
+        return len(tokenize(query)) <= config.SEARCH_LEXICAL_MAX_TERMS and len(lexical_results) >= top_k
+
+    @staticmethod
+    def _merge(dense_results: list[dict], lexical_results: list[dict] | None, top_k: int) -> list[dict]:
+        if lexical_results is None:
+            return sorted(dense_results, key=lambda item: item["similarity"], reverse=True)[:top_k]
+        return reciprocal_rank_fusion([dense_results, lexical_results], top_k)
+
+    async def search(
+        self,
+        query: str,
+        session: AsyncSession,
+        top_k: int = config.DEFAULT_TOP_K,
+        nprobe: int | None = None,
+        ef_search: int | None = None,
+        mode: str | None = None,
+        mmr_lambda: float | None = None,
+    ) -> list[dict]:
+        """Искать документы, наиболее похожие на запрос.
+
+        mode: dense — только эмбеддинги, lexical — только BM25 без энкодера,
+        hybrid — слияние обоих списков через reciprocal rank fusion,
+        auto — BM25 для коротких запросов из ключевых слов, иначе hybrid.
+        mmr_lambda < 1 включает MMR: top_k выбирается из пула в SEARCH_MMR_POOL_FACTOR
+        раз больше с балансом релевантности (1) и разнообразия (0), почти-дубликаты схлопываются.
+        Одинаковые одновременные запросы выполняются один раз.
+        """
         normalized_query = self._normalize_text(query, "Запрос")
-        
-        results = await self.vector_db.search(
-            self.embedding_service.encode_one(normalized_query),
-            session=session,
-            top_k=top_k,
-            query=normalized_query,
-        )
-        
-        sorted_docs = sorted(results, key=lambda item: item["similarity"], reverse=True)[:top_k]
-        return sorted_docs
-    
+        mode = self._resolve_mode(mode)
+        mmr_lambda = self._resolve_mmr_lambda(mmr_lambda)
+        key = f"{mode}:{top_k}:{nprobe}:{ef_search}:{mmr_lambda}:{normalized_query}"
+        [results] = await self._single_flight.run(
+            key, partial(self._search_many, [normalized_query], session, top_k, nprobe, ef_search, mode, mmr_lambda)
+        )
+        # Ожидающие получают общий список, копируем, чтобы вызывающие не портили результаты друг друга
+        return [dict(item) for item in results]
+
+    async def search_many(
+        self,
+        queries: list[str],
+        session: AsyncSession,
+        top_k: int = config.DEFAULT_TOP_K,
+        nprobe: int | None = None,
+        ef_search: int | None = None,
+        mode: str | None = None,
+        mmr_lambda: float | None = None,
+    ) -> list[list[dict]]:
+        """Искать документы сразу для нескольких запросов одним батчем эмбеддингов и FAISS.
+
+        Запросы, которым хватает лексического быстрого пути, в батч эмбеддингов не попадают.
+        """
+        if not queries:
+            raise ValueError("Список запросов не может быть пустым")
+        normalized_queries = [self._normalize_text(query, "Запрос") for query in queries]
+        mode = self._resolve_mode(mode)
+        mmr_lambda = self._resolve_mmr_lambda(mmr_lambda)
+        return await self._search_many(normalized_queries, session, top_k, nprobe, ef_search, mode, mmr_lambda)
+
+    @staticmethod
+    def _result_cache_query(query: str, mode: str, mmr_lambda: float) -> str:
+        """Текст запроса в ключе кеша итоговых результатов.
+
+        Плотный top_k без MMR совпадает с тем, что кеширует VectorDB.search_many,
+        и делит с ним ключ; остальные режимы кешируются под своим ключом.
+        """
+        if mode == "dense" and mmr_lambda >= 1:
+            return query
+        return f"{mode}:{mmr_lambda}\n{query}"
+
+    async def _search_many(
+        self,
+        queries: list[str],
+        session: AsyncSession,
+        top_k: int,
+        nprobe: int | None,
+        ef_search: int | None,
+        mode: str,
+        mmr_lambda: float,
+    ) -> list[list[dict]]:
+        """Поиск, при котором BM25, энкодер и FAISS запускаются только для промахов кеша результатов.
+
+        Поколение индекса читается один раз: по нему проверяется кеш итоговых
+        результатов, и с ним же промахи ищутся и кешируются без повторного MGET.
+        """
+        started = time.perf_counter()
+        generation = await self.vector_db.get_generation()
+        cache_queries = [self._result_cache_query(query, mode, mmr_lambda) for query in queries]
+        results = await self.vector_db.get_cached_results(
+            cache_queries, top_k=top_k, nprobe=nprobe, ef_search=ef_search, generation=generation
+        )
+        misses = [position for position, cached in enumerate(results) if cached is None]
+        hits = len(queries) - len(misses)
+        lookup_seconds = time.perf_counter() - started
+        search_cache_requests_counter.labels(result="hit").inc(hits)
+        search_cache_requests_counter.labels(result="miss").inc(len(misses))
+        if hits and self._miss_seconds is not None:
+            search_cache_saved_seconds_counter.inc(hits * max(self._miss_seconds - lookup_seconds / len(queries), 0.0))
+        if not misses:
+            return results
+
+        miss_queries = [queries[position] for position in misses]
+        pool = top_k if mmr_lambda >= 1 else top_k * config.SEARCH_MMR_POOL_FACTOR
+        # Для слияния берём списки глубже top_k, чтобы документы из хвоста одного списка могли подняться
+        depth = pool if mode == "dense" else max(pool, top_k * config.SEARCH_HYBRID_DEPTH)
+
+        lexical_rows: list[list[dict] | None] = [None] * len(miss_queries)
+        if mode != "dense":
+            lexical_rows = await self.vector_db.lexical_search_many(miss_queries, session=session, top_k=depth)
+
+        rows: list[list[dict]] = [[] for _ in miss_queries]
+        dense_positions: list[int] = []
+        for position, (query, lexical_results) in enumerate(zip(miss_queries, lexical_rows)):
+            if mode == "lexical" or (mode == "auto" and self._lexical_is_enough(query, lexical_results, top_k)):
+                rows[position] = lexical_results[:pool]
+            else:
+                dense_positions.append(position)
+
+        if dense_positions:
+            dense_rows = await self._dense_search_many(
+                [miss_queries[position] for position in dense_positions], session, depth, nprobe, ef_search, generation
+            )
+            for position, row in zip(dense_positions, dense_rows):
+                rows[position] = self._merge(row, lexical_rows[position], pool)
+
+        for position, row in zip(misses, await self._diversify_many(rows, top_k, mmr_lambda)):
+            results[position] = row
+        # Плотный top_k без MMR уже положил в кеш VectorDB.search_many под тем же ключом
+        await self.vector_db.cache_results(
+            {
+                cache_queries[position]: results[position]
+                for position in misses
+                if cache_queries[position] != queries[position]
+            },
+            top_k=top_k,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            generation=generation,
+        )
+
+        miss_seconds = (time.perf_counter() - started) / len(misses)
+        self._miss_seconds = miss_seconds if self._miss_seconds is None else (
+            (1 - MISS_LATENCY_DECAY) * self._miss_seconds + MISS_LATENCY_DECAY * miss_seconds
+        )
+        return results
+
+    async def _dense_search_many(
+        self,
+        queries: list[str],
+        session: AsyncSession,
+        top_k: int,
+        nprobe: int | None,
+        ef_search: int | None,
+        generation: int | None,
+    ) -> list[list[dict]]:
+        """Плотный поиск по промахам кеша: энкодер и FAISS без повторной проверки кеша."""
+        if len(queries) == 1:
+            # Одиночный запрос идёт через микробатчер, чтобы склеиться с конкурентными
+            vectors = np.asarray(await self.embedding_service.encode_one_async(queries[0])).reshape(1, -1)
+        else:
+            vectors = await self.embedding_service.encode_batch_async(queries)
+        return await self.vector_db.search_many(
+            vectors,
+            session=session,
+            top_k=top_k,
+            queries=queries,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            generation=generation,
+            cache_lookup=False,
+        )
+
     async def delete(self, item_id: str | int) -> None:
-        """Удалить документ из базы данных и очистить кеш."""
+        """Удалить документ из индекса; кеш поиска инвалидируется сменой поколения."""
         await self.vector_db.delete(str(item_id))
-        await self.clear_cache()
+        await self.vector_db.maybe_checkpoint()
 
     async def clear_cache(self) -> None:
-        """Очистить весь кеш поиска."""
+        """Инвалидировать весь кеш поиска за O(1)."""
         await self.vector_db.clear_search_cache()
 
-    async def save_index(self) -> bool:
-        """Сохранить FAISS индекс в Redis."""
-        return await self.vector_db.save_to_redis()
+    async def save_index(self, publish: bool = False) -> bool:
+        """Сохранить снапшот FAISS индекса в Redis; publish — разослать его другим процессам."""
+        return await self.vector_db.save_to_redis(publish=publish)
 
     async def load_index(self) -> bool:
         """Загрузить FAISS индекс из Redis."""
@@ -0,0 +1,479 @@
+"""
+Шардированная VectorDB: векторы разнесены по процессам-шардам, поиск идёт scatter-gather.
+
+Каждый шард — отдельный процесс с обычной VectorDB в собственном пространстве
+имён Redis ("<namespace>:shard<i>"), поэтому снапшоты, журнал изменений и
+фильтры работают в шардах без изменений. Координатор маршрутизирует записи
+по хешу item_id, рассылает запросы всем шардам параллельно, сливает top-k
+и сам отвечает за кеш поиска и гидратацию текстов из базы.
+
+Шарды запускаются локально (ShardedVectorDB.spawn) или на отдельных узлах.
+Локальные шарды принадлежат запустившему их процессу API; Celery воркерам и
+нескольким процессам API нужны общие шарды через VECTOR_DB_SHARD_ADDRESSES:
+
+    python -m app.ml.nlp.sharded_vector_db --shard 0 --port 7100
+
+Шарды и координатор аутентифицируют соединения общим VECTOR_DB_SHARD_AUTHKEY,
+но сами запросы передаются pickle, поэтому порты шардов должны оставаться в
+закрытой сети: по умолчанию шард слушает только 127.0.0.1, а --host 0.0.0.0
+допустим лишь за файрволом, не пускающим к портам никого, кроме координаторов.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Awaitable, Callable
+
+import faiss
+import numpy as np
+import redis.asyncio as redis
+
+from app.core import config
+from .vector_db import VectorDB
+
+
+logger = logging.getLogger(__name__)
+
+SHARD_START_TIMEOUT = 120
+
+
+def _shard_authkey() -> bytes:
+    """Ключ аутентификации соединений с шардами; ключ подписи JWT для этого не используется."""
+    if not config.VECTOR_DB_SHARD_AUTHKEY:
+        raise RuntimeError("Для соединений с шардами VectorDB задайте VECTOR_DB_SHARD_AUTHKEY")
+    return config.VECTOR_DB_SHARD_AUTHKEY.encode("utf-8")
+
+
+class ShardClient:
+    """RPC клиент одного шарда с пулом соединений multiprocessing.connection."""
+
+    def __init__(self, address: tuple[str, int], authkey: bytes, max_connections: int) -> None:
+        self.address = address
+        self._authkey = authkey
+        self._idle: queue.LifoQueue[Connection] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def call(self, method: str, *args: Any) -> Any:
+        """Выполнить метод шарда (блокирующий вызов, выполняется в пуле потоков координатора)."""
+        with self._slots:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = Client(self.address, authkey=self._authkey)
+            try:
+                connection.send((method, args))
+                status, result = connection.recv()
+            except (EOFError, OSError) as exc:
+                connection.close()
+                raise ConnectionError(f"Шард {self.address} недоступен: {exc}") from exc
+            self._idle.put(connection)
+
+        if status == "error":
+            raise RuntimeError(f"Ошибка шарда {self.address}: {result}")
+        return result
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def serve_shard(
+    address: tuple[str, int],
+    authkey: bytes,
+    dim: int,
+    namespace: str,
+    index_type: str | None = None,
+    compression: str | None = None,
+    redis_url: str | None = None,
+    ready: Connection | None = None,
+    threads: int | None = None,
+) -> None:
+    """Точка входа процесса шарда: VectorDB в своём event loop и RPC сервер поверх неё.
+
+    threads ограничивает потоки OpenMP в FAISS, чтобы локальные шарды не делили
+    между собой одни и те же ядра.
+    """
+    if threads:
+        faiss.omp_set_num_threads(threads)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name=f"{namespace}-loop", daemon=True).start()
+
+    def run(coroutine: Awaitable[Any]) -> Any:
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    redis_client = redis.from_url(redis_url) if redis_url else None
+    vector_db = VectorDB(
+        dim=dim,
+        redis_client=redis_client,
+        index_type=index_type,
+        compression=compression,
+        namespace=namespace,
+    )
+    if redis_client is not None:
+        run(vector_db.load_from_redis())
+        # Шард сам догоняет записи других координаторов в своё пространство имён
+        loop.call_soon_threadsafe(vector_db.start_following)
+
+    handlers: dict[str, Callable[..., Awaitable[Any]]] = {
+        "add": vector_db._add_vectors,
+        "search": vector_db._search_hits,
+        "lexical": vector_db._lexical_hits,
+        "vectors": vector_db.get_vectors,
+        "attributes": vector_db.set_attributes,
+        "ids_without_attributes": vector_db.ids_without_attributes,
+        "ids_without_lexical": vector_db.ids_without_lexical,
+        "lexical_texts": vector_db._index_lexical_texts,
+        "delete": vector_db.delete,
+        "contains_many": vector_db.contains_many,
+        "size": vector_db.size,
+        "ids": vector_db.all_ids,
+        "sync": vector_db.sync,
+        "save_to_redis": vector_db.save_to_redis,
+        "maybe_checkpoint": vector_db.maybe_checkpoint,
+        "maybe_promote": vector_db.maybe_promote,
+        "compact": vector_db.compact,
+    }
+
+    with Listener(address, authkey=authkey) as listener:
+        logger.info("Шард %s слушает %s", namespace, listener.address)
+        if ready is not None:
+            ready.send(listener.address)
+            ready.close()
+        while True:
+            try:
+                connection = listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as exc:
+                logger.warning("Отклонено подключение к шарду %s: %s", namespace, exc)
+                continue
+            threading.Thread(target=_serve_connection, args=(connection, handlers, run), daemon=True).start()
+
+
+def _serve_connection(
+    connection: Connection,
+    handlers: dict[str, Callable[..., Awaitable[Any]]],
+    run: Callable[[Awaitable[Any]], Any],
+) -> None:
+    """Обслуживать запросы одного соединения координатора до его закрытия."""
+    with connection:
+        while True:
+            try:
+                method, args = connection.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                handler = handlers.get(method)
+                if handler is None:
+                    raise ValueError(f"Неизвестный метод шарда: {method}")
+                response = ("ok", run(handler(*args)))
+            except Exception as exc:
+                response = ("error", f"{type(exc).__name__}: {exc}")
+            try:
+                connection.send(response)
+            except (EOFError, OSError):
+                return
+
+
+class ShardedVectorDB(VectorDB):
+    """VectorDB, разнесённая по процессам-шардам со scatter-gather поиском.
+
+    Кеш поиска в Redis и LRU кеш текстов остаются на координаторе. Кеш текстов
+    инвалидируется только изменениями, прошедшими через этот координатор.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        shard_addresses: list[tuple[str, int]],
+        redis_client: redis.Redis | None = None,
+        namespace: str = "vector_db",
+        authkey: bytes | None = None,
+        processes: list[multiprocessing.Process] | None = None,
+    ) -> None:
+        if not shard_addresses:
+            raise ValueError("Нужен хотя бы один шард")
+        super().__init__(dim=dim, redis_client=redis_client, namespace=namespace)
+        authkey = authkey or _shard_authkey()
+        self.shards = [
+            ShardClient(address, authkey, config.VECTOR_DB_SHARD_CONNECTIONS) for address in shard_addresses
+        ]
+        self._processes = processes or []
+        # Блокирующие RPC вызовы: по пулу соединений на каждый шард
+        self._shard_executor = ThreadPoolExecutor(
+            max_workers=len(self.shards) * config.VECTOR_DB_SHARD_CONNECTIONS,
+            thread_name_prefix=f"{namespace}-shards",
+        )
+
+    @classmethod
+    def spawn(
+        cls,
+        dim: int,
+        shard_count: int,
+        redis_client: redis.Redis | None = None,
+        redis_url: str | None = None,
+        namespace: str = "vector_db",
+        index_type: str | None = None,
+        compression: str | None = None,
+    ) -> ShardedVectorDB:
+        """Запустить shard_count локальных процессов-шардов и подключиться к ним.
+
+        Шарды — дочерние daemon процессы вызывающего, поэтому spawn доступен только
+        обычному (не daemon) процессу, например API. Celery prefork воркеры сами
+        daemon и должны подключаться к шардам через VECTOR_DB_SHARD_ADDRESSES.
+        """
+        if multiprocessing.current_process().daemon:
+            raise RuntimeError(
+                "Локальные шарды нельзя запустить из daemon процесса (например, Celery воркера): "
+                "запустите шарды отдельно и укажите VECTOR_DB_SHARD_ADDRESSES"
+            )
+        context = multiprocessing.get_context("spawn")
+        authkey = os.urandom(32)
+        threads = max(1, (os.cpu_count() or 1) // shard_count)
+        processes, receivers = [], []
+        for shard in range(shard_count):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=serve_shard,
+                args=(("127.0.0.1", 0), authkey, dim, f"{namespace}:shard{shard}", index_type, compression, redis_url, sender, threads),
+                name=f"{namespace}-shard{shard}",
+                daemon=True,
+            )
+            process.start()
+            sender.close()
+            processes.append(process)
+            receivers.append(receiver)
+
+        addresses = []
+        for process, receiver in zip(processes, receivers):
+            if not receiver.poll(SHARD_START_TIMEOUT):
+                for started in processes:
+                    started.terminate()
+                raise RuntimeError(f"Шард {process.name} не запустился за {SHARD_START_TIMEOUT} с")
+            addresses.append(receiver.recv())
+            receiver.close()
+        return cls(dim, addresses, redis_client=redis_client, namespace=namespace, authkey=authkey, processes=processes)
+
+    def shard_of(self, item_id: str) -> int:
+        """Номер шарда, которому принадлежит документ (стабильный хеш item_id)."""
+        return zlib.crc32(item_id.encode("utf-8")) % len(self.shards)
+
+    # len(), in и ids потребовали бы синхронных RPC и блокировали бы event loop
+    def __len__(self) -> int:
+        raise TypeError("len() недоступен для ShardedVectorDB: используйте await size()")
+
+    def __bool__(self) -> bool:
+        return True
+
+    def __contains__(self, item_id: object) -> bool:
+        raise TypeError("Оператор in недоступен для ShardedVectorDB: используйте await contains_many()")
+
+    @property
+    def ids(self) -> list[str]:
+        raise TypeError("ids недоступен для ShardedVectorDB: используйте await all_ids()")
+
+    async def all_ids(self) -> list[str]:
+        return [item_id for shard_ids in await self._broadcast("ids") for item_id in shard_ids]
+
+    async def size(self) -> int:
+        return sum(await self._broadcast("size"))
+
+    async def contains_many(self, item_ids: list[str]) -> list[bool]:
+        """Проверить наличие документов: по одному RPC на каждый затронутый шард."""
+        positions: dict[int, list[int]] = {}
+        for position, item_id in enumerate(item_ids):
+            positions.setdefault(self.shard_of(str(item_id)), []).append(position)
+
+        found = [False] * len(item_ids)
+        shard_found = await asyncio.gather(
+            *(
+                self._call(self.shards[shard], "contains_many", [str(item_ids[position]) for position in shard_positions])
+                for shard, shard_positions in positions.items()
+            )
+        )
+        for shard_positions, flags in zip(positions.values(), shard_found):
+            for position, flag in zip(shard_positions, flags):
+                found[position] = flag
+        return found
+
+    async def _call(self, shard: ShardClient, method: str, *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._shard_executor, partial(shard.call, method, *args))
+
+    async def _broadcast(self, method: str, *args: Any) -> list[Any]:
+        """Вызвать метод на всех шардах параллельно."""
+        return await asyncio.gather(*(self._call(shard, method, *args) for shard in self.shards))
+
+    async def _add_vectors(
+        self,
+        item_ids: list[str],
+        vectors: np.ndarray,
+        attributes: list[dict[str, Any] | None] | None = None,
+        texts: list[str] | None = None,
+    ) -> None:
+        """Разослать векторы по шардам-владельцам параллельно."""
+        positions: dict[int, list[int]] = {}
+        for position, item_id in enumerate(item_ids):
+            positions.setdefault(self.shard_of(item_id), []).append(position)
+
+        await asyncio.gather(
+            *(
+                self._call(
+                    self.shards[shard],
+                    "add",
+                    [item_ids[position] for position in shard_positions],
+                    vectors[shard_positions],
+                    [attributes[position] for position in shard_positions] if attributes is not None else None,
+                    [texts[position] for position in shard_positions] if texts is not None else None,
+                )
+                for shard, shard_positions in positions.items()
+            )
+        )
+        self.text_cache.invalidate(item_ids)
+        await self.clear_search_cache()
+
+    async def delete(self, item_id: str) -> None:
+        await self._call(self.shards[self.shard_of(item_id)], "delete", item_id)
+        self.text_cache.invalidate([item_id])
+        await self.clear_search_cache()
+
+    async def _search_hits(
+        self,
+        vectors: np.ndarray,
+        top_k: int,
+        nprobe: int | None = None,
+        ef_search: int | None = None,
+        filters: dict[str, Any] | None = None,
+    ) -> list[list[tuple[str, float]]]:
+        """Запросить top_k у каждого шарда и слить результаты в общий top_k."""
+        shard_hits = await self._broadcast("search", vectors, top_k, nprobe, ef_search, filters)
+        return [
+            heapq.nlargest(top_k, itertools.chain.from_iterable(rows), key=lambda hit: hit[1])
+            for rows in zip(*shard_hits)
+        ]
+
+    async def _lexical_hits(
+        self,
+        queries: list[str],
+        top_k: int,
+        filters: dict[str, Any] | None = None,
+    ) -> list[list[tuple[str, float]]]:
+        """BM25 top_k каждого шарда (IDF считается по шарду) и слияние в общий top_k."""
+        shard_hits = await self._broadcast("lexical", queries, top_k, filters)
+        return [
+            heapq.nlargest(top_k, itertools.chain.from_iterable(rows), key=lambda hit: hit[1])
+            for rows in zip(*shard_hits)
+        ]
+
+    async def get_vectors(self, item_ids: list[str]) -> np.ndarray:
+        """Запросить векторы у шардов-владельцев параллельно и собрать в исходном порядке."""
+        positions: dict[int, list[int]] = {}
+        for position, item_id in enumerate(item_ids):
+            positions.setdefault(self.shard_of(item_id), []).append(position)
+
+        vectors = np.zeros((len(item_ids), self.dim), dtype=np.float32)
+        shard_vectors = await asyncio.gather(
+            *(
+                self._call(self.shards[shard], "vectors", [item_ids[position] for position in shard_positions])
+                for shard, shard_positions in positions.items()
+            )
+        )
+        for shard_positions, rows in zip(positions.values(), shard_vectors):
+            vectors[shard_positions] = rows
+        return vectors
+
+    async def set_attributes(self, attributes: dict[str, dict[str, Any]]) -> int:
+        """Разослать атрибуты шардам-владельцам документов."""
+        by_shard: dict[int, dict[str, dict[str, Any]]] = {}
+        for item_id, current_attributes in attributes.items():
+            by_shard.setdefault(self.shard_of(item_id), {})[item_id] = current_attributes
+        updated = await asyncio.gather(
+            *(self._call(self.shards[shard], "attributes", shard_attributes) for shard, shard_attributes in by_shard.items())
+        )
+        await self.clear_search_cache()
+        return sum(updated)
+
+    async def ids_without_attributes(self) -> list[str]:
+        return [item_id for shard_ids in await self._broadcast("ids_without_attributes") for item_id in shard_ids]
+
+    async def ids_without_lexical(self) -> list[str]:
+        return [item_id for shard_ids in await self._broadcast("ids_without_lexical") for item_id in shard_ids]
+
+    async def _index_lexical_texts(self, texts: dict[str, str]) -> None:
+        by_shard: dict[int, dict[str, str]] = {}
+        for item_id, text in texts.items():
+            by_shard.setdefault(self.shard_of(item_id), {})[item_id] = text
+        await asyncio.gather(
+            *(self._call(self.shards[shard], "lexical_texts", shard_texts) for shard, shard_texts in by_shard.items())
+        )
+
+    async def sync(self) -> bool:
+        return any(await self._broadcast("sync"))
+
+    async def save_to_redis(self, publish: bool = False) -> bool:
+        return all(await self._broadcast("save_to_redis", publish))
+
+    async def load_from_redis(self) -> bool:
+        """Шарды загружают снапшоты при старте, поэтому здесь достаточно догнать журналы.
+
+        Шарды не знают базы с текстами, поэтому их лексические индексы координатор
+        проверяет и дополняет при первом лексическом поиске.
+        """
+        await self._broadcast("sync")
+        self._lexical_backfill = True
+        return await self.size() > 0
+
+    async def maybe_checkpoint(self) -> bool:
+        return any(await self._broadcast("maybe_checkpoint"))
+
+    async def maybe_promote(self) -> bool:
+        return any(await self._broadcast("maybe_promote"))
+
+    async def compact(self) -> int:
+        return sum(await self._broadcast("compact"))
+
+    def start_following(self) -> None:
+        """Шарды сами следят за своими журналами изменений."""
+
+    async def stop_following(self) -> None:
+        """Шарды сами следят за своими журналами изменений."""
+
+    def close(self) -> None:
+        """Закрыть соединения и остановить локально запущенные шарды."""
+        for shard in self.shards:
+            shard.close()
+        for process in self._processes:
+            process.terminate()
+            process.join(timeout=5)
+        self._shard_executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Запустить шард VectorDB на отдельном узле")
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--namespace", default="vector_db")
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    serve_shard(
+        (arguments.host, arguments.port),
+        _shard_authkey(),
+        arguments.dim,
+        f"{arguments.namespace}:shard{arguments.shard}",
+        redis_url=config.REDIS_URL,
+    )
@@ -0,0 +1,148 @@
+"""
+Single-flight: одно вычисление на ключ для одновременных одинаковых запросов.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import uuid
+from typing import Any, Awaitable, Callable
+
+import redis.asyncio as redis
+from prometheus_client import Counter, REGISTRY
+
+
+def _get_or_create_counter(name: str, documentation: str, labelnames: list):
+    """Получить счётчик из реестра или создать, если он отсутствует."""
+    if name in REGISTRY._names_to_collectors:
+        return REGISTRY._names_to_collectors[name]
+    return Counter(name, documentation, labelnames)
+
+
+single_flight_counter = _get_or_create_counter(
+    "single_flight_requests_total",
+    "Single-flight calls by role: leader computes, waiter reuses an in-process result, remote_waiter reuses a result from another process",
+    ["name", "role"],
+)
+
+
+class SingleFlight:
+    """Склеивает одновременные вычисления с одинаковым ключом.
+
+    Внутри процесса первый вызов по ключу (ведущий) считает результат, остальные
+    ждут его future. С redis_client и fetch ведущий ещё берёт блокировку
+    SET NX PX в Redis, а ведущие других процессов вместо вычисления опрашивают
+    общий кеш через fetch, пока держатель блокировки его не заполнит. Если
+    держатель упал, блокировка истекает через lock_ttl и вычисление забирает
+    следующий. Ошибки Redis не мешают посчитать результат без блокировки.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        redis_client: redis.Redis | None = None,
+        lock_ttl: float = 90.0,
+        poll_interval: float = 0.05,
+    ) -> None:
+        self.name = name
+        self.redis_client = redis_client
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def run(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        fetch: Callable[[], Awaitable[Any | None]] | None = None,
+    ) -> Any:
+        """Вернуть результат compute для ключа, посчитав его не более одного раза на всех ожидающих.
+
+        fetch читает общий кеш, который заполняет compute; None означает промах.
+        Все ожидающие получают один и тот же объект результата.
+        """
+        while True:
+            future = self._inflight.get(key)
+            if future is None:
+                break
+            single_flight_counter.labels(name=self.name, role="waiter").inc()
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Отменили ведущего, а не нас: пробуем снова и, возможно, сами становимся ведущим
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._run_locked(key, compute, fetch)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            future.exception() # Ожидающих может не быть, не даём asyncio ругаться на непрочитанную ошибку
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    async def _run_locked(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        fetch: Callable[[], Awaitable[Any | None]] | None,
+    ) -> Any:
+        if self.redis_client is None or fetch is None:
+            single_flight_counter.labels(name=self.name, role="leader").inc()
+            return await compute()
+
+        lock_key = f"single_flight:{self.name}:{key}"
+        token = uuid.uuid4().hex
+        waited = False
+        while True:
+            try:
+                acquired = await self.redis_client.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000))
+            except Exception:
+                single_flight_counter.labels(name=self.name, role="leader").inc()
+                return await compute()
+            if acquired:
+                break
+
+            waited = True
+            await asyncio.sleep(self.poll_interval)
+            result = await fetch()
+            if result is not None:
+                single_flight_counter.labels(name=self.name, role="remote_waiter").inc()
+                return result
+
+        try:
+            # Держатель мог успеть заполнить кеш и отпустить блокировку между опросами
+            result = await fetch() if waited else None
+            if result is not None:
+                single_flight_counter.labels(name=self.name, role="remote_waiter").inc()
+                return result
+            single_flight_counter.labels(name=self.name, role="leader").inc()
+            return await compute()
+        finally:
+            await self._release(lock_key, token)
+
+    async def _release(self, lock_key: str, token: str) -> None:
+        """Снять свою блокировку.
+
+        Проверка и удаление не атомарны: если блокировка истекла и её успел взять другой
+        процесс ровно между ними, он лишь посчитает результат ещё раз.
+        """
+        try:
+            holder = await self.redis_client.get(lock_key)
+            if isinstance(holder, bytes):
+                holder = holder.decode("utf-8")
+            if holder == token:
+                await self.redis_client.delete(lock_key)
+        except Exception:
+            return
@@ -25,6 +25,10 @@ logger = logging.getLogger(__name__)
 from app.ml.nlp.embedding_service import EmbeddingService
 from app.ml.nlp.vector_db import VectorDB
 from app.ml.cv.embedding.image_embedding_service import ImageEmbeddingService
+from app.ml.recsys.content_based import task_attributes
+
+
+REINDEX_BATCH_SIZE = 256
 
 
 @celery_app.task(name="process_task_tags_and_embedding")
@@ -44,6 +48,8 @@ async def _process_task_tags_and_embedding_async(task_id: int, title: str, descr
     
     text = f"{title}\n{description}"
     tags_result = ner_service.tag_task(text)
+    # Индекс воркера догоняет изменения API и других воркеров перед записью
+    await semantic_search_service.vector_db.sync()
     
     async with async_session() as session:
         await session.execute(
@@ -78,21 +84,47 @@ async def _reindex_tasks_async():
     except RuntimeError as e:
         logger.warning(f"Semantic search service not initialized: {e}")
         return
+
+    # Проверка `not in` ниже должна учитывать задачи, проиндексированные другими процессами
+    await semantic_search_service.vector_db.sync()
     
     async with async_session() as session:
         result = await session.execute(select(Task.id, Task.title, Task.description))
         tasks = result.all()
         
-        for task in tasks:
-            text = f"{task.title}\n{task.description}"
-            
-            task_id = str(task.id)
-            if task_id not in semantic_search_service.vector_db.ids:
-                await semantic_search_service.index(
-                    text=text,
-                    session=session,
-                    item_id=task_id
-                )
+        indexed = await semantic_search_service.vector_db.contains_many([str(task.id) for task in tasks])
+        missing = [task for task, present in zip(tasks, indexed) if not present]
+        for offset in range(0, len(missing), REINDEX_BATCH_SIZE):
+            batch = missing[offset:offset + REINDEX_BATCH_SIZE]
+            await semantic_search_service.index_many(
+                [f"{task.title}\n{task.description}" for task in batch],
+                session=session,
+                item_ids=[str(task.id) for task in batch],
+            )
+        await session.commit()
+
+    await _backfill_recsys_attributes()
+
+
+async def _backfill_recsys_attributes():
+    """Дозаполнить атрибуты фильтрации у векторов recsys, проиндексированных без них."""
+    try:
+        rs_vector_db: VectorDB = get_recsys_vector_db()
+    except RuntimeError as e:
+        logger.warning("Recommendation vector DB is not initialized: %s", e)
+        return
+
+    await rs_vector_db.sync()
+    missing = [int(item_id) for item_id in await rs_vector_db.ids_without_attributes() if item_id.isdigit()]
+    if not missing:
+        return
+
+    async with async_session() as session:
+        for offset in range(0, len(missing), REINDEX_BATCH_SIZE):
+            result = await session.execute(select(Task).where(Task.id.in_(missing[offset:offset + REINDEX_BATCH_SIZE])))
+            await rs_vector_db.set_attributes({str(task.id): task_attributes(task) for task in result.scalars()})
+    await rs_vector_db.maybe_checkpoint()
+    logger.info("Backfilled filter attributes for %d recommendation vectors", len(missing))
     
     
 @celery_app.task(name="update_recommendations_for_task")
@@ -121,7 +153,7 @@ async def _update_recommendations_for_task_async(task_id: int):
         text = f"{task.title}\n{task.description}"
         avatar_file = task.avatar_file  # Путь к файлу аватара, если он есть
         
-        text_embedding = embedding_service.encode_one(text).astype(np.float32)
+        text_embedding = (await embedding_service.encode_one_async(text)).astype(np.float32)
         image_embedding = np.zeros(512, dtype=np.float32)
 
         if avatar_file:
@@ -138,16 +170,53 @@ async def _update_recommendations_for_task_async(task_id: int):
         # Нормализуем эмбеддинг
         embedding = embedding / np.linalg.norm(embedding)    
         
-        # Добавить в vector_db (если нет) или обновить (если есть)
-        item_id = str(task_id)
-        if rs_vector_db.id_to_position.get(item_id) is not None:
-            await rs_vector_db.delete(item_id=item_id)
-
-        await rs_vector_db.add(
-            embeddings=embedding,
+        # Добавить в vector_db (если нет) или заменить вектор на месте (если есть)
+        await rs_vector_db.sync()
+        await rs_vector_db.upsert(
+            str(task_id),
+            embedding,
             session=session,
-            item_id=item_id,
+            attributes=task_attributes(task),
         )
+        await rs_vector_db.maybe_checkpoint()
+
+
+@celery_app.task(name="maintain_vector_indexes")
+@track_celery_task("maintain_vector_indexes")
+def maintain_vector_indexes():
+    """Периодическое обслуживание FAISS индексов: перевод в ANN индекс и компактизация."""
+    try:
+        asyncio.run(_maintain_vector_indexes_async())
+    except Exception as e:
+        logger.error(f"Error during vector index maintenance: {e}", exc_info=True)
+
+
+async def _maintain_vector_indexes_async():
+    """Асинхронная реализация обслуживания индексов."""
+    try:
+        semantic_search_service = get_semantic_search()
+        rs_vector_db: VectorDB = get_recsys_vector_db()
+    except RuntimeError as e:
+        logger.warning("Vector databases are not initialized: %s", e)
+        return
+
+    # Снапшот после обслуживания должен включать изменения всех процессов
+    await semantic_search_service.vector_db.sync()
+    await rs_vector_db.sync()
+
+    promoted = await semantic_search_service.vector_db.maybe_promote()
+    removed = await semantic_search_service.vector_db.compact()
+    # Перевод в ANN индекс и компактизация не пишутся в журнал: остальные процессы
+    # получают новый индекс по отметке опубликованного снапшота
+    if promoted or removed:
+        await semantic_search_service.save_index(publish=True)
+        await semantic_search_service.clear_cache()
+
+    promoted_recsys = await rs_vector_db.maybe_promote()
+    removed_recsys = await rs_vector_db.compact()
+    if promoted_recsys or removed_recsys:
+        await rs_vector_db.save_to_redis(publish=True)
+    logger.info("Vector index maintenance removed %d + %d vectors", removed, removed_recsys)
 
 
 @celery_app.task(name="warmup_llm", bind=True, max_retries=10)
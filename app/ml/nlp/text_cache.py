@@ -0,0 +1,99 @@
+"""
+LRU кеш текстов документов для гидратации результатов поиска VectorDB.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+
+
+# Примерные накладные расходы на запись: объекты str, узел OrderedDict, ключ словаря
+ENTRY_OVERHEAD = 160
+
+
+class TextCache:
+    """Ограниченный по объёму LRU кеш text_id -> текст.
+
+    Инвалидация идёт из потоков FAISS (под write-локом VectorDB), а чтение —
+    из event loop, поэтому операции защищены обычным мьютексом. Счётчик
+    version позволяет не сохранять строки, прочитанные из базы до инвалидации.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[str, int]] = OrderedDict() # text_id -> (текст, размер в байтах)
+        self._bytes = 0
+        self._version = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    @property
+    def version(self) -> int:
+        """Номер поколения кеша, увеличивается при каждой инвалидации."""
+        return self._version
+
+    def get_many(self, text_ids: Iterable[str]) -> dict[str, str]:
+        """Вернуть найденные в кеше тексты, отметив их как недавно использованные."""
+        found: dict[str, str] = {}
+        with self._lock:
+            for text_id in text_ids:
+                entry = self._entries.get(text_id)
+                if entry is None:
+                    self.misses += 1
+                    continue
+                self._entries.move_to_end(text_id)
+                found[text_id] = entry[0]
+                self.hits += 1
+        return found
+
+    def put_many(self, texts: dict[str, str], version: int | None = None) -> None:
+        """Сохранить тексты; пропустить, если с момента чтения version кеш инвалидировался."""
+        if self.max_bytes <= 0:
+            return
+
+        with self._lock:
+            if version is not None and version != self._version:
+                return
+            for text_id, text in texts.items():
+                self._remove(text_id)
+                size = self._entry_size(text_id, text)
+                if size > self.max_bytes:
+                    continue
+                self._entries[text_id] = (text, size)
+                self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, size) = self._entries.popitem(last=False)
+                self._bytes -= size
+
+    def invalidate(self, text_ids: Iterable[str]) -> None:
+        """Удалить тексты изменённых документов."""
+        with self._lock:
+            self._version += 1
+            for text_id in text_ids:
+                self._remove(text_id)
+
+    def clear(self) -> None:
+        """Очистить кеш целиком."""
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, text_id: str) -> None:
+        entry = self._entries.pop(text_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    @staticmethod
+    def _entry_size(text_id: str, text: str) -> int:
+        return len(text_id) + len(text.encode("utf-8")) + ENTRY_OVERHEAD
@@ -6,40 +6,154 @@ from __future__ import annotations
 
 import hashlib
 import json
+import logging
+import os
+import time
 from uuid import uuid4
 import pickle
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
 
 import faiss
 import numpy as np
 import redis.asyncio as redis
+from redis.exceptions import WatchError
 
-from sqlalchemy import select, insert
+from sqlalchemy import delete, select, insert
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core import config
 from app.db_models import Text
+from .faiss_index import (
+    COMPRESSIONS,
+    INDEX_TYPES,
+    build_index,
+    read_index_mmap,
+    requires_training,
+    search_parameters,
+    supports_remove,
+    train_index,
+)
+from .id_store import IdStore
+from .lexical_index import LexicalIndex
+from .rw_lock import AsyncRWLock
+from .text_cache import TextCache
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_OPEN_ATTEMPTS = 3
+LEXICAL_BACKFILL_BATCH_SIZE = 1000
 
 
+def _stream_id(entry_id: str | bytes) -> tuple[int, int]:
+    """Разобрать ID записи Redis Stream ("<ms>-<seq>") для сравнения."""
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+    milliseconds, _, sequence = entry_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+def _checkpoint_id(log_offset: str | None, created_ns: int) -> tuple[int, int, int]:
+    """Порядковый номер снапшота: смещение журнала, затем время создания для снапшотов одного смещения."""
+    return (*(_stream_id(log_offset) if log_offset else (0, 0)), created_ns)
+
+
 class VectorDB:
     """Класс для хранения эмбеддингов и поиска по ним с поддержкой Redis."""
 
     def __init__(
         self,
         dim: int,
-        redis_client: redis.Redis | None = None
+        redis_client: redis.Redis | None = None,
+        index_type: str | None = None,
+        compression: str | None = None,
+        exact_rerank: bool = False,
+        namespace: str = "vector_db",
+        background_compaction: bool = True,
     ) -> None:
         
         self.dim = dim # Размерность эмбеддингов
-        self.index = faiss.IndexFlatIP(dim) # Индекс для поиска по косинусной близости (нормализованные векторы)
-        self.ids: list[str] = []
-        self.id_to_position: dict[str, int] = {} # Словарь для быстрого поиска индекса по item_id
+        # Тип ANN индекса, в который переводится плоский индекс после порога размера корпуса
+        self.target_index_type = index_type or config.VECTOR_DB_INDEX_TYPE
+        if self.target_index_type not in INDEX_TYPES:
+            raise ValueError(f"Неизвестный тип индекса: {self.target_index_type}. Доступны: {', '.join(INDEX_TYPES)}")
+        # Формат хранения векторов в индексе (float16 / SQ8 / PQ сокращают RAM и размер снапшота)
+        self.compression = compression or config.VECTOR_DB_COMPRESSION
+        if self.compression not in COMPRESSIONS:
+            raise ValueError(f"Неизвестный режим сжатия: {self.compression}. Доступны: {', '.join(COMPRESSIONS)}")
+        self.index_type = "flat"
+        # SQ8 и PQ требуют обучения, поэтому до набора выборки храним векторы в float16
+        self.index_compression = "fp16" if requires_training(self.compression) else self.compression
+        # Индекс для поиска по косинусной близости (нормализованные векторы) со стабильными int64-метками
+        self.index = build_index(self.index_type, dim, compression=self.index_compression)
+        self.id_store = IdStore() # item_id <-> int64-метка в FAISS на массивах numpy
+        self._tombstones: set[int] = set() # Метки удалённых векторов, ещё не вычищенных из индекса
+        self._attributes: dict[int, dict[str, Any]] = {} # Атрибуты живых векторов для фильтрации (author_id, tags, ...)
+        self._postings: dict[str, dict[Any, set[int]]] = {} # Инвертированный индекс: атрибут -> значение -> метки
+        self.lexical_index = LexicalIndex() # BM25 по текстам документов для лексического и гибридного поиска
+        self._next_label = 0
         self.redis_client = redis_client
-        self.index_key = "vector_db:faiss_index"
-        self.ids_key = "vector_db:ids"
-        self.delete_cache_prefix = "vector_db:delete_cache:"
-        self.search_cache_prefix = "vector_db:search_cache:"
-        self._lock = asyncio.Lock() # Асинхронный лок для обеспечения потокобезопасности при добавлении и поиске
+        # Точные float32 векторы в Redis для переранжирования кандидатов из сжатого индекса
+        self.exact_rerank = exact_rerank and redis_client is not None
+        self.index_key = f"{namespace}:faiss_index"
+        self.ids_key = f"{namespace}:ids"
+        # Номер последнего записанного снапшота: запись более старого снапшота отклоняется
+        self.checkpoint_key = f"{namespace}:checkpoint"
+        self.vectors_key = f"{namespace}:vectors"
+        self.log_key = f"{namespace}:oplog" # Журнал add/delete операций после последнего снапшота
+        self.next_label_key = f"{namespace}:next_label" # Общий для всех процессов счётчик меток
+        self._log_offset: str | None = None # ID последней записи журнала, отражённой в памяти
+        self._checkpoint: tuple[int, int, int] | None = None # Номер снапшота, на котором основан индекс в памяти
+        self._reload_pending = False # В журнале встретилась отметка более нового снапшота после обслуживания
+        self._ops_since_checkpoint = 0
+        # Снапшот записан до появления BM25: тексты документов подтягиваются из базы при первом лексическом поиске
+        self._lexical_backfill = False
+        self.search_cache_prefix = f"{namespace}:search_cache:"
+        # Поколение индекса в ключах кеша: изменение индекса делает INCR вместо удаления ключей,
+        # устаревшие записи просто истекают по TTL
+        self.generation_key = f"{namespace}:search_generation"
+        # Версионированные снапшоты на диске, которые процессы узла открывают через mmap
+        self.snapshot_dir = os.path.join(config.VECTOR_DB_SNAPSHOT_DIR, namespace) if config.VECTOR_DB_SNAPSHOT_DIR else None
+        self._snapshot_path: str | None = None # Путь к отображённому снапшоту, если self.index открыт через mmap
+        self._delta: faiss.IndexIDMap2 | None = None # Векторы, добавленные поверх read-only снапшота
+        # Поиски идут параллельно под read-локом, изменения индекса — эксклюзивно под write-локом
+        self._lock = AsyncRWLock()
+        self._mutations = 0 # Счётчик изменений для проверки, что индекс не менялся во время сборки снапшота
+        # FAISS отпускает GIL, поэтому тяжёлые вызовы выполняются в пуле потоков, не блокируя event loop
+        self._executor = ThreadPoolExecutor(max_workers=config.VECTOR_DB_THREADS, thread_name_prefix=f"{namespace}-faiss")
+        self._follower: asyncio.Task | None = None # Фоновое слежение за журналом изменений других процессов
+        self._compaction: asyncio.Task | None = None # Фоновая компактизация, запущенная порогом удалённых векторов
+        # Только для долгоживущего event loop: в Celery задаче loop закрывается сразу после записи
+        self.background_compaction = background_compaction
+        # Тексты горячих документов, чтобы повторные поиски не ходили в базу
+        self.text_cache = TextCache(config.VECTOR_DB_TEXT_CACHE_BYTES)
+
+    def __len__(self) -> int:
+        return len(self.id_store)
+
+    def __contains__(self, item_id: object) -> bool:
+        return str(item_id) in self.id_store
+
+    @property
+    def ids(self) -> list[str]:
+        """Список идентификаторов живых (не удалённых) документов."""
+        return self.id_store.ids()
+
+    async def all_ids(self) -> list[str]:
+        """То же, что ids; работает и для шардированной базы."""
+        return self.ids
+
+    async def size(self) -> int:
+        """Число живых документов; в отличие от len() работает и для шардированной базы."""
+        return len(self)
+
+    async def contains_many(self, item_ids: list[str]) -> list[bool]:
+        """Для каждого идентификатора: есть ли живой документ с ним в индексе."""
+        return [str(item_id) in self.id_store for item_id in item_ids]
 
     async def add(
         self,
@@ -47,8 +161,88 @@ class VectorDB:
         session: AsyncSession,
         item_id: str | list[str] | None = None,
         text: str | list[str] | None = None,
+        attributes: dict[str, Any] | list[dict[str, Any]] | None = None,
     ) -> str | list[str]:
-        """Добавить один или несколько эмбеддингов и сохранить тексты в базу данных."""
+        """Добавить один или несколько эмбеддингов и сохранить тексты в базу данных.
+
+        attributes — атрибуты документов (например, author_id и tags), по которым
+        работает фильтр filters в search/search_many.
+        """
+        resolved_item_ids = await self._write(embeddings, session, item_id, text, attributes, upsert=False)
+        return resolved_item_ids[0] if len(resolved_item_ids) == 1 else resolved_item_ids
+
+    async def upsert(
+        self,
+        item_id: str,
+        embedding: list[float] | np.ndarray,
+        session: AsyncSession,
+        text: str | None = None,
+        attributes: dict[str, Any] | None = None,
+    ) -> str:
+        """Заменить вектор документа (и его текст, если передан) или добавить документ, если его нет.
+
+        Замена идёт под одним write-локом: прежний вектор помечается удалённым за O(1)
+        и вычищается фоновой компактизацией, перестроения индекса нет.
+        """
+        [resolved_item_id] = await self.upsert_many(
+            [item_id],
+            np.asarray(embedding, dtype=np.float32).reshape(1, -1),
+            session=session,
+            texts=[text] if text is not None else None,
+            attributes=[attributes] if attributes is not None else None,
+        )
+        return resolved_item_id
+
+    async def upsert_many(
+        self,
+        item_ids: list[str],
+        embeddings: list[list[float]] | np.ndarray,
+        session: AsyncSession,
+        texts: list[str] | None = None,
+        attributes: list[dict[str, Any]] | None = None,
+    ) -> list[str]:
+        """Пакетный upsert: одна запись в индекс и журнал и один INSERT ... ON CONFLICT для текстов."""
+        if not item_ids:
+            raise ValueError("Список item_id не может быть пустым")
+        return await self._write(embeddings, session, list(item_ids), texts, attributes, upsert=True)
+
+    async def set_attributes(self, attributes: dict[str, dict[str, Any]]) -> int:
+        """Заменить атрибуты фильтрации уже проиндексированных документов, не трогая их векторы.
+
+        Нужен для дозаполнения атрибутов у векторов, добавленных без них. Документы,
+        которых нет в индексе, пропускаются. Возвращает число обновлённых документов.
+        """
+        async with self._lock.write():
+            updated = await self._run(self._apply_attributes, attributes)
+            if updated:
+                await self._append_log(
+                    [
+                        {"op": "attributes", "id": item_id, "attributes": json.dumps(attributes[item_id], ensure_ascii=False)}
+                        for item_id in updated
+                    ],
+                    updated,
+                )
+        return len(updated)
+
+    async def ids_without_attributes(self) -> list[str]:
+        """Идентификаторы живых документов, проиндексированных без атрибутов фильтрации."""
+        async with self._lock.read():
+            return [
+                self.id_store.id_of(label)
+                for label in self.id_store.live_labels().tolist()
+                if label not in self._attributes
+            ]
+
+    async def _write(
+        self,
+        embeddings: list[float] | list[list[float]] | np.ndarray,
+        session: AsyncSession,
+        item_id: str | list[str] | None,
+        text: str | list[str] | None,
+        attributes: dict[str, Any] | list[dict[str, Any]] | None,
+        upsert: bool,
+    ) -> list[str]:
+        """Проверить батч, записать векторы в индекс и тексты в базу данных."""
 
         vectors = np.asarray(embeddings, dtype=np.float32)
         if vectors.ndim == 1:
@@ -61,23 +255,23 @@ class VectorDB:
 
         item_ids = [item_id] if isinstance(item_id, str) else item_id
         texts = [text] if isinstance(text, str) else text
+        attributes_list = [attributes] if isinstance(attributes, dict) else attributes
 
         if item_ids is not None and len(item_ids) != batch_size:
             raise ValueError(f"Длина item_id ({len(item_ids)}) не совпадает с количеством эмбеддингов ({batch_size})")
         if texts is not None and len(texts) != batch_size:
             raise ValueError(f"Длина text ({len(texts)}) не совпадает с количеством эмбеддингов ({batch_size})")
+        if attributes_list is not None and len(attributes_list) != batch_size:
+            raise ValueError(f"Длина attributes ({len(attributes_list)}) не совпадает с количеством эмбеддингов ({batch_size})")
 
         resolved_item_ids = [str(value) for value in item_ids] if item_ids is not None else [str(uuid4()) for _ in range(batch_size)]
         resolved_texts = texts or [""] * batch_size
 
-        async with self._lock:
-            try:
-                self.index.add(vectors)
-                self.ids.extend(resolved_item_ids)
-            except Exception as e:
-                raise RuntimeError(f"Ошибка при добавлении эмбеддингов в индекс: {e}")
+        await self._add_vectors(resolved_item_ids, vectors, attributes_list, texts)
         
-        if any(resolved_texts):
+        if upsert and texts is not None:
+            await self._upsert_texts(session, resolved_item_ids, texts)
+        elif any(resolved_texts):
             await session.execute(
                 insert(Text).values([
                     {"text_id": current_id, "text": current_text}
@@ -85,12 +279,66 @@ class VectorDB:
                 ])
             )
 
-        start_index = len(self.ids) - batch_size
-        self.id_to_position.update(
-            {current_id: start_index + idx for idx, current_id in enumerate(resolved_item_ids)}
-        )
+        return resolved_item_ids
+
+    async def _upsert_texts(self, session: AsyncSession, item_ids: list[str], texts: list[str]) -> None:
+        """Записать тексты одним INSERT ... ON CONFLICT (text_id) DO UPDATE."""
+        # Повтор id в одном батче недопустим для ON CONFLICT, остаётся последняя версия
+        rows = {current_id: current_text for current_id, current_text in zip(item_ids, texts) if current_text}
+        if not rows:
+            return
+
+        values = [{"text_id": current_id, "text": current_text} for current_id, current_text in rows.items()]
+        dialect = session.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            statement = (postgresql if dialect == "postgresql" else sqlite).insert(Text).values(values)
+            statement = statement.on_conflict_do_update(index_elements=[Text.text_id], set_={"text": statement.excluded.text})
+            await session.execute(statement)
+        else:
+            await session.execute(delete(Text).where(Text.text_id.in_(rows)))
+            await session.execute(insert(Text).values(values))
+        # Строки могли попасть в кеш из базы между заменой вектора и записью текста
+        self.text_cache.invalidate(rows)
 
-        return resolved_item_ids[0] if batch_size == 1 else resolved_item_ids
+    async def _add_vectors(
+        self,
+        item_ids: list[str],
+        vectors: np.ndarray,
+        attributes: list[dict[str, Any] | None] | None = None,
+        texts: list[str] | None = None,
+    ) -> None:
+        """Добавить проверенные векторы в индекс, журнал изменений и хранилище точных векторов."""
+        async with self._lock.write():
+            labels = await self._allocate_labels(len(item_ids))
+            try:
+                replaced_labels = await self._run(self._apply_add, item_ids, labels, vectors, attributes, texts)
+            except Exception as e:
+                raise RuntimeError(f"Ошибка при добавлении эмбеддингов в индекс: {e}")
+
+            log_entries = [
+                {"op": "add", "id": current_id, "label": label, "vector": vector.tobytes()}
+                for current_id, label, vector in zip(item_ids, labels.tolist(), vectors)
+            ]
+            for entry, current_attributes in zip(log_entries, attributes or []):
+                if current_attributes:
+                    entry["attributes"] = json.dumps(current_attributes, ensure_ascii=False)
+            for entry, current_text in zip(log_entries, texts or []):
+                if current_text:
+                    # Текст нужен другим процессам для их лексического индекса
+                    entry["text"] = current_text
+            await self._append_log(log_entries, item_ids)
+
+        if self.exact_rerank:
+            async with self.redis_client.pipeline(transaction=False) as pipeline:
+                await pipeline.hset(
+                    self.vectors_key,
+                    mapping={label: vector.tobytes() for label, vector in zip(labels.tolist(), vectors)},
+                )
+                if replaced_labels:
+                    await pipeline.hdel(self.vectors_key, *replaced_labels)
+                await pipeline.execute()
+        if replaced_labels:
+            self._maybe_schedule_compaction()
     
     async def search(
         self,
@@ -98,46 +346,239 @@ class VectorDB:
         session: AsyncSession,
         top_k: int = config.DEFAULT_TOP_K,
         query: str | None = None,
+        nprobe: int | None = None,
+        ef_search: int | None = None,
+        filters: dict[str, Any] | None = None,
     ) -> list[dict]:
-        """Поиск наиболее похожих текстов по эмбеддингу запроса."""
+        """Поиск наиболее похожих текстов по эмбеддингу запроса.
 
-        cache_key = self._build_search_cache_key(query, top_k)
-        cached_result = await self._get_from_cache(cache_key) if cache_key else None
-        if cached_result is not None:
-            return cached_result
+        nprobe (IVF) и ef_search (HNSW) позволяют для отдельного запроса
+        обменять полноту на задержку; для плоского индекса игнорируются.
+        filters ограничивает поиск документами с заданными атрибутами:
+        {"author_id": 7, "tags": ["python", "redis"]} — автор 7 и хотя бы один из тегов.
+        """
 
         vector = np.asarray(query_embedding, dtype=np.float32)
         if vector.ndim != 1 or vector.size == 0 or vector.shape[0] != self.dim:
             raise ValueError(f"Эмбеддинг запроса должен быть непустым вектором размерности {self.dim}")
-        
-        async with self._lock:
-            if not self.ids:
-                return []
-            
-            # Проверка консистентности между индексом и ids
-            if self.index.ntotal != len(self.ids):
-                raise RuntimeError(f"Консистентность нарушена: размер индекса ({self.index.ntotal}) != размер ids ({len(self.ids)})")
+
+        results = await self.search_many(
+            vector.reshape(1, -1),
+            session=session,
+            top_k=top_k,
+            queries=[query],
+            nprobe=nprobe,
+            ef_search=ef_search,
+            filters=filters,
+        )
+        return results[0]
+
+    async def search_many(
+        self,
+        query_embeddings: list[list[float]] | np.ndarray,
+        session: AsyncSession,
+        top_k: int = config.DEFAULT_TOP_K,
+        queries: list[str | None] | None = None,
+        nprobe: int | None = None,
+        ef_search: int | None = None,
+        filters: dict[str, Any] | None = None,
+        generation: int | None = None,
+        cache_lookup: bool = True,
+    ) -> list[list[dict]]:
+        """Пакетный поиск: один вызов FAISS и один SQL запрос на все эмбеддинги.
+
+        Возвращает список результатов в порядке эмбеддингов. Тексты запросов
+        (queries) используются только как ключи кеша. Вызывающий, который уже
+        проверил кеш через get_cached_results, передаёт прочитанное поколение и
+        cache_lookup=False, чтобы не повторять GET поколения и MGET по промахам.
+        """
+
+        vectors = np.asarray(query_embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[0] == 0 or vectors.shape[1] != self.dim:
+            raise ValueError(f"Эмбеддинги запросов должны быть непустым массивом формы (n, {self.dim})")
+        if queries is not None and len(queries) != vectors.shape[0]:
+            raise ValueError(f"Длина queries ({len(queries)}) не совпадает с количеством эмбеддингов ({vectors.shape[0]})")
+
+        if generation is None and queries is not None and any(queries):
+            generation = await self.get_generation()
+        cache_keys = [
+            self._build_search_cache_key(current_query, top_k, nprobe, ef_search, filters, generation)
+            for current_query in (queries or [None] * vectors.shape[0])
+        ]
+        results = await self._get_many_from_cache(cache_keys) if cache_lookup else [None] * len(cache_keys)
+        pending = [position for position, cached in enumerate(results) if cached is None]
+        if not pending:
+            return results
+
+        hits = await self._search_hits(vectors[pending], top_k, nprobe, ef_search, filters)
+        for position, row in zip(pending, await self._hydrate(hits, session)):
+            results[position] = row
+
+        await self._save_many_to_cache(
+            {cache_keys[position]: results[position] for position in pending if cache_keys[position] and results[position]}
+        )
+        return results
+
+    async def get_vectors(self, item_ids: list[str]) -> np.ndarray:
+        """Восстановить векторы документов из индекса; для отсутствующих id — нулевые строки.
+
+        Для сжатых индексов (fp16, sq8, pq) векторы приблизительные.
+        """
+        vectors = np.zeros((len(item_ids), self.dim), dtype=np.float32)
+        async with self._lock.read():
+            labels = [self.id_store.get(item_id) for item_id in item_ids]
+            present = [position for position, label in enumerate(labels) if label is not None]
+            if present:
+                vectors[present] = await self._run(
+                    self._reconstruct, np.asarray([labels[position] for position in present], dtype=np.int64)
+                )
+        return vectors
+
+    async def get_cached_results(
+        self,
+        queries: list[str],
+        top_k: int = config.DEFAULT_TOP_K,
+        nprobe: int | None = None,
+        ef_search: int | None = None,
+        filters: dict[str, Any] | None = None,
+        generation: int | None = None,
+    ) -> list[list[dict] | None]:
+        """Результаты search_many из кеша по текстам запросов, без эмбеддингов; None — промах.
+
+        Позволяет не запускать энкодер для запросов, чей результат уже закеширован
+        в текущем поколении индекса. Поколение, прочитанное вызывающим, не читается повторно.
+        """
+        if generation is None:
+            generation = await self.get_generation()
+        return await self._get_many_from_cache([
+            self._build_search_cache_key(query, top_k, nprobe, ef_search, filters, generation)
+            for query in queries
+        ])
+
+    async def cache_results(
+        self,
+        results: dict[str, list[dict]],
+        top_k: int = config.DEFAULT_TOP_K,
+        nprobe: int | None = None,
+        ef_search: int | None = None,
+        generation: int | None = None,
+    ) -> None:
+        """Положить в кеш поиска готовые результаты по текстам запросов, например после слияния с BM25.
+
+        Читаются они через get_cached_results с теми же параметрами.
+        """
+        entries = {}
+        for query, rows in results.items():
+            cache_key = self._build_search_cache_key(query, top_k, nprobe, ef_search, None, generation)
+            if cache_key and rows:
+                entries[cache_key] = rows
+        await self._save_many_to_cache(entries)
+
+    async def _search_hits(
+        self,
+        vectors: np.ndarray,
+        top_k: int,
+        nprobe: int | None = None,
+        ef_search: int | None = None,
+        filters: dict[str, Any] | None = None,
+    ) -> list[list[tuple[str, float]]]:
+        """Найти top_k пар (item_id, близость) для каждого эмбеддинга без обращения к кешу и базе."""
+        async with self._lock.read():
+            if not len(self.id_store):
+                return [[] for _ in vectors]
 
-            limit = min(top_k, len(self.ids))
-            similarities, indices = self.index.search(vector.reshape(1, -1), limit)
-
-        results: list[dict] = []
-        valid_indices = [idx for idx in indices[0] if 0 <= idx < len(self.ids)]
-        valid_index_set = set(valid_indices)
-        if valid_indices:
-            text_ids = [self.ids[idx] for idx in valid_indices]
-            texts = await session.execute(select(Text).where(Text.text_id.in_(text_ids)))
-            text_map = {text.text_id: text.text for text in texts.scalars().all()}
-
-            for idx, sim in zip(indices[0], similarities[0]):
-                if idx not in valid_index_set:
-                    continue
+            # При переранжировании берём больше кандидатов из сжатого индекса
+            candidates = top_k * config.VECTOR_DB_RERANK_FACTOR if self.exact_rerank else top_k
+            allowed = self._filter_labels(filters) if filters else None
+            if allowed is None:
+                # Удалённые векторы остаются в индексе до компактизации, поэтому запрашиваем с запасом,
+                # ограниченным кратным candidates, чтобы стоимость поиска не росла с числом удалений
+                overfetch = min(len(self._tombstones), candidates * config.VECTOR_DB_TOMBSTONE_OVERFETCH_FACTOR)
+                limit = min(candidates + overfetch, self._ntotal())
+                params = search_parameters(self.index, nprobe=nprobe, ef_search=ef_search)
+                similarities, labels = await self._run(self._search_index, vectors, limit, params)
+            elif not allowed.size:
+                return [[] for _ in vectors]
+            elif allowed.size <= config.VECTOR_DB_FILTER_EXACT_LIMIT:
+                # Узкий фильтр: точный перебор подходящих векторов быстрее и не теряет полноту ANN
+                similarities, labels = await self._run(self._search_exact, vectors, allowed, candidates)
+            else:
+                # Фильтр применяется внутри FAISS, поэтому top_k набирается только из подходящих векторов
+                selector = faiss.IDSelectorBatch(allowed)
+                params = search_parameters(self.index, nprobe=nprobe, ef_search=ef_search, selector=selector)
+                similarities, labels = await self._run(
+                    self._search_index, vectors, min(candidates, allowed.size), params, selector
+                )
+            alive = self.id_store.alive_mask(labels)
+            candidate_hits = [
+                [
+                    (label, sim)
+                    for label, sim, is_alive in zip(row_labels.tolist(), row_similarities.tolist(), row_alive.tolist())
+                    if is_alive
+                ][:candidates]
+                for row_labels, row_similarities, row_alive in zip(labels, similarities, alive)
+            ]
+            if allowed is None and self._tombstones:
+                await self._refill_short_rows(vectors, candidate_hits, candidates, nprobe, ef_search)
+            if self.exact_rerank:
+                candidate_hits = await self._rerank_many(vectors, candidate_hits)
+            return [[(self.id_store.id_of(label), score) for label, score in row[:top_k]] for row in candidate_hits]
+
+    async def _refill_short_rows(
+        self,
+        vectors: np.ndarray,
+        candidate_hits: list[list[tuple[int, float]]],
+        candidates: int,
+        nprobe: int | None,
+        ef_search: int | None,
+    ) -> None:
+        """Повторить поиск для строк, где запас съели удалённые векторы (под read-локом).
+
+        Удалённые метки исключаются внутри FAISS селектором, поэтому повтор
+        возвращает полный список кандидатов независимо от числа удалений.
+        """
+        expected = min(candidates, len(self.id_store))
+        short = [position for position, row in enumerate(candidate_hits) if len(row) < expected]
+        if not short:
+            return
+
+        tombstones = faiss.IDSelectorBatch(np.fromiter(self._tombstones, dtype=np.int64, count=len(self._tombstones)))
+        selector = faiss.IDSelectorNot(tombstones)
+        params = search_parameters(self.index, nprobe=nprobe, ef_search=ef_search, selector=selector)
+        similarities, labels = await self._run(
+            self._search_index, vectors[short], min(candidates, self._ntotal()), params, selector
+        )
+        alive = self.id_store.alive_mask(labels)
+        for position, row_labels, row_similarities, row_alive in zip(short, labels, similarities, alive):
+            candidate_hits[position] = [
+                (label, sim)
+                for label, sim, is_alive in zip(row_labels.tolist(), row_similarities.tolist(), row_alive.tolist())
+                if is_alive
+            ]
 
-                text_id = self.ids[idx]
+    async def _hydrate(self, hits: list[list[tuple[str, float]]], session: AsyncSession) -> list[list[dict]]:
+        """Подтянуть тексты найденных документов из LRU кеша, а недостающие — одним SQL запросом."""
+        text_ids = {text_id for row in hits for text_id, _ in row}
+        if not text_ids:
+            return [[] for _ in hits]
+
+        text_map = self.text_cache.get_many(text_ids)
+        missing = text_ids.difference(text_map)
+        if missing:
+            cache_version = self.text_cache.version
+            texts = await session.execute(select(Text.text_id, Text.text).where(Text.text_id.in_(missing)))
+            loaded = dict(texts.all())
+            # Отсутствующие в базе строки не кешируются: текст мог ещё не быть закоммичен
+            self.text_cache.put_many(loaded, cache_version)
+            text_map.update(loaded)
+
+        results: list[list[dict]] = []
+        for row in hits:
+            row_results: list[dict] = []
+            for text_id, score in row:
                 text_value = text_map.get(text_id, "")
                 title, _, description = text_value.partition("\n")
-                score = float(sim)
-                results.append(
+                row_results.append(
                     {
                         "text_id": text_id,
                         "similarity": score,
@@ -148,142 +589,933 @@ class VectorDB:
                         "score": score,
                     }
                 )
-
-        if cache_key and results:
-            await self._save_to_cache(cache_key, results)
+            results.append(row_results)
         return results
 
-    async def save_to_redis(self) -> bool:
-        """Сохранить индекс и метаданные в Redis."""
+    async def lexical_search_many(
+        self,
+        queries: list[str],
+        session: AsyncSession,
+        top_k: int = config.DEFAULT_TOP_K,
+        filters: dict[str, Any] | None = None,
+    ) -> list[list[dict]]:
+        """Лексический BM25 поиск без эмбеддингов, результаты в формате search_many.
+
+        score и lexical_score — BM25. similarity остаётся косинусной мерой плотного
+        поиска: без эмбеддинга запроса она неизвестна и равна None.
+        """
+        await self._backfill_lexical_index(session)
+        hits = await self._lexical_hits(queries, top_k, filters)
+        results = await self._hydrate(hits, session)
+        for row in results:
+            for item in row:
+                item["lexical_score"] = item["score"]
+                item["similarity"] = None
+        return results
+
+    async def _backfill_lexical_index(self, session: AsyncSession) -> None:
+        """Проиндексировать в BM25 тексты документов, загруженных из снапшота без лексического индекса.
+
+        Тексты читаются из базы батчами вне локов; документы, удалённые или
+        переиндексированные за это время, пропускаются.
+        """
+        if not self._lexical_backfill:
+            return
+        missing = await self.ids_without_lexical()
+        for offset in range(0, len(missing), LEXICAL_BACKFILL_BATCH_SIZE):
+            batch = missing[offset:offset + LEXICAL_BACKFILL_BATCH_SIZE]
+            rows = await session.execute(select(Text.text_id, Text.text).where(Text.text_id.in_(batch)))
+            await self._index_lexical_texts(dict(rows.all()))
+        self._lexical_backfill = False
+        if missing:
+            logger.info("Лексический индекс %s дополнен по %d документам из базы", self.ids_key, len(missing))
+
+    async def ids_without_lexical(self) -> list[str]:
+        """Идентификаторы живых документов, которых нет в лексическом индексе."""
+        async with self._lock.read():
+            return [item_id for item_id in self.id_store.ids() if not self.lexical_index.has_document(item_id)]
+
+    async def _index_lexical_texts(self, texts: dict[str, str]) -> None:
+        async with self._lock.write():
+            for item_id, text in texts.items():
+                if item_id in self.id_store and not self.lexical_index.has_document(item_id):
+                    self.lexical_index.add(item_id, text)
+
+    async def _lexical_hits(
+        self,
+        queries: list[str],
+        top_k: int,
+        filters: dict[str, Any] | None = None,
+    ) -> list[list[tuple[str, float]]]:
+        """Найти top_k пар (item_id, BM25) для каждого запроса."""
+        async with self._lock.read():
+            allowed = None
+            if filters:
+                allowed = {self.id_store.id_of(label) for label in self._filter_labels(filters).tolist()}
+            return await self._run(
+                lambda: [self.lexical_index.search(query, top_k, allowed) for query in queries]
+            )
+
+    async def maybe_checkpoint(self) -> bool:
+        """Сделать снапшот, если журнал изменений перерос интервал контрольных точек."""
+        if self._ops_since_checkpoint < config.VECTOR_DB_CHECKPOINT_INTERVAL:
+            return False
+        return await self.save_to_redis()
+
+    async def save_to_redis(self, publish: bool = False) -> bool:
+        """Сохранить снапшот индекса и метаданных в Redis и обрезать журнал изменений.
+
+        Запись идёт как compare-and-set по номеру снапшота: если другой процесс уже
+        записал более новый снапшот, этот не записывается и журнал не обрезается,
+        иначе старый снапшот затёр бы новый, а нужные ему записи журнала были бы удалены.
+        publish=True дописывает в журнал отметку снапшота: после перевода в ANN индекс
+        или компактизации другие процессы по ней перезагружают индекс из снапшота,
+        ведь сами эти операции в журнал не попадают.
+        """
         if self.redis_client is None:
             return False
 
         try:
-            async with self._lock:
-                index_data = faiss.serialize_index(self.index)
-                ids_data = pickle.dumps(self.ids)
-            
+            async with self._lock.write():
+                await self._run(self._prepare_checkpoint)
+
+            # Сериализация и запись файла идут под read-локом, поиск при этом не блокируется
+            async with self._lock.read():
+                mutations = self._mutations
+                checkpointed_ops = self._ops_since_checkpoint
+                log_offset = self._log_offset
+                checkpoint = _checkpoint_id(log_offset, time.time_ns())
+                index_data, ids_data, snapshot_version = await self._run(self._serialize_checkpoint, checkpoint)
+
+            async with self._lock.write():
+                self._ops_since_checkpoint = max(0, self._ops_since_checkpoint - checkpointed_ops)
+                # Если индекс успел измениться, снапшот откроется через mmap при следующей контрольной точке
+                if snapshot_version is not None and self._mutations == mutations:
+                    mapped_index = await self._run(self._read_snapshot, snapshot_version)
+                    if mapped_index is not None:
+                        self._use_snapshot(mapped_index, snapshot_version)
+
+            if not await self._write_checkpoint(checkpoint, index_data, ids_data, log_offset, publish):
+                logger.info("Снапшот %s устарел: в Redis уже записан более новый", self.index_key)
+                return False
+            self._checkpoint = checkpoint
+            return True
+        except Exception:
+            return False
+
+    async def _write_checkpoint(
+        self,
+        checkpoint: tuple[int, int, int],
+        index_data: bytes,
+        ids_data: bytes,
+        log_offset: str | None,
+        publish: bool,
+        attempts: int = 3,
+    ) -> bool:
+        """Записать снапшот, только если он новее записанного (WATCH + MULTI); False — снапшот устарел."""
+        encoded_checkpoint = ",".join(map(str, checkpoint))
+        for _ in range(attempts):
             async with self.redis_client.pipeline(transaction=True) as pipeline:
+                await pipeline.watch(self.checkpoint_key)
+                stored = await pipeline.get(self.checkpoint_key)
+                if isinstance(stored, bytes):
+                    stored = stored.decode()
+                if stored and tuple(int(part) for part in stored.split(",")) >= checkpoint:
+                    return False
+
+                pipeline.multi()
                 await pipeline.set(self.index_key, index_data)
                 await pipeline.set(self.ids_key, ids_data)
-                await pipeline.execute()
-            return True
-        except Exception:
-            return False
+                await pipeline.set(self.checkpoint_key, encoded_checkpoint)
+                if log_offset is not None:
+                    # Записи до снапшота больше не нужны для восстановления
+                    await pipeline.xtrim(self.log_key, minid=log_offset, approximate=False)
+                if publish:
+                    await pipeline.xadd(self.log_key, {"op": "snapshot", "id": "", "checkpoint": encoded_checkpoint})
+                try:
+                    await pipeline.execute()
+                    return True
+                except WatchError:
+                    # Параллельно записан другой снапшот: сравниваем заново
+                    continue
+        return False
 
     async def load_from_redis(self) -> bool:
-        """Загрузить индекс и метаданные из Redis."""
+        """Загрузить снапшот индекса из Redis и доиграть журнал изменений после него."""
         if self.redis_client is None:
             return False
 
         try:
-            index_bytes = await self.redis_client.get(self.index_key)
-            ids_bytes = await self.redis_client.get(self.ids_key)
+            # Снапшот, уже лежащий на диске узла, открывается через mmap без чтения блоба из Redis:
+            # версия файла записана в самих метаданных, поэтому они заведомо из одного снапшота.
+            # Файл может исчезнуть при открытии, если его вытеснила новая контрольная точка, —
+            # тогда перечитываем метаданные: файл новой версии, скорее всего, уже на диске
+            index_bytes = mapped_index = None
+            for _ in range(SNAPSHOT_OPEN_ATTEMPTS):
+                ids_bytes = await self.redis_client.get(self.ids_key)
+                metadata = self._parse_metadata(ids_bytes)
+                snapshot_version = metadata.get("snapshot_version") if metadata and self.snapshot_dir else None
+                if snapshot_version is None:
+                    break
+                mapped_index = await self._run(self._read_snapshot, snapshot_version)
+                if mapped_index is not None:
+                    break
+
+            if mapped_index is None:
+                # Метаданные и индекс читаются одним MGET, иначе между двумя GET мог
+                # записаться новый снапшот и они оказались бы от разных снапшотов
+                ids_bytes, index_bytes = await self.redis_client.mget([self.ids_key, self.index_key])
+                metadata = self._parse_metadata(ids_bytes)
+                snapshot_version = metadata.get("snapshot_version") if metadata and self.snapshot_dir else None
 
-            async with self._lock:
-                if index_bytes:
-                    self.index = faiss.deserialize_index(index_bytes)
-                if ids_bytes:
-                    self.ids = pickle.loads(ids_bytes)
-                self.id_to_position = {current_id: idx for idx, current_id in enumerate(self.ids)}
+            async with self._lock.write():
+                await self._run(self._install_snapshot, index_bytes, snapshot_version, mapped_index)
+                if metadata:
+                    self.id_store = IdStore.from_bytes(metadata["ids"])
+                    self.text_cache.clear()
+                    self._tombstones = set(metadata["tombstones"])
+                    self._next_label = metadata["next_label"]
+                    self.index_type = metadata.get("index_type", "flat")
+                    self.index_compression = metadata.get("compression", "none")
+                    self._log_offset = metadata.get("log_offset")
+                    self._checkpoint = metadata.get("checkpoint")
+                    self._attributes = {}
+                    self._postings = {}
+                    for label, attributes in metadata.get("attributes", {}).items():
+                        self._set_attributes(label, attributes)
+                    self.lexical_index = LexicalIndex.from_state(metadata.get("lexical", {}))
+                    self._lexical_backfill = "lexical" not in metadata
+                if not isinstance(self.index, faiss.IndexIDMap2):
+                    self.index = await self._run(self._wrap_legacy_index, self.index)
+                self._mutations += 1
+                self._reload_pending = False
 
-            return bool(index_bytes or ids_bytes)
+                replayed = await self._replay_log()
+
+            return bool(index_bytes or self._snapshot_path or ids_bytes or replayed)
         except Exception:
             return False
         
+    @staticmethod
+    def _parse_metadata(ids_bytes: bytes | None) -> dict[str, Any] | None:
+        """Разобрать метаданные снапшота, приводя старые форматы к текущему."""
+        metadata = pickle.loads(ids_bytes) if ids_bytes else None
+        if isinstance(metadata, list):
+            # Старый формат: список ids по позициям плоского индекса
+            metadata = {"label_to_id": dict(enumerate(metadata)), "tombstones": set(), "next_label": len(metadata)}
+        if metadata and "ids" not in metadata:
+            # Формат со словарём меток переводится в компактное хранилище
+            metadata["ids"] = IdStore.from_mapping(metadata.pop("label_to_id")).to_bytes()
+        return metadata
+
     async def delete(
         self, 
         item_id: str
     ) -> None:
-        """Удалить документ из индекса, сохранив остальные записи через кэш Redis."""
+        """Удалить документ из индекса за O(1), пометив его вектор как удалённый."""
 
-        async with self._lock:
-            if item_id not in self.id_to_position:
+        async with self._lock.write():
+            label = await self._run(self._apply_delete, item_id)
+            if label is None:
                 return
 
-            retained_ids = [current_id for current_id in self.ids if current_id != item_id]
-            retained_vectors: dict[str, np.ndarray] = {
-                current_id: self.index.reconstruct(idx)
-                for idx, current_id in enumerate(self.ids)
-                if current_id != item_id
-            }
-
-            if self.redis_client is not None:
-                for current_id in retained_ids:
-                    cache_key = f"{self.delete_cache_prefix}{current_id}"
-                    cached_vector = await self.redis_client.get(cache_key)
-                    
-                    if cached_vector is None:
-                        await self.redis_client.set(cache_key, pickle.dumps(retained_vectors[current_id]))
-
-            self.index.reset() # Сброс индекса, так как FAISS не поддерживает удаление отдельных векторов
-            self.ids = retained_ids
-            self.id_to_position = {current_id: idx for idx, current_id in enumerate(self.ids)}
+            await self._append_log([{"op": "delete", "id": item_id, "label": label}], [item_id])
+
+        if self.exact_rerank:
+            await self.redis_client.hdel(self.vectors_key, label)
+        self._maybe_schedule_compaction()
+
+    async def sync(self) -> bool:
+        """Применить изменения, сделанные другими процессами; вернуть True, если индекс изменился.
+
+        Обычно доигрывается хвост журнала. Если журнал уже обрезан контрольной точкой
+        другого процесса дальше текущего смещения, индекс заменяется новым снапшотом.
+        """
+        if self.redis_client is None:
+            return False
+
+        try:
+            head = await self.redis_client.xrange(self.log_key, min="-", max="+", count=1)
+            if head and (self._log_offset is None or _stream_id(head[0][0]) > _stream_id(self._log_offset)):
+                changed = await self.load_from_redis()
+            else:
+                async with self._lock.write():
+                    changed = bool(await self._replay_log())
+                if self._reload_pending:
+                    # Другой процесс перестроил индекс и опубликовал снапшот: подменяем свой целиком
+                    changed = await self.load_from_redis() or changed
+            self._maybe_schedule_compaction()
+            return changed
+        except Exception as exc:
+            logger.warning("Не удалось синхронизировать индекс %s: %s", self.log_key, exc)
+            return False
+
+    async def follow(self, block_ms: int = config.VECTOR_DB_SYNC_BLOCK_MS) -> None:
+        """Следить за журналом и применять изменения других процессов по мере появления.
+
+        XREAD BLOCK возвращается сразу после новой записи, поэтому задержка
+        распространения определяется сетью, а не интервалом опроса.
+        """
+        while True:
+            try:
+                if self._reload_pending:
+                    await self.sync()
+                entries = await self.redis_client.xread({self.log_key: self._log_offset or "0-0"}, count=1, block=block_ms)
+                if entries and not await self.sync():
+                    # Не крутимся вхолостую, если журнал недоступен для применения
+                    await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("Ошибка чтения журнала %s: %s", self.log_key, exc)
+                await asyncio.sleep(block_ms / 1000)
+
+    def start_following(self) -> None:
+        """Запустить фоновое слежение за журналом в текущем event loop."""
+        if self.redis_client is not None and (self._follower is None or self._follower.done()):
+            self._follower = asyncio.create_task(self.follow())
+
+    async def stop_following(self) -> None:
+        """Остановить фоновое слежение за журналом."""
+        if self._follower is None:
+            return
+        self._follower.cancel()
+        try:
+            await self._follower
+        except asyncio.CancelledError:
+            pass
+        self._follower = None
 
-            vectors_to_restore: list[np.ndarray] = []
-            keys_to_cleanup: list[str] = []
+    async def compact(self) -> int:
+        """Физически удалить из индекса все помеченные векторы. Возвращает число удалённых."""
+        async with self._lock.write():
+            if not self._tombstones:
+                return 0
+            await self._run(self._materialize)
+            if supports_remove(self.index):
+                return await self._run(self._remove_tombstones)
+
+            removed = len(self._tombstones)
+            index_type, compression = self.index_type, self.index_compression
+
+        await self._rebuild(index_type, compression)
+        return removed
+
+    def _maybe_schedule_compaction(self) -> None:
+        """Запустить компактизацию в фоне, если доля удалённых векторов перешла порог.
+
+        Так индексы без remove_ids (HNSW, отображённый снапшот) вычищаются в каждом
+        процессе сразу, не дожидаясь периодической задачи обслуживания. Экземпляры с
+        background_compaction=False (Celery воркеры, asyncio.run на задачу) оставляют
+        компактизацию задаче maintain_vector_indexes: закрытие loop отменило бы задачу,
+        а перестройка в пуле потоков продолжилась бы без write-лока.
+        """
+        if not self.background_compaction:
+            return
+        if self._compaction is not None and not self._compaction.done():
+            return
+        if not self._tombstones or not self._needs_compaction():
+            return
+        self._compaction = asyncio.create_task(self._compact_in_background())
+
+    async def _compact_in_background(self) -> None:
+        try:
+            removed = await self.compact()
+            logger.info("Компактизация %s удалила %d векторов", self.index_key, removed)
+        except Exception as exc:
+            logger.warning("Не удалось компактизировать индекс %s: %s", self.index_key, exc)
+
+    async def maybe_promote(self) -> bool:
+        """Перестроить индекс в целевой ANN тип и формат сжатия, если корпус перерос пороги."""
+        async with self._lock.read():
+            index_type, compression = self._target_layout()
+            if (index_type, compression) == (self.index_type, self.index_compression):
+                return False
+
+        await self._rebuild(index_type, compression)
+        return True
+
+    def _target_layout(self) -> tuple[str, str]:
+        """Тип индекса и формат сжатия, подходящие текущему размеру корпуса."""
+        size = len(self.id_store)
+        index_type = self.target_index_type if size >= config.VECTOR_DB_PROMOTION_THRESHOLD else "flat"
+        compression = self.compression
+        if requires_training(compression) and size < config.VECTOR_DB_COMPRESSION_TRAIN_SIZE:
+            compression = "fp16"
+        return index_type, compression
+
+    def _apply_add(
+        self,
+        item_ids: list[str],
+        labels: np.ndarray,
+        vectors: np.ndarray,
+        attributes: list[dict[str, Any] | None] | None = None,
+        texts: list[str | None] | None = None,
+    ) -> list[int]:
+        """Добавить векторы с заданными метками; вернуть метки заменённых векторов (под write-локом)."""
+        self._writable_index().add_with_ids(vectors, labels)
+        self._mutations += 1
+        self._next_label = max(self._next_label, int(labels.max()) + 1)
+
+        # Повторное добавление того же item_id заменяет старый вектор
+        replaced_labels = self.id_store.set_many(item_ids, labels)
+        self.text_cache.invalidate(item_ids)
+        for previous_label in replaced_labels:
+            self._tombstones.add(previous_label)
+            self._drop_attributes(previous_label)
+        for label, current_attributes in zip(labels.tolist(), attributes or []):
+            if current_attributes:
+                self._set_attributes(label, current_attributes)
+        for item_id, text in zip(item_ids, texts or []):
+            if text:
+                self.lexical_index.add(item_id, text)
+        return replaced_labels
+
+    def _apply_delete(self, item_id: str) -> int | None:
+        """Пометить вектор документа как удалённый; вернуть его метку (под write-локом)."""
+        label = self.id_store.pop(item_id)
+        if label is None:
+            return None
+        self._mutations += 1
+        self.text_cache.invalidate([item_id])
+        self.lexical_index.remove(item_id)
+
+        self._drop_attributes(label)
+        self._tombstones.add(label)
+
+        # ANN индексы не поддерживают удаление и компактизируются перестроением в фоне,
+        # отображённый снапшот read-only и вычищается при следующей контрольной точке
+        if self._snapshot_path is None and supports_remove(self.index) and self._needs_compaction():
+            self._remove_tombstones()
+        return label
+
+    async def _append_log(self, entries: list[dict], item_ids: list[str]) -> None:
+        """Дописать операции в журнал изменений Redis (вызывается под write-локом).
+
+        В той же транзакции читаются записи других процессов, появившиеся после
+        текущего смещения: они применяются здесь, чтобы смещение не перескочило через них.
+        """
+        if self.redis_client is None:
+            return
+
+        start = f"({self._log_offset}" if self._log_offset else "-"
+        try:
+            async with self.redis_client.pipeline(transaction=True) as pipeline:
+                await pipeline.xrange(self.log_key, min=start, max="+")
+                for entry in entries:
+                    await pipeline.xadd(self.log_key, entry)
+                # Инвалидация кеша поиска за O(1): записи прошлого поколения больше не читаются
+                await pipeline.incr(self.generation_key)
+                foreign_entries, *entry_ids, _ = await pipeline.execute()
+        except Exception as exc:
+            logger.warning("Не удалось записать журнал изменений %s: %s", self.log_key, exc)
+            return
+
+        if foreign_entries:
+            # Свои операции уже применены и в журнале стоят позже, поэтому по тем же id они главнее
+            await self._run(self._apply_log_entries, [fields for _, fields in foreign_entries], set(item_ids))
+            # Новый снапшот подхватит следующий sync, прерывать запись ради перезагрузки нельзя
+            self._reload_pending = self._reload_pending or self._newer_snapshot_at(foreign_entries) is not None
+        last_id = entry_ids[-1]
+        self._log_offset = last_id.decode() if isinstance(last_id, bytes) else last_id
+        self._ops_since_checkpoint += len(entries) + len(foreign_entries)
+
+    async def _allocate_labels(self, count: int) -> np.ndarray:
+        """Выделить диапазон меток, уникальный для всех процессов (вызывается под write-локом)."""
+        start = self._next_label
+        if self.redis_client is not None:
+            try:
+                end = await self.redis_client.incrby(self.next_label_key, count)
+                if end - count < self._next_label:
+                    # Счётчик отстаёт от меток снапшота: резервируем диапазон не ниже локального
+                    end = await self.redis_client.incrby(self.next_label_key, max(count, self._next_label + count - end))
+                start = end - count
+            except Exception as exc:
+                logger.warning("Не удалось выделить метки через %s: %s", self.next_label_key, exc)
+        return np.arange(start, start + count, dtype=np.int64)
+
+    async def _replay_log(self, chunk_size: int = 1000) -> int:
+        """Применить записи журнала после текущего смещения (вызывается под write-локом)."""
+        replayed = 0
+        while True:
+            start = f"({self._log_offset}" if self._log_offset else "-"
+            entries = await self.redis_client.xrange(self.log_key, min=start, max="+", count=chunk_size)
+            if not entries:
+                return replayed
+
+            snapshot_at = self._newer_snapshot_at(entries)
+            if snapshot_at is not None:
+                # Записи после отметки уже входят в новый снапшот, дальше индекс заменяется загрузкой
+                entries = entries[:snapshot_at]
+                self._reload_pending = True
+            if entries:
+                await self._run(self._apply_log_entries, [fields for _, fields in entries])
+                last_id = entries[-1][0]
+                self._log_offset = last_id.decode() if isinstance(last_id, bytes) else last_id
+                self._ops_since_checkpoint += len(entries)
+                replayed += len(entries)
+            if snapshot_at is not None:
+                return replayed
+
+    def _newer_snapshot_at(self, entries: list[tuple[Any, dict]]) -> int | None:
+        """Позиция первой отметки снапшота новее того, на котором основан индекс в памяти."""
+        for position, (_, fields) in enumerate(entries):
+            if fields.get(b"op") != b"snapshot":
+                continue
+            checkpoint = tuple(int(part) for part in fields[b"checkpoint"].decode().split(","))
+            if self._checkpoint is None or checkpoint > tuple(self._checkpoint):
+                return position
+        return None
+
+    def _apply_log_entries(self, entries: list[dict], skip_ids: set[str] | None = None) -> None:
+        """Применить записи журнала, объединяя подряд идущие добавления в один батч.
+
+        Записи по id из skip_ids пропускаются: их перекрывают более поздние операции.
+        """
+        pending_ids: list[str] = []
+        pending_labels: list[int] = []
+        pending_vectors: list[bytes] = []
+        pending_attributes: list[dict[str, Any] | None] = []
+        pending_texts: list[str | None] = []
+
+        def flush_adds() -> None:
+            if pending_ids:
+                vectors = np.frombuffer(b"".join(pending_vectors), dtype=np.float32).reshape(-1, self.dim)
+                self._apply_add(
+                    list(pending_ids),
+                    np.asarray(pending_labels, dtype=np.int64),
+                    vectors,
+                    list(pending_attributes),
+                    list(pending_texts),
+                )
+                pending_ids.clear()
+                pending_labels.clear()
+                pending_vectors.clear()
+                pending_attributes.clear()
+                pending_texts.clear()
+
+        for fields in entries:
+            op = fields[b"op"].decode()
+            item_id = fields[b"id"].decode()
+            if skip_ids and item_id in skip_ids:
+                continue
+            if op == "add":
+                pending_ids.append(item_id)
+                pending_labels.append(int(fields[b"label"]))
+                pending_vectors.append(fields[b"vector"])
+                attributes = fields.get(b"attributes")
+                pending_attributes.append(json.loads(attributes) if attributes else None)
+                text = fields.get(b"text")
+                pending_texts.append(text.decode() if text else None)
+            elif op == "delete":
+                flush_adds()
+                self._apply_delete(item_id)
+            elif op == "attributes":
+                flush_adds()
+                self._apply_attributes({item_id: json.loads(fields[b"attributes"])})
+            # Отметки снапшотов ("snapshot") обрабатываются в _replay_log
+        flush_adds()
+
+    def _apply_attributes(self, attributes: dict[str, dict[str, Any]]) -> list[str]:
+        """Заменить атрибуты документов по item_id; вернуть обновлённые id (под write-локом)."""
+        updated = []
+        for item_id, current_attributes in attributes.items():
+            label = self.id_store.get(item_id)
+            if label is None:
+                continue
+            self._drop_attributes(label)
+            if current_attributes:
+                self._set_attributes(label, current_attributes)
+            updated.append(item_id)
+        if updated:
+            self._mutations += 1
+        return updated
+
+    def _set_attributes(self, label: int, attributes: dict[str, Any]) -> None:
+        """Запомнить атрибуты вектора и добавить его метку в инвертированный индекс."""
+        self._attributes[label] = attributes
+        for name, value in attributes.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            for current_value in values:
+                self._postings.setdefault(name, {}).setdefault(current_value, set()).add(label)
+
+    def _drop_attributes(self, label: int) -> None:
+        """Убрать метку удалённого или заменённого вектора из инвертированного индекса."""
+        attributes = self._attributes.pop(label, None)
+        if not attributes:
+            return
+        for name, value in attributes.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            for current_value in values:
+                labels = self._postings.get(name, {}).get(current_value)
+                if labels is not None:
+                    labels.discard(label)
+                    if not labels:
+                        del self._postings[name][current_value]
+
+    def _filter_labels(self, filters: dict[str, Any]) -> np.ndarray:
+        """Метки живых векторов, подходящих под все условия фильтра.
+
+        Список значений условия означает «любое из», разные атрибуты объединяются по И.
+        """
+        allowed: set[int] | None = None
+        for name, value in filters.items():
+            postings = self._postings.get(name, {})
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            matched = set().union(*(postings.get(current_value, ()) for current_value in values))
+            allowed = matched if allowed is None else allowed & matched
+            if not allowed:
+                break
+        return np.fromiter(allowed or (), dtype=np.int64)
 
-            for current_id in self.ids:
-                if self.redis_client is not None:
-                    
-                    cache_key = f"{self.delete_cache_prefix}{current_id}"
-                    cached_vector = await self.redis_client.get(cache_key)
-                    
-                    if cached_vector is not None:
-                        vectors_to_restore.append(pickle.loads(cached_vector))
-                        keys_to_cleanup.append(cache_key)
-                        
-                        continue
-                    
-                vectors_to_restore.append(retained_vectors[current_id])
+    def _needs_compaction(self) -> bool:
+        """Проверить, накопилось ли достаточно удалённых векторов для компактизации."""
+        return len(self._tombstones) >= max(
+            config.VECTOR_DB_COMPACTION_MIN_TOMBSTONES,
+            int(self.index.ntotal * config.VECTOR_DB_COMPACTION_RATIO),
+        )
 
-            if vectors_to_restore:
-                self.index.add(np.asarray(vectors_to_restore, dtype=np.float32))
+    def _remove_tombstones(self) -> int:
+        """Удалить помеченные векторы одним батчем (вызывается под write-локом)."""
+        selector = faiss.IDSelectorBatch(np.fromiter(self._tombstones, dtype=np.int64, count=len(self._tombstones)))
+        removed = self.index.remove_ids(selector)
+        self._tombstones.clear()
+        return int(removed)
 
-            if self.redis_client is not None and keys_to_cleanup:
-                await self.redis_client.delete(*keys_to_cleanup)
+    async def _rebuild(self, index_type: str, compression: str) -> None:
+        """Перестроить индекс заданного типа из живых векторов.
+
+        Новый индекс собирается под read-локом, и поиск продолжает работать
+        по старому; под write-локом выполняется только подмена.
+        """
+        async with self._lock.write():
+            await self._run(self._materialize)
+
+        async with self._lock.read():
+            mutations = self._mutations
+            index = await self._build_live_index(index_type, compression)
+
+        async with self._lock.write():
+            if self._mutations != mutations:
+                # Пока шла сборка, индекс изменился: собираем заново уже эксклюзивно
+                await self._run(self._materialize)
+                index = await self._build_live_index(index_type, compression)
+
+            self.index = index
+            self.index_type = index_type
+            self.index_compression = compression
+            self._snapshot_path = None
+            self._delta = None
+            self._tombstones.clear()
+
+    async def _build_live_index(self, index_type: str, compression: str) -> faiss.IndexIDMap2:
+        """Собрать новый индекс из живых векторов, не изменяя текущий."""
+        labels = self.id_store.live_labels()
+        vectors = await self._load_exact_vectors(labels)
+        if vectors is None:
+            # Без точного хранилища векторы восстанавливаются из индекса (для PQ/SQ8 — с потерями)
+            if labels.size:
+                vectors = await self._run(self.index.reconstruct_batch, labels)
+            else:
+                vectors = np.empty((0, self.dim), dtype=np.float32)
+
+        index = build_index(index_type, self.dim, n_train=labels.size, compression=compression)
+        await self._run(train_index, index, vectors)
+        if labels.size:
+            await self._run(index.add_with_ids, vectors, labels)
+        return index
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Выполнить вызов FAISS в пуле потоков VectorDB, не блокируя event loop."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args))
+
+    def _prepare_checkpoint(self) -> None:
+        """Влить дельту и вычистить удалённые векторы перед снапшотом (под write-локом)."""
+        self._materialize()
+        self.id_store.compact()
+        if supports_remove(self.index) and self._needs_compaction():
+            self._remove_tombstones()
+
+    def _serialize_checkpoint(self, checkpoint: tuple[int, int, int]) -> tuple[bytes, bytes, str | None]:
+        """Сериализовать индекс и метаданные и записать версию снапшота на диск (под read-локом)."""
+        index_data = faiss.serialize_index(self.index).tobytes()
+        snapshot_version = self._write_snapshot(self.index) if self.snapshot_dir else None
+        ids_data = pickle.dumps(
+            {
+                "ids": self.id_store.to_bytes(),
+                "tombstones": self._tombstones,
+                "next_label": self._next_label,
+                "index_type": self.index_type,
+                "compression": self.index_compression,
+                "log_offset": self._log_offset,
+                "checkpoint": checkpoint,
+                "snapshot_version": snapshot_version,
+                "attributes": self._attributes,
+                "lexical": self.lexical_index.to_state(),
+            }
+        )
+        return index_data, ids_data, snapshot_version
+
+    def _install_snapshot(
+        self,
+        index_bytes: bytes | None,
+        snapshot_version: str | None,
+        mapped_index: faiss.IndexIDMap2 | None = None,
+    ) -> None:
+        """Установить загруженный снапшот: отображённый с диска или из блоба Redis (под write-локом)."""
+        if mapped_index is not None:
+            self._use_snapshot(mapped_index, snapshot_version)
+            return
+        if not index_bytes:
+            return
+
+        self.index = faiss.deserialize_index(np.frombuffer(index_bytes, dtype=np.uint8))
+        self._snapshot_path = None
+        self._delta = None
+        if snapshot_version is not None and isinstance(self.index, faiss.IndexIDMap2):
+            # Первый процесс на узле выкладывает снапшот на диск для остальных
+            self._write_snapshot(self.index, snapshot_version)
+            # Не открылся — остаётся собственная копия из блоба
+            mapped_index = self._read_snapshot(snapshot_version)
+            if mapped_index is not None:
+                self._use_snapshot(mapped_index, snapshot_version)
+
+    def _ntotal(self) -> int:
+        """Число векторов в индексе вместе с дельтой поверх снапшота."""
+        return self.index.ntotal + (self._delta.ntotal if self._delta is not None else 0)
+
+    def _search_index(
+        self,
+        vectors: np.ndarray,
+        limit: int,
+        params: faiss.SearchParameters | None = None,
+        selector: faiss.IDSelector | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Поиск по основному индексу и дельте с объединением результатов (под read-локом)."""
+        similarities, labels = self.index.search(vectors, limit, params=params)
+        if self._delta is None or not self._delta.ntotal:
+            return similarities, labels
+
+        delta_params = faiss.SearchParameters(sel=selector) if selector is not None else None
+        delta_similarities, delta_labels = self._delta.search(
+            vectors, min(limit, self._delta.ntotal), params=delta_params
+        )
+        similarities = np.concatenate([similarities, delta_similarities], axis=1)
+        labels = np.concatenate([labels, delta_labels], axis=1)
+        order = np.argsort(-similarities, axis=1, kind="stable")[:, :limit]
+        return np.take_along_axis(similarities, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+    def _search_exact(self, vectors: np.ndarray, labels: np.ndarray, limit: int) -> tuple[np.ndarray, np.ndarray]:
+        """Точный перебор по заданным меткам для узких фильтров (под read-локом)."""
+        similarities = vectors @ self._reconstruct(labels).T
+        limit = min(limit, labels.size)
+        top = np.argpartition(-similarities, limit - 1, axis=1)[:, :limit]
+        top_similarities = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_similarities, axis=1, kind="stable")
+        return np.take_along_axis(top_similarities, order, axis=1), labels[np.take_along_axis(top, order, axis=1)]
+
+    def _reconstruct(self, labels: np.ndarray) -> np.ndarray:
+        """Восстановить векторы по меткам из основного индекса и дельты."""
+        if self._delta is None or not self._delta.ntotal:
+            return self.index.reconstruct_batch(labels)
+
+        in_delta = np.isin(labels, faiss.vector_to_array(self._delta.id_map))
+        vectors = np.empty((labels.size, self.dim), dtype=np.float32)
+        if in_delta.any():
+            vectors[in_delta] = self._delta.reconstruct_batch(labels[in_delta])
+        if not in_delta.all():
+            vectors[~in_delta] = self.index.reconstruct_batch(labels[~in_delta])
+        return vectors
+
+    def _writable_index(self) -> faiss.IndexIDMap2:
+        """Индекс для новых векторов: дельта, если основной индекс — отображённый снапшот."""
+        if self._snapshot_path is None:
+            return self.index
+        if self._delta is None:
+            self._delta = build_index("flat", self.dim)
+        return self._delta
+
+    def _materialize(self) -> None:
+        """Заменить отображённый снапшот собственной копией индекса с влитой дельтой (под write-локом)."""
+        if self._snapshot_path is None:
+            return
+
+        index = faiss.read_index(self._snapshot_path)
+        if self._delta is not None and self._delta.ntotal:
+            labels = faiss.vector_to_array(self._delta.id_map).astype(np.int64)
+            index.add_with_ids(self._delta.reconstruct_batch(labels), labels)
+        self.index = index
+        self._snapshot_path = None
+        self._delta = None
+
+    def _snapshot_file(self, version: str) -> str:
+        return os.path.join(self.snapshot_dir, f"{version}.faiss")
 
-    def _build_search_cache_key(self, query: str | None, top_k: int) -> str | None:
-        """Собрать ключ кеша для поиска по запросу."""
-        if query is None:
+    def _write_snapshot(self, index: faiss.Index, version: str | None = None) -> str | None:
+        """Атомарно записать версию снапшота на диск и удалить устаревшие версии."""
+        version = version or f"{time.time_ns()}-{uuid4().hex[:8]}"
+        path = self._snapshot_file(version)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            faiss.write_index(index, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as exc:
+            logger.warning("Не удалось записать снапшот %s: %s", path, exc)
+            return None
+
+        # Уже отображённые другими процессами файлы остаются доступны им и после удаления
+        snapshots = sorted(name for name in os.listdir(self.snapshot_dir) if name.endswith(".faiss"))
+        for name in snapshots[:-config.VECTOR_DB_SNAPSHOT_KEEP]:
+            if name != f"{version}.faiss":
+                try:
+                    os.remove(os.path.join(self.snapshot_dir, name))
+                except OSError:
+                    pass
+        return version
+
+    def _read_snapshot(self, version: str) -> faiss.IndexIDMap2 | None:
+        """Открыть версию снапшота через mmap; None, если файла уже нет или он не читается.
+
+        Файл открывается сразу, без предварительной проверки exists(): между проверкой
+        и открытием его могла удалить ротация после чужой контрольной точки.
+        """
+        path = self._snapshot_file(version)
+        try:
+            return read_index_mmap(path)
+        except (FileNotFoundError, RuntimeError) as exc:
+            logger.info("Снапшот %s недоступен на диске: %s", path, exc)
+            return None
+
+    def _use_snapshot(self, index: faiss.IndexIDMap2, version: str) -> None:
+        """Заменить индекс отображённым снапшотом (под write-локом)."""
+        self.index = index
+        self._snapshot_path = self._snapshot_file(version)
+        self._delta = None
+
+    async def _load_exact_vectors(self, labels: np.ndarray, chunk_size: int = 10000) -> np.ndarray | None:
+        """Загрузить точные векторы из Redis; None, если хоть одного не хватает."""
+        if not self.exact_rerank or not labels.size:
+            return None
+
+        vectors = np.empty((labels.size, self.dim), dtype=np.float32)
+        for start in range(0, labels.size, chunk_size):
+            chunk = labels[start:start + chunk_size].tolist()
+            payloads = await self.redis_client.hmget(self.vectors_key, chunk)
+            if any(payload is None for payload in payloads):
+                return None
+            vectors[start:start + len(chunk)] = np.frombuffer(b"".join(payloads), dtype=np.float32).reshape(-1, self.dim)
+        return vectors
+
+    async def _rerank_many(
+        self,
+        vectors: np.ndarray,
+        candidate_hits: list[list[tuple[int, float]]],
+    ) -> list[list[tuple[int, float]]]:
+        """Пересчитать сходство кандидатов по точным векторам из Redis одним HMGET на все запросы."""
+        labels = list({label for row in candidate_hits for label, _ in row})
+        if not labels:
+            return candidate_hits
+
+        try:
+            payloads = await self.redis_client.hmget(self.vectors_key, labels)
+        except Exception:
+            return candidate_hits
+
+        exact_vectors = {
+            label: np.frombuffer(payload, dtype=np.float32)
+            for label, payload in zip(labels, payloads)
+            if payload
+        }
+        reranked: list[list[tuple[int, float]]] = []
+        for vector, row in zip(vectors, candidate_hits):
+            row = [
+                (label, float(np.dot(exact_vectors[label], vector)) if label in exact_vectors else score)
+                for label, score in row
+            ]
+            reranked.append(sorted(row, key=lambda item: item[1], reverse=True))
+        return reranked
+
+    def _wrap_legacy_index(self, index: faiss.Index) -> faiss.IndexIDMap2:
+        """Перенести векторы из индекса без id-маппинга, используя позиции как метки."""
+        wrapped = build_index("flat", self.dim, compression=self.index_compression)
+        if index.ntotal:
+            wrapped.add_with_ids(index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal, dtype=np.int64))
+        return wrapped
+
+    def _build_search_cache_key(
+        self,
+        query: str | None,
+        top_k: int,
+        nprobe: int | None = None,
+        ef_search: int | None = None,
+        filters: dict[str, Any] | None = None,
+        generation: int | None = None,
+    ) -> str | None:
+        """Собрать ключ кеша для поиска по запросу в текущем поколении индекса.
+
+        Кроме поколения, ключ содержит смещение журнала, применённое этим процессом:
+        INCR поколения идёт вместе с XADD, и реплика, ещё не доигравшая запись, иначе
+        положила бы результат поиска по устаревшему индексу под ключ нового поколения.
+        """
+        if query is None or generation is None:
             return None
         query_hash = hashlib.sha256(query.encode("utf-8")).hexdigest()
-        return f"{self.search_cache_prefix}{query_hash}:{top_k}"
+        applied = self._log_offset or "0-0"
+        key = f"{self.search_cache_prefix}{generation}:{applied}:{query_hash}:{top_k}:{nprobe}:{ef_search}"
+        if filters:
+            filters_data = json.dumps(filters, sort_keys=True, ensure_ascii=False, default=str)
+            key += f":{hashlib.sha256(filters_data.encode('utf-8')).hexdigest()[:16]}"
+        return key
 
-    async def _get_from_cache(self, cache_key: str) -> list[dict] | None:
-        """Получить результаты поиска из кеша Redis."""
+    async def get_generation(self) -> int | None:
+        """Текущее поколение индекса из Redis; None, если кеш недоступен."""
         if self.redis_client is None:
             return None
 
         try:
-            cached = await self.redis_client.get(cache_key)
-            return json.loads(cached) if cached else None
+            generation = await self.redis_client.get(self.generation_key)
         except Exception:
             return None
+        return int(generation) if generation else 0
 
-    async def _save_to_cache(self, cache_key: str, results: list[dict], ttl: int = 3600) -> None:
-        """Сохранить результаты поиска в кеш Redis."""
-        if self.redis_client is None:
+    async def _get_many_from_cache(self, cache_keys: list[str | None]) -> list[list[dict] | None]:
+        """Получить результаты нескольких поисков из кеша Redis одним MGET."""
+        results: list[list[dict] | None] = [None] * len(cache_keys)
+        keys = [cache_key for cache_key in cache_keys if cache_key]
+        if self.redis_client is None or not keys:
+            return results
+
+        try:
+            cached_values = iter(await self.redis_client.mget(keys))
+            for position, cache_key in enumerate(cache_keys):
+                if cache_key:
+                    cached = next(cached_values)
+                    results[position] = json.loads(cached) if cached else None
+        except Exception:
+            return [None] * len(cache_keys)
+        return results
+
+    async def _save_many_to_cache(self, entries: dict[str, list[dict]], ttl: int = 3600) -> None:
+        """Сохранить результаты нескольких поисков в кеш Redis одним пайплайном."""
+        if self.redis_client is None or not entries:
             return
 
         try:
-            await self.redis_client.setex(cache_key, ttl, json.dumps(results, ensure_ascii=False))
+            async with self.redis_client.pipeline(transaction=False) as pipeline:
+                for cache_key, results in entries.items():
+                    await pipeline.setex(cache_key, ttl, json.dumps(results, ensure_ascii=False))
+                await pipeline.execute()
         except Exception:
             return
 
     async def clear_search_cache(self) -> None:
-        """Очистить весь кеш поиска."""
+        """Инвалидировать весь кеш поиска, перейдя к новому поколению индекса."""
         if self.redis_client is None:
             return
 
         try:
-            cursor = 0
-            while True:
-                cursor, keys = await self.redis_client.scan(cursor, match=f"{self.search_cache_prefix}*")
-                if keys:
-                    await self.redis_client.delete(*keys)
-                if cursor == 0:
-                    break
+            await self.redis_client.incr(self.generation_key)
         except Exception:
             return
         
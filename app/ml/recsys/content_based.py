@@ -2,6 +2,8 @@
 Сервис для работы с контентной рекомендательной системой. В данном случае - для получения эмбеддингов изображений и текстовых описаний, которые затем можно использовать для поиска похожих задач.
 """
 
+import json
+
 import numpy as np
 
 from sqlalchemy import select
@@ -17,6 +19,20 @@ from app.ml.nlp.vector_db import VectorDB
 from app.db_models import Task
 
 
+def task_attributes(task: Task) -> dict:
+    """Атрибуты задачи для фильтрованного поиска в recsys_vector_db."""
+    technologies = []
+    if task.tags:
+        try:
+            technologies = json.loads(task.tags).get("technologies", [])
+        except (ValueError, AttributeError):
+            technologies = []
+    return {
+        "author_id": task.author_id,
+        "tags": [name for name, *_confidence in technologies],
+    }
+
+
 class ContentBasedRecommender:
     """Сервис для контентной рекомендательной системы."""
     
@@ -30,7 +46,13 @@ class ContentBasedRecommender:
     ):
         self.image_embedding_service: ImageEmbeddingService = image_embedding_service or ImageEmbeddingService()
         self.text_embedding_service: EmbeddingService = text_embedding_service or EmbeddingService()
-        self.recsys_vector_db: VectorDB = image_vector_db or VectorDB(dim=896, redis_client=redis_client)
+        self.recsys_vector_db: VectorDB = image_vector_db if image_vector_db is not None else VectorDB(
+            dim=896,
+            redis_client=redis_client,
+            compression=config.RECSYS_VECTOR_DB_COMPRESSION,
+            exact_rerank=config.RECSYS_VECTOR_DB_EXACT_RERANK,
+            namespace=config.RECSYS_VECTOR_DB_NAMESPACE,
+        )
 
 
     async def _get_image_embedding(self, image: str):
@@ -108,15 +130,24 @@ class ContentBasedRecommender:
         task_embedding: np.ndarray,
         session: AsyncSession,
         top_k: int = config.DEFAULT_TOP_K,
-        author_id: int = None
+        author_id: int = None,
+        tags: list[str] | None = None,
     ) -> list[dict]:
         """Находим похожие задачи на основе эмбеддингов."""
         
+        # Фильтр по автору и тегам применяется внутри индекса, поэтому возвращается полный top_k
+        filters = {}
+        if author_id is not None:
+            filters["author_id"] = author_id
+        if tags:
+            filters["tags"] = tags
+
         # Ищем похожие задачи в векторной базе данных изображений
         search_results = await self.recsys_vector_db.search(
             query_embedding=task_embedding,
             session=session,
             top_k=top_k,
+            filters=filters or None,
         )
         if not search_results:
             return []
@@ -136,10 +167,9 @@ class ContentBasedRecommender:
         tasks = tasks_result.scalars().all()
         
         for task in tasks:
-            if author_id is not None and task.author_id != author_id:
-                continue
             similar_tasks.append({
                 "id": task.id,
+                "task_id": task.id,
                 "title": task.title,
                 "description": task.description,
                 "avatar_file": task.avatar_file,
@@ -154,9 +184,14 @@ class ContentBasedRecommender:
         self,
         task_id: int,
         session: AsyncSession,
-        author_id: int = None
+        top_k: int = config.DEFAULT_TOP_K,
+        author_id: int = None,
+        tags: list[str] | None = None,
     ) -> list[dict]:
-        """Рекомендуем похожие задачи на основе эмбеддингов."""
+        """Рекомендуем похожие задачи на основе эмбеддингов.
+
+        author_id и tags (любой из тегов) фильтруют кандидатов внутри индекса.
+        """
 
         task = await self._get_task(task_id, session)
         
@@ -170,8 +205,9 @@ class ContentBasedRecommender:
         similar_tasks = await self._find_similar_tasks(
             task_emb,
             session,
-            top_k=config.DEFAULT_TOP_K,
+            top_k=top_k,
             author_id=author_id,
+            tags=tags,
         )
         
         return similar_tasks
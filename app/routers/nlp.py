@@ -5,26 +5,37 @@
 from __future__ import annotations
 
 import asyncio
+import json
 import logging
+from collections.abc import AsyncIterator
+from uuid import uuid4
 
 from fastapi import APIRouter, Body, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.requests import ClientDisconnect
 
 from ..core import config
-from ..db import get_async_session
+from ..db import async_session, get_async_session
 from ..error_handlers import AppError
 from ..ml.nlp.embedding_service import EmbeddingService
 from ..ml.nlp.ner_service import NerService
-from ..ml.nlp.semantic_search_service import SemanticSearchService
+from ..ml.nlp.semantic_search_service import SEARCH_MODES, SemanticSearchService
 from ..schemas import (
-    EmbeddingResponse, SearchResults, IndexResponse, NLPTagTaskResponse
+    EmbeddingResponse, SearchResults, BatchSearchResults, IndexResponse, BulkIndexResponse, NLPTagTaskResponse
 )
 
 router = APIRouter(prefix="/nlp", tags=["NLP"])
 logger = logging.getLogger(__name__)
 
 MAX_BATCH_SIZE = 10
+MAX_SEARCH_BATCH_SIZE = 256
 MAX_TEXT_LENGTH = 1000
+MAX_NPROBE = 1024
+MAX_EF_SEARCH = 1024
+BULK_INDEX_BATCH_SIZE = 256
+MAX_BULK_LINE_BYTES = 64 * 1024
+MAX_BULK_ERRORS = 100
 
 
 def _normalize_text(text: str) -> str:
@@ -62,6 +73,25 @@ def _normalize_texts(payload: str | list[str]) -> str | list[str]:
     )
 
 
+def _validate_search_params(
+    top_k: int,
+    nprobe: int | None,
+    ef_search: int | None,
+    mode: str | None = None,
+    mmr_lambda: float | None = None,
+) -> None:
+    if top_k <= 0 or top_k > 20:
+        raise HTTPException(status_code=400, detail="top_k должен быть в диапазоне от 1 до 20")
+    if nprobe is not None and not 1 <= nprobe <= MAX_NPROBE:
+        raise HTTPException(status_code=400, detail=f"nprobe должен быть в диапазоне от 1 до {MAX_NPROBE}")
+    if ef_search is not None and not 1 <= ef_search <= MAX_EF_SEARCH:
+        raise HTTPException(status_code=400, detail=f"ef_search должен быть в диапазоне от 1 до {MAX_EF_SEARCH}")
+    if mode is not None and mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode должен быть одним из: {', '.join(SEARCH_MODES)}")
+    if mmr_lambda is not None and not 0 <= mmr_lambda <= 1:
+        raise HTTPException(status_code=400, detail="mmr_lambda должен быть в диапазоне от 0 до 1")
+
+
 def _get_embedding_service(request: Request) -> EmbeddingService:
     return getattr(request.app.state, "embedding_service", None)
 
@@ -91,9 +121,9 @@ async def get_embedding(request: Request, text: str | list[str] = Body(...)):
 
     try:
         if isinstance(normalized_payload, str):
-            embedding = await asyncio.to_thread(embedding_service.encode_one, normalized_payload)
+            embedding = await embedding_service.encode_one_async(normalized_payload)
         else:
-            embedding = await asyncio.to_thread(embedding_service.encode_batch, normalized_payload)
+            embedding = await embedding_service.encode_batch_async(normalized_payload)
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
     except Exception as exc:
@@ -112,12 +142,17 @@ async def search(
     request: Request,
     query: str = Body(..., embed=True, description="Текст запроса для поиска"),
     top_k: int = Body(config.DEFAULT_TOP_K, embed=True, description="Количество результатов для возврата"),
+    nprobe: int | None = Body(None, embed=True, description="Число просматриваемых кластеров IVF индекса"),
+    ef_search: int | None = Body(None, embed=True, description="Ширина поиска HNSW индекса"),
+    mode: str | None = Body(None, embed=True, description="Режим поиска: dense, lexical, hybrid или auto"),
+    mmr_lambda: float | None = Body(
+        None, embed=True, description="Баланс релевантности (1) и разнообразия (0) для MMR; 1 отключает диверсификацию"
+    ),
     session: AsyncSession = Depends(get_async_session),
 ):
     """Поиск документов, наиболее похожих на запрос."""
     normalized_query = _normalize_text(query)
-    if top_k <= 0 or top_k > 20:
-        raise HTTPException(status_code=400, detail="top_k должен быть в диапазоне от 1 до 20")
+    _validate_search_params(top_k, nprobe, ef_search, mode, mmr_lambda)
 
     semantic_search_service = _require_service(
         _get_semantic_search_service(request),
@@ -125,7 +160,15 @@ async def search(
     )
 
     try:
-        results = await semantic_search_service.search(normalized_query, session=session, top_k=top_k)
+        results = await semantic_search_service.search(
+            normalized_query,
+            session=session,
+            top_k=top_k,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            mode=mode,
+            mmr_lambda=mmr_lambda,
+        )
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
     except Exception as exc:
@@ -135,6 +178,62 @@ async def search(
     return SearchResults(results=results, total=len(results))
 
 
+@router.post(
+    "/search/batch",
+    description="Искать документы сразу для нескольких запросов",
+    status_code=status.HTTP_200_OK,
+    response_model=BatchSearchResults
+)
+async def search_batch(
+    request: Request,
+    queries: list[str] = Body(..., embed=True, description="Тексты запросов для поиска"),
+    top_k: int = Body(config.DEFAULT_TOP_K, embed=True, description="Количество результатов для каждого запроса"),
+    nprobe: int | None = Body(None, embed=True, description="Число просматриваемых кластеров IVF индекса"),
+    ef_search: int | None = Body(None, embed=True, description="Ширина поиска HNSW индекса"),
+    mode: str | None = Body(None, embed=True, description="Режим поиска: dense, lexical, hybrid или auto"),
+    mmr_lambda: float | None = Body(
+        None, embed=True, description="Баланс релевантности (1) и разнообразия (0) для MMR; 1 отключает диверсификацию"
+    ),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """Пакетный поиск: один батч эмбеддингов, один вызов FAISS и один SQL запрос на все запросы."""
+    if not queries:
+        raise HTTPException(status_code=400, detail="Список запросов не может быть пустым")
+    if len(queries) > MAX_SEARCH_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много запросов в списке. Максимум {MAX_SEARCH_BATCH_SIZE}",
+        )
+    normalized_queries = [_normalize_text(query) for query in queries]
+    _validate_search_params(top_k, nprobe, ef_search, mode, mmr_lambda)
+
+    semantic_search_service = _require_service(
+        _get_semantic_search_service(request),
+        "semantic_search",
+    )
+
+    try:
+        results = await semantic_search_service.search_many(
+            normalized_queries,
+            session=session,
+            top_k=top_k,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            mode=mode,
+            mmr_lambda=mmr_lambda,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    except Exception as exc:
+        logger.error(f"Ошибка при пакетном семантическом поиске: {exc}", exc_info=True)
+        raise AppError("Ошибка при пакетном семантическом поиске", status_code=500) from exc
+
+    return BatchSearchResults(
+        results=[SearchResults(results=row, total=len(row)) for row in results],
+        total=len(results),
+    )
+
+
 @router.post(
     "/index",
     description="Индексировать текст, добавляя его эмбеддинг в базу данных",
@@ -163,6 +262,137 @@ async def index(
     return IndexResponse(detail="Текст успешно индексирован")
 
 
+async def _iter_ndjson_lines(request: Request) -> AsyncIterator[bytes]:
+    """Читать тело запроса по строкам, не держа в памяти больше одной строки и одного чанка."""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > MAX_BULK_LINE_BYTES:
+            raise HTTPException(status_code=400, detail=f"Строка NDJSON длиннее {MAX_BULK_LINE_BYTES} байт")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+class _UploadStreamingResponse(StreamingResponse):
+    """StreamingResponse для генератора, который сам ещё читает тело запроса.
+
+    Обычный StreamingResponse на ASGI < 2.4 параллельно ждёт http.disconnect через
+    receive и забирал бы чанки тела у request.stream(). Здесь отключение клиента
+    видно из request.stream() и из send.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.stream_response(send)
+        except OSError as exc:
+            raise ClientDisconnect() from exc
+        if self.background is not None:
+            await self.background()
+
+
+def _parse_bulk_line(line: bytes) -> tuple[str, str]:
+    """Разобрать строку {"text": ..., "item_id": ...}; без item_id документу назначается новый id."""
+    try:
+        document = json.loads(line)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="Некорректный JSON") from exc
+    if not isinstance(document, dict):
+        raise HTTPException(status_code=400, detail="Строка должна быть JSON объектом")
+
+    item_id = document.get("item_id")
+    return _normalize_text(document.get("text")), str(uuid4()) if item_id is None else str(item_id)
+
+
+@router.post(
+    "/index/bulk",
+    description=(
+        "Индексировать корпус из NDJSON потока: по объекту {\"text\": ..., \"item_id\": ...} на строку. "
+        "Ответ — NDJSON: строка {\"batch\", \"indexed\"} на каждый закоммиченный батч и итоговая "
+        "строка со сводкой или с {\"error\", \"indexed\"}"
+    ),
+    status_code=status.HTTP_200_OK,
+    response_class=_UploadStreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def index_bulk(request: Request):
+    """Индексировать большой корпус батчами с ограниченной памятью.
+
+    Тело читается потоково, каждые BULK_INDEX_BATCH_SIZE документов индексируются
+    одним index_many и коммитятся, о чём клиенту сразу уходит строка прогресса.
+    Некорректные строки пропускаются и попадают в errors итоговой строки.
+    Статус 200 отправляется с первой строкой, поэтому ошибка посреди потока
+    приходит последней строкой {"error": ..., "indexed": n}: n документов уже
+    закоммичены, и повтор можно начать с них.
+    """
+    semantic_search_service = _require_service(
+        _get_semantic_search_service(request),
+        "semantic_search",
+    )
+
+    async def progress() -> AsyncIterator[str]:
+        indexed = batches = failed = 0
+        errors: list[str] = []
+        texts: list[str] = []
+        item_ids: list[str] = []
+        # Своя сессия на весь поток: сессия-зависимость запроса может закрыться раньше, чем тело дочитано
+        session = async_session()
+
+        async def flush() -> None:
+            nonlocal indexed, batches
+            try:
+                await semantic_search_service.index_many(texts, session=session, item_ids=item_ids)
+                await session.commit()
+            except Exception as exc:
+                await session.rollback()
+                raise AppError(f"Ошибка пакетной индексации после {indexed} документов", status_code=500) from exc
+            indexed += len(texts)
+            batches += 1
+            logger.info("Bulk index: batch %d committed, %d documents indexed", batches, indexed)
+            texts.clear()
+            item_ids.clear()
+
+        try:
+            line_number = 0
+            async for line in _iter_ndjson_lines(request):
+                line_number += 1
+                if not line.strip():
+                    continue
+                try:
+                    text, item_id = _parse_bulk_line(line)
+                except HTTPException as exc:
+                    failed += 1
+                    if len(errors) < MAX_BULK_ERRORS:
+                        errors.append(f"строка {line_number}: {exc.detail}")
+                    continue
+
+                texts.append(text)
+                item_ids.append(item_id)
+                if len(texts) >= BULK_INDEX_BATCH_SIZE:
+                    await flush()
+                    yield _ndjson({"batch": batches, "indexed": indexed})
+
+            if texts:
+                await flush()
+                yield _ndjson({"batch": batches, "indexed": indexed})
+        except (HTTPException, AppError) as exc:
+            logger.warning("Bulk index stopped after %d documents: %s", indexed, exc.detail, exc_info=exc.__cause__)
+            yield _ndjson({"error": exc.detail, "indexed": indexed})
+            return
+        finally:
+            await session.close()
+
+        yield _ndjson(BulkIndexResponse(indexed=indexed, batches=batches, failed=failed, errors=errors).model_dump())
+
+    return _UploadStreamingResponse(progress(), media_type="application/x-ndjson")
+
+
+def _ndjson(payload: dict) -> str:
+    return json.dumps(payload, ensure_ascii=False) + "\n"
+
+
 @router.post("/tag-task", description="Получить теги для текста задачи", response_model=NLPTagTaskResponse)
 async def tag_task(request: Request, text: str = Body(...)):
     """Получить теги для текста задачи."""
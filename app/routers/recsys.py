@@ -27,6 +27,7 @@ async def get_recommendations(
     current_user: User = Depends(get_current_user),
     top_k: int = Query(config.DEFAULT_TOP_K, ge=1, le=20),
     author_id: int = Query(None, description="ID автора задачи для фильтрации рекомендаций"),
+    tags: list[str] | None = Query(None, description="Технологии для фильтрации рекомендаций (любая из)"),
     session: AsyncSession = Depends(get_async_session)
 ) -> RecommendationGet:
     """Получение рекомендаций для задачи на основе ее ID."""
@@ -45,7 +46,9 @@ async def get_recommendations(
         
     content_based_recommender: ContentBasedRecommender = services.get_service("content_based_recommender")
     
-    recommendations = await content_based_recommender.recommend(task.id, session, top_k=top_k, author_id=author_id or current_user.id)
+    recommendations = await content_based_recommender.recommend(
+        task.id, session, top_k=top_k, author_id=author_id or current_user.id, tags=tags
+    )
     
     return RecommendationGet(
         recommendations=[
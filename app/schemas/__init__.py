@@ -8,6 +8,7 @@ from .common import (
     FileUploadResponse,
     EmbeddingResponse,
     SearchResults,
+    BatchSearchResults,
     TagsResponse,
     TaskStatusResponse,
     TokenResponse,
@@ -16,6 +17,7 @@ from .common import (
     AskResponse,
     NLPTagTaskResponse,
     IndexResponse,
+    BulkIndexResponse,
 )
 from .rag import AskRequest
 from .recommendation import Recommendation, RecommendationGet
@@ -25,6 +27,8 @@ from .user import UserBase, UserCreate, UserGet
 __all__ = [
     "AskRequest",
     "AskResponse",
+    "BatchSearchResults",
+    "BulkIndexResponse",
     "CeleryTaskResponse",
     "CeleryTaskStatusResponse",
     "DriftHistoryResponse",
@@ -65,8 +65,9 @@ class SearchResultItem(BaseModel):
     text: Optional[str] = Field(default=None, description="Indexed source text")
     title: Optional[str] = Field(default=None, description="Task title")
     description: Optional[str] = Field(default=None, description="Task description")
-    similarity: Optional[float] = Field(default=None, description="Search relevance score")
-    score: Optional[float] = Field(default=None, description="Alias of similarity score")
+    similarity: Optional[float] = Field(default=None, description="Cosine similarity of dense search, absent for lexical-only hits")
+    lexical_score: Optional[float] = Field(default=None, description="BM25 score of lexical search")
+    score: Optional[float] = Field(default=None, description="Ranking score: similarity, BM25 or fused rank score")
 
 
 class SearchResults(BaseModel):
@@ -76,6 +77,13 @@ class SearchResults(BaseModel):
     total: int = Field(default=0, description="Total number of results")
 
 
+class BatchSearchResults(BaseModel):
+    """Результаты пакетного поиска в порядке запросов."""
+
+    results: list[SearchResults] = Field(description="Search results for each query")
+    total: int = Field(default=0, description="Number of queries")
+
+
 class TagsResponse(BaseModel):
     """Ответ, содержащий теги."""
 
@@ -167,3 +175,12 @@ class IndexResponse(BaseModel):
     """Ответ для индексации текста."""
 
     detail: str = Field(description="Indexing status message")
+
+
+class BulkIndexResponse(BaseModel):
+    """Ответ для пакетной индексации NDJSON потока."""
+
+    indexed: int = Field(description="Number of indexed documents")
+    batches: int = Field(description="Number of committed batches")
+    failed: int = Field(description="Number of skipped invalid lines")
+    errors: list[str] = Field(default_factory=list, description="First errors by line number")
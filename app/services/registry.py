@@ -24,6 +24,7 @@ from app.ml.nlp.llm_service import LLMService
 from app.ml.nlp.ner_service import NerService
 from app.ml.nlp.rag_service import RAGService
 from app.ml.nlp.semantic_search_service import SemanticSearchService
+from app.ml.nlp.sharded_vector_db import ShardedVectorDB
 from app.ml.nlp.vector_db import VectorDB
 from app.ml.recsys.collaborative_filtering import CollaborativeFilteringRecommender
 from app.ml.recsys.content_based import ContentBasedRecommender
@@ -44,8 +45,15 @@ async def init_services(
     redis_client: redis.Redis | None = None,
     inference_checkpoint_path: str | None = None,
     inference_idx_to_class: dict | None = None,
+    spawn_shards: bool = True,
+    background_compaction: bool = True,
 ) -> None:
-    """Инициализировать все singleton-сервисы один раз."""
+    """Инициализировать все singleton-сервисы один раз.
+
+    spawn_shards=False запрещает запускать локальные шарды VectorDB (Celery воркеры).
+    background_compaction=False отключает фоновую компактизацию индексов для процессов
+    без долгоживущего event loop (Celery воркеры); её выполняет maintain_vector_indexes.
+    """
 
     global _initialized
     if _initialized:
@@ -81,13 +89,22 @@ async def init_services(
     _services["segmentation"] = SegmentationService()
 
     logger.info("Loading NLP services")
-    _services["embedding"] = EmbeddingService()
+    _services["embedding"] = EmbeddingService(redis_client=redis_client)
     _services["ner"] = NerService()
     _services["llm"] = LLMService()
 
     logger.info("Loading vector databases and recommenders")
-    _services["vector_db"] = VectorDB(dim=_services["embedding"].dimension, redis_client=redis_client)
-    _services["recsys_vector_db"] = VectorDB(dim=896, redis_client=redis_client)
+    _services["vector_db"] = _create_search_vector_db(
+        _services["embedding"].dimension, redis_client, spawn_shards, background_compaction
+    )
+    _services["recsys_vector_db"] = VectorDB(
+        dim=896,
+        redis_client=redis_client,
+        compression=config.RECSYS_VECTOR_DB_COMPRESSION,
+        exact_rerank=config.RECSYS_VECTOR_DB_EXACT_RERANK,
+        namespace=config.RECSYS_VECTOR_DB_NAMESPACE,
+        background_compaction=background_compaction,
+    )
     _services["content_based_recommender"] = ContentBasedRecommender(
         image_embedding_service=_services["image_embedding"],
         text_embedding_service=_services["embedding"],
@@ -99,6 +116,7 @@ async def init_services(
 
     if redis_client:
         await _services["vector_db"].load_from_redis()
+        await _services["recsys_vector_db"].load_from_redis()
 
     _services["semantic_search"] = SemanticSearchService(
         embedding_service=_services["embedding"],
@@ -127,11 +145,47 @@ async def init_services(
     logger.info("Services initialized successfully: %s", sorted(_services.keys()))
 
 
+def _create_search_vector_db(
+    dim: int,
+    redis_client: redis.Redis | None,
+    spawn_shards: bool = True,
+    background_compaction: bool = True,
+) -> VectorDB:
+    """VectorDB семантического поиска: один индекс в процессе или шарды со scatter-gather поиском.
+
+    Локальные шарды (VECTOR_DB_SHARDS) запускает только процесс API и только для себя;
+    воркерам и нескольким процессам API нужны общие шарды из VECTOR_DB_SHARD_ADDRESSES.
+    """
+    if config.VECTOR_DB_SHARD_ADDRESSES:
+        addresses = []
+        for address in config.VECTOR_DB_SHARD_ADDRESSES.split(","):
+            host, _, port = address.strip().rpartition(":")
+            addresses.append((host, int(port)))
+        logger.info("Connecting to %d vector DB shards", len(addresses))
+        return ShardedVectorDB(dim, addresses, redis_client=redis_client)
+    if config.VECTOR_DB_SHARDS > 1:
+        if not spawn_shards:
+            raise RuntimeError(
+                "VECTOR_DB_SHARDS запускает шарды только в процессе API: "
+                "для воркеров запустите шарды отдельно и укажите VECTOR_DB_SHARD_ADDRESSES"
+            )
+        logger.info("Starting %d local vector DB shards", config.VECTOR_DB_SHARDS)
+        return ShardedVectorDB.spawn(
+            dim,
+            config.VECTOR_DB_SHARDS,
+            redis_client=redis_client,
+            redis_url=config.REDIS_URL if redis_client else None,
+        )
+    return VectorDB(dim=dim, redis_client=redis_client, background_compaction=background_compaction)
+
+
 async def ensure_services_initialized(
     use_onnx: bool = False,
     redis_client: redis.Redis | None = None,
     inference_checkpoint_path: str | None = None,
     inference_idx_to_class: dict | None = None,
+    spawn_shards: bool = True,
+    background_compaction: bool = True,
 ) -> None:
     """Потокобезопасная инициализация сервисов для FastAPI и Celery."""
 
@@ -147,6 +201,8 @@ async def ensure_services_initialized(
             redis_client=redis_client,
             inference_checkpoint_path=inference_checkpoint_path or default_inference_checkpoint_path(),
             inference_idx_to_class=inference_idx_to_class,
+            spawn_shards=spawn_shards,
+            background_compaction=background_compaction,
         )
 
 
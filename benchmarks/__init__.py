@@ -0,0 +1 @@
+"""Нагрузочные бенчмарки компонентов приложения."""
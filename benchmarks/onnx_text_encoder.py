@@ -0,0 +1,88 @@
+"""
+Бенчмарк текстового энкодера на CPU: torch против ONNX Runtime (fp32 и int8).
+
+Для каждого бэкенда печатает расхождение с эмбеддингами torch, задержку
+одиночного запроса и пропускную способность батчевого кодирования. С --workers
+батчи кодируются пулом процессов EncoderPool:
+
+    python -m benchmarks.onnx_text_encoder --texts 512 --batch-size 32
+    python -m benchmarks.onnx_text_encoder --backends torch --texts 4096 --batch-size 1024 --workers 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from app.ml.nlp.embedding_service import EmbeddingService
+
+
+WORDS = (
+    "задача отчёт продажи квартал сервис миграция база данных очередь redis celery postgresql "
+    "fastapi docker deploy релиз тест баг логин авторизация кеш индекс поиск пользователь "
+    "настроить проверить обновить исправить подготовить согласовать встреча клиент"
+).split()
+
+
+def _corpus(count: int, seed: int) -> list[str]:
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(WORDS, size=rng.integers(4, 40))) for _ in range(count)]
+
+
+def _measure(service: EmbeddingService, texts: list[str], args) -> tuple[np.ndarray, dict[str, float]]:
+    encode = service.pool.encode if service.pool else service.encode_batch
+    encode(texts[:args.batch_size]) # Прогрев, для пула — ещё и ожидание загрузки моделей в воркерах
+
+    latencies: list[float] = []
+    for text in texts[:args.single]:
+        started = time.perf_counter()
+        service.encode_one(text)
+        latencies.append(time.perf_counter() - started)
+
+    embeddings = []
+    started = time.perf_counter()
+    for offset in range(0, len(texts), args.batch_size):
+        embeddings.append(encode(texts[offset:offset + args.batch_size]))
+    batch_seconds = time.perf_counter() - started
+
+    return np.concatenate(embeddings), {
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "texts_per_s": len(texts) / batch_seconds,
+    }
+
+
+def main(args) -> None:
+    torch.set_num_threads(args.threads)
+    texts = _corpus(args.texts, args.seed)
+    reference = None
+    print(f"{'backend':>10} {'min_cos':>8} {'mean_cos':>9} {'p50_ms':>8} {'p99_ms':>8} {'texts/s':>9}")
+    for backend in args.backends.split(","):
+        service = EmbeddingService(backend=backend, workers=args.workers)
+        if service.backend != backend:
+            print(f"{backend:>10} недоступен, сервис откатился на {service.backend}")
+            continue
+        embeddings, stats = _measure(service, texts, args)
+        service.close()
+        if reference is None:
+            reference = embeddings
+        cosine = np.sum(reference * embeddings, axis=1)
+        print(
+            f"{backend:>10} {cosine.min():8.4f} {cosine.mean():9.4f} "
+            f"{stats['p50_ms']:8.2f} {stats['p99_ms']:8.2f} {stats['texts_per_s']:9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="torch,onnx,onnx_int8", help="Первый бэкенд — эталон для сравнения")
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--single", type=int, default=200, help="Сколько одиночных запросов для задержки")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=1, help="Потоки torch; onnxruntime использует свои")
+    parser.add_argument("--workers", type=int, default=0, help="Процессы EncoderPool, -1 — по числу ядер")
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,124 @@
+"""
+Бенчмарк пропускной способности поиска: одна VectorDB против ShardedVectorDB с разным числом шардов.
+
+Для каждого режима печатаются две пропускные способности: "index QPS" — только
+поиск по индексу (scatter-gather и слияние, _search_hits), "QPS" — полный
+search с кешами и гидратацией текстов из базы, общей для всех режимов.
+"speedup" — рост index QPS относительно одного шарда. Шарды масштабируются
+только до числа свободных ядер: на машине с N ядрами больше N шардов не ускоряют.
+
+Запуск (нужны те же переменные окружения, что и для приложения):
+
+    python -m benchmarks.sharded_vector_db --vectors 200000 --shards 1,2,4
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import time
+
+import numpy as np
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.db_models import Base
+from app.ml.nlp.sharded_vector_db import ShardedVectorDB
+from app.ml.nlp.vector_db import VectorDB
+
+
+def _random_vectors(count: int, dim: int, seed: int) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+async def _measure(vector_db: VectorDB, vectors: np.ndarray, queries: np.ndarray, args, session) -> dict[str, float]:
+    """Проиндексировать корпус и прогнать запросы с заданной конкурентностью."""
+    started = time.perf_counter()
+    for offset in range(0, len(vectors), args.batch_size):
+        batch = vectors[offset:offset + args.batch_size]
+        await vector_db.add(batch, session=session, item_id=[str(offset + i) for i in range(len(batch))])
+    index_seconds = time.perf_counter() - started
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one_index_query(query: np.ndarray) -> None:
+        async with semaphore:
+            await vector_db._search_hits(query.reshape(1, -1), args.top_k)
+
+    await vector_db._search_hits(queries[:1], args.top_k) # Прогрев соединений и пулов
+    started = time.perf_counter()
+    await asyncio.gather(*(one_index_query(query) for query in queries))
+    index_qps = len(queries) / (time.perf_counter() - started)
+
+    latencies: list[float] = []
+
+    async def one_query(query: np.ndarray) -> None:
+        async with semaphore:
+            query_started = time.perf_counter()
+            await vector_db.search(query, session=session, top_k=args.top_k)
+            latencies.append(time.perf_counter() - query_started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_query(query) for query in queries))
+    search_seconds = time.perf_counter() - started
+
+    return {
+        "index_s": index_seconds,
+        "index_qps": index_qps,
+        "qps": len(queries) / search_seconds,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+    }
+
+
+async def main(args) -> None:
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    vectors = _random_vectors(args.vectors, args.dim, seed=0)
+    queries = _random_vectors(args.queries, args.dim, seed=1)
+    print(f"CPU cores: {os.cpu_count()}")
+    print(f"{'mode':<12}{'index, s':>10}{'index QPS':>11}{'speedup':>9}{'QPS':>10}{'p50, ms':>10}{'p99, ms':>10}")
+    baseline_qps = None
+
+    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+        for shard_count in [0, *args.shards]:
+            if shard_count:
+                vector_db = ShardedVectorDB.spawn(
+                    args.dim, shard_count, namespace=f"bench{shard_count}", index_type=args.index_type
+                )
+                mode = f"{shard_count} shards"
+            else:
+                vector_db = VectorDB(dim=args.dim, index_type=args.index_type, namespace="bench")
+                mode = "single"
+            try:
+                result = await _measure(vector_db, vectors, queries, args, session)
+            finally:
+                if shard_count:
+                    vector_db.close()
+            if shard_count and baseline_qps is None:
+                baseline_qps = result["index_qps"]
+            speedup = f"{result['index_qps'] / baseline_qps:.2f}x" if baseline_qps else "-"
+            print(
+                f"{mode:<12}{result['index_s']:>10.2f}{result['index_qps']:>11.0f}{speedup:>9}"
+                f"{result['qps']:>10.0f}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+            )
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--shards", type=lambda value: [int(item) for item in value.split(",")], default=[1, 2, 4])
+    asyncio.run(main(parser.parse_args()))
@@ -66,7 +66,7 @@ async def unit_session_maker(unit_db_engine):
 
 
 @pytest.fixture(scope="function")
-def unit_app(unit_session_maker) -> FastAPI:
+def unit_app(unit_session_maker, monkeypatch) -> FastAPI:
     app = FastAPI()
     register_exception_handlers(app)
     app.include_router(auth.router)
@@ -97,6 +97,8 @@ def unit_app(unit_session_maker) -> FastAPI:
             loop.close()
     
     app.dependency_overrides[get_async_session] = _override_session
+    # Потоковая индексация открывает сессию сама, без зависимости запроса
+    monkeypatch.setattr("app.routers.nlp.async_session", unit_session_maker)
     return app
 
 
@@ -1,6 +1,126 @@
 from __future__ import annotations
 
 import numpy as np
+from redis.exceptions import WatchError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.db_models import Base
+
+
+class DummyRedisPipeline:
+    def __init__(self, redis):
+        self._redis = redis
+        self._commands = []
+        self._watched = None
+        self._immediate = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def watch(self, *keys):
+        self._watched = {key: self._redis.data.get(key) for key in keys}
+        self._immediate = True
+
+    def multi(self):
+        self._immediate = False
+
+    def __getattr__(self, name):
+        if self._immediate:
+            return getattr(self._redis, name)
+
+        def command(*args, **kwargs):
+            self._commands.append((name, args, kwargs))
+            return self
+
+        return command
+
+    def __await__(self):
+        yield from []
+        return self
+
+    async def execute(self):
+        watched, self._watched = self._watched, None
+        if watched and any(self._redis.data.get(key) != value for key, value in watched.items()):
+            self._commands.clear()
+            raise WatchError("Watched variable changed.")
+        results = [await getattr(self._redis, name)(*args, **kwargs) for name, args, kwargs in self._commands]
+        self._commands.clear()
+        return results
+
+
+class DummyRedis:
+    """In-memory подмножество redis.asyncio, достаточное для VectorDB."""
+
+    def __init__(self):
+        self.data: dict = {}
+        self._stream_seq = 0
+
+    def pipeline(self, transaction: bool = True):
+        return DummyRedisPipeline(self)
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def setex(self, key, ttl, value):
+        return await self.set(key, value)
+
+    async def incr(self, key):
+        return await self.incrby(key, 1)
+
+    async def incrby(self, key, amount):
+        self.data[key] = int(self.data.get(key, 0)) + amount
+        return self.data[key]
+
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def hset(self, key, mapping):
+        self.data.setdefault(key, {}).update({str(field).encode(): value for field, value in mapping.items()})
+        return len(mapping)
+
+    async def hmget(self, key, fields):
+        values = self.data.get(key, {})
+        return [values.get(str(field).encode()) for field in fields]
+
+    async def hdel(self, key, *fields):
+        values = self.data.get(key, {})
+        return sum(values.pop(str(field).encode(), None) is not None for field in fields)
+
+    async def xadd(self, key, fields):
+        self._stream_seq += 1
+        entry_id = f"{self._stream_seq}-0".encode()
+        encoded = {
+            name.encode(): value if isinstance(value, bytes) else str(value).encode()
+            for name, value in fields.items()
+        }
+        self.data.setdefault(key, []).append((entry_id, encoded))
+        return entry_id
+
+    async def xrange(self, key, min="-", max="+", count=None):
+        entries = self.data.get(key, [])
+        if min.startswith("("):
+            offset = int(min[1:].split("-")[0])
+            entries = [entry for entry in entries if int(entry[0].split(b"-")[0]) > offset]
+        return entries[:count] if count else entries
+
+    async def xtrim(self, key, minid, approximate=True):
+        offset = int(minid.split("-")[0])
+        entries = self.data.get(key, [])
+        self.data[key] = [entry for entry in entries if int(entry[0].split(b"-")[0]) >= offset]
+        return len(entries) - len(self.data[key])
 
 
 class DummyDelayTask:
@@ -15,6 +135,12 @@ class DummyEmbeddingService:
     def encode_one(self, text: str) -> np.ndarray:
         return np.array([len(text), 1.0, 0.0, 0.5], dtype=float)
 
+    async def encode_one_async(self, text: str) -> np.ndarray:
+        return self.encode_one(text)
+
+    async def encode_batch_async(self, texts: list[str]) -> np.ndarray:
+        return self.encode_batch(texts)
+
     def encode_batch(self, texts: list[str]) -> np.ndarray:
         return np.array([[len(t), 1.0, 0.0, 0.5] for t in texts], dtype=float)
 
@@ -27,7 +153,7 @@ class DummySemanticSearchService:
         self.vector_db = object()
         self._indexed: list[str] = []
 
-    async def search(self, query: str, session, top_k: int = 5):
+    async def search(self, query: str, session, top_k: int = 5, nprobe=None, ef_search=None, mode=None, mmr_lambda=None):
         return [
             {
                 "text_id": str(i + 1),
@@ -39,9 +165,18 @@ class DummySemanticSearchService:
             for i, text in enumerate(self._indexed[:top_k])
         ]
 
+    async def search_many(
+        self, queries: list[str], session, top_k: int = 5, nprobe=None, ef_search=None, mode=None, mmr_lambda=None
+    ):
+        return [await self.search(query, session, top_k=top_k) for query in queries]
+
     async def index(self, text: str, session):
         self._indexed.append(text)
 
+    async def index_many(self, texts: list[str], session, item_ids=None):
+        self._indexed.extend(texts)
+        return item_ids or [str(len(self._indexed) - len(texts) + i) for i in range(len(texts))]
+
 
 class DummyNerService:
     is_ready = True
@@ -69,3 +204,15 @@ class DummyRagService:
     async def ask_stream(self, query: str, session, top_k: int):
         for token in ["hello", "world"]:
             yield token
+
+
+async def with_session(scenario):
+    """Выполнить scenario(session) на чистой in-memory SQLite базе."""
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    try:
+        async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+            return await scenario(session)
+    finally:
+        await engine.dispose()
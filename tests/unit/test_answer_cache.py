@@ -0,0 +1,117 @@
+import asyncio
+
+import numpy as np
+
+from app.ml.nlp.answer_cache import SemanticAnswerCache
+from app.ml.nlp.rag_service import RAGService
+from app.ml.nlp.semantic_search_service import SemanticSearchService
+from app.ml.nlp.vector_db import VectorDB
+from tests.unit.mocks import DummyEmbeddingService, DummyRedis, with_session
+
+
+def _unit_vector(dim: int, hot: int) -> np.ndarray:
+    vector = np.zeros(dim, dtype=np.float32)
+    vector[hot] = 1.0
+    return vector
+
+
+def test_answer_cache_evicts_oldest_and_drops_answers_of_old_generation():
+    vectors = np.eye(4, dtype=np.float32)
+    cache = SemanticAnswerCache(dim=4, threshold=0.9, max_entries=1, ttl=60)
+    cache.store(vectors[0], 5, 0, {"answer": "старый"})
+    cache.store(vectors[1], 5, 0, {"answer": "новый"})
+
+    assert len(cache) == 1
+    assert cache.lookup(vectors[0], 5, 0) is None
+    assert cache.lookup(vectors[1], 3, 0) is None
+    assert cache.lookup(vectors[1], 5, 0) == {"answer": "новый"}
+    # После изменения индекса источники могли устареть: запись удаляется при первом обращении
+    assert cache.lookup(vectors[1], 5, 1) is None
+    assert len(cache) == 0
+
+
+def test_rag_embeds_normalized_query_and_caches_answer_without_sources():
+    encoded: list[str] = []
+
+    class RecordingEncoder(DummyEmbeddingService):
+        async def encode_one_async(self, text):
+            encoded.append(text)
+            return np.eye(4, dtype=np.float32)[0]
+
+    class FailingLLM:
+        async def generate(self, prompt, system=None):
+            raise AssertionError("LLM не нужен, когда задач не найдено")
+
+    async def scenario():
+        # Пустой индекс: поиск ничего не находит и не обращается к базе
+        vector_db = VectorDB(dim=4, redis_client=DummyRedis())
+        rag = RAGService(FailingLLM(), SemanticSearchService(RecordingEncoder(), vector_db=vector_db))
+        first = await rag.ask("  Как подготовить отчёт?  ", session=None, top_k=1)
+        again = await rag.ask("Как подготовить отчёт?", session=None, top_k=1)
+        return first, again
+
+    first, again = asyncio.run(scenario())
+
+    assert first["sources"] == [] and not first["cached"]
+    assert again == {**first, "cached": True}
+    assert set(encoded) == {"Как подготовить отчёт?"}
+
+
+def test_rag_serves_paraphrase_from_semantic_cache_until_index_changes():
+    class ParaphraseEncoder(DummyEmbeddingService):
+        async def encode_one_async(self, text):
+            # Перефразированные вопросы про отчёт почти совпадают по эмбеддингу
+            vector = _unit_vector(4, 0) + (0.05 if "квартал" in text else 0.0) * _unit_vector(4, 1)
+            return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+    class CountingLLM:
+        calls = 0
+
+        async def generate(self, prompt, system=None):
+            CountingLLM.calls += 1
+            return f"ответ {CountingLLM.calls}"
+
+    async def scenario(session):
+        vector_db = VectorDB(dim=4, redis_client=DummyRedis())
+        await vector_db.add(_unit_vector(4, 0), session=session, item_id="a", text="Подготовить отчёт")
+        rag = RAGService(CountingLLM(), SemanticSearchService(ParaphraseEncoder(), vector_db=vector_db))
+        first = await rag.ask("Как подготовить отчёт?", session=session, top_k=1)
+        paraphrase = await rag.ask("Как подготовить квартальный отчёт?", session=session, top_k=1)
+        await vector_db.add(_unit_vector(4, 2), session=session, item_id="b", text="Другая задача")
+        after_write = await rag.ask("Как подготовить квартальный отчёт?", session=session, top_k=1)
+        return first, paraphrase, after_write
+
+    first, paraphrase, after_write = asyncio.run(with_session(scenario))
+
+    assert paraphrase == {**first, "cached": True}
+    assert after_write["answer"] == "ответ 2"
+    assert CountingLLM.calls == 2
+
+
+def test_rag_answers_again_once_a_matching_task_is_indexed():
+    class ReportEncoder(DummyEmbeddingService):
+        async def encode_one_async(self, text):
+            return _unit_vector(4, 0)
+
+    class CountingLLM:
+        calls = 0
+
+        async def generate(self, prompt, system=None):
+            CountingLLM.calls += 1
+            return f"ответ {CountingLLM.calls}"
+
+    async def scenario(session):
+        redis_client = DummyRedis()
+        vector_db = VectorDB(dim=4, redis_client=redis_client)
+        rag = RAGService(CountingLLM(), SemanticSearchService(ReportEncoder(), vector_db=vector_db), redis=redis_client)
+        empty = await rag.ask("Как подготовить отчёт?", session=session, top_k=1)
+        await vector_db.add(_unit_vector(4, 0), session=session, item_id="a", text="Подготовить отчёт")
+        fresh = await rag.ask("Как подготовить отчёт?", session=session, top_k=1)
+        return empty, fresh
+
+    empty, fresh = asyncio.run(with_session(scenario))
+
+    assert empty["sources"] == []
+    # Пустой ответ не лежит под точным ключом и не переживает появление подходящей задачи
+    assert fresh["answer"] == "ответ 1" and not fresh["cached"]
+    assert [source["text_id"] for source in fresh["sources"]] == ["a"]
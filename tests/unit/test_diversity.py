@@ -0,0 +1,14 @@
+import numpy as np
+
+from app.ml.nlp.diversity import maximal_marginal_relevance
+
+
+def test_mmr_collapses_near_duplicates_and_prefers_diverse_results():
+    near_duplicate = np.array([1.0, 0.05, 0.0, 0.0], dtype=np.float32)
+    vectors = np.stack([np.eye(4, dtype=np.float32)[0], near_duplicate / np.linalg.norm(near_duplicate), np.eye(4, dtype=np.float32)[2]])
+
+    order = maximal_marginal_relevance(np.array([1.0, 0.99, 0.5]), vectors, top_k=2, mmr_lambda=0.5)
+    collapsed = maximal_marginal_relevance(np.array([1.0, 0.99, 0.5]), vectors, top_k=3, duplicate_threshold=0.95)
+
+    assert order == [0, 2]
+    assert collapsed == [0, 2]
@@ -0,0 +1,41 @@
+import asyncio
+
+import numpy as np
+
+from app.ml.nlp.embedding_cache import EmbeddingCache
+from tests.unit.mocks import DummyRedis
+
+
+def test_embedding_cache_evicts_lru_and_shares_float16_vectors_via_redis():
+    redis_client = DummyRedis()
+    vectors = {f"задача {i}": np.eye(4, dtype=np.float32)[i] for i in range(3)}
+
+    async def scenario():
+        writer = EmbeddingCache("model:torch", dim=4, max_entries=2, redis_client=redis_client)
+        await writer.put_many(vectors)
+        reader = EmbeddingCache("model:torch", dim=4, max_entries=2, redis_client=redis_client)
+        other_model = EmbeddingCache("model:onnx_int8", dim=4, max_entries=2, redis_client=redis_client)
+        return len(writer), await reader.get_many([*vectors, "новая"]), await other_model.get_many(list(vectors))
+
+    memory_size, restored, other_model = asyncio.run(scenario())
+
+    assert memory_size == 2
+    assert set(restored) == set(vectors)
+    assert all(np.allclose(restored[text], vector) for text, vector in vectors.items())
+    assert all(len(value) == 4 * 2 for key, value in redis_client.data.items() if key.startswith("emb:"))
+    assert other_model == {}
+
+
+def test_embedding_cache_does_not_pin_batch_matrix():
+    batch = np.ones((8, 4), dtype=np.float32)
+
+    async def scenario():
+        cache = EmbeddingCache("model:torch", dim=4, max_entries=8)
+        await cache.put_many({"задача": batch[3]})
+        batch[3] = 0.0
+        return await cache.get_many(["задача"])
+
+    cached = asyncio.run(scenario())
+
+    assert cached["задача"].base is None
+    assert np.allclose(cached["задача"], 1.0)
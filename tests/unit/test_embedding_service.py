@@ -0,0 +1,40 @@
+import asyncio
+
+import numpy as np
+
+from app.ml.metrics import MLMetricsCollector
+from app.ml.nlp.embedding_cache import EmbeddingCache
+from app.ml.nlp.embedding_service import EmbeddingService
+
+
+def test_length_buckets_group_similar_lengths_within_token_budget():
+    lengths = np.array([120, 5, 7, 6, 118, 64, 5])
+
+    buckets = EmbeddingService._length_buckets(lengths, max_size=3, max_tokens=256)
+
+    assert buckets == [[1, 6, 3], [2, 5], [4, 0]]
+    assert sorted(position for bucket in buckets for position in bucket) == list(range(len(lengths)))
+    assert all(len(bucket) * lengths[bucket].max() <= 256 for bucket in buckets)
+
+
+def test_encode_one_reads_and_fills_memory_cache():
+    encoded = []
+
+    def encode(text):
+        encoded.append(text)
+        return np.eye(4, dtype=np.float32)[0]
+
+    # Без загрузки модели: синхронному пути нужны только метрики, кеш и кодировщик
+    service = EmbeddingService.__new__(EmbeddingService)
+    service.metrics = MLMetricsCollector("EmbeddingService[test]")
+    service.cache = EmbeddingCache("model:test", dim=4, max_entries=8)
+    service._encode = encode
+    asyncio.run(service.cache.put_many({"из async пути": np.eye(4, dtype=np.float32)[1]}))
+
+    cached = service.encode_one("  из async пути ")
+    first = service.encode_one("новая задача")
+    again = service.encode_one("новая задача")
+
+    assert np.allclose(cached, np.eye(4)[1])
+    assert encoded == ["новая задача"]
+    assert np.allclose(first, again)
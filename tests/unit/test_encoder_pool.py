@@ -0,0 +1,59 @@
+import os
+import zlib
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from app.ml.nlp.encoder_pool import EncoderPool
+
+
+class HashEncoder:
+    """Детерминированный энкодер без модели: воркеры пула создают его через фабрику."""
+
+    def __init__(self, crash_marker: str | None = None) -> None:
+        self.crash_marker = crash_marker
+
+    def encode_batch(self, texts: list[str]) -> np.ndarray:
+        if self.crash_marker and "сбой" in texts and not os.path.exists(self.crash_marker):
+            # Первый такой батч убивает воркер, как OOM или segfault в модели
+            Path(self.crash_marker).touch()
+            os._exit(1)
+        vectors = np.stack([np.random.default_rng(zlib.crc32(text.encode())).normal(size=4) for text in texts])
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def hash_encoder(backend: str) -> HashEncoder:
+    return HashEncoder(os.environ.get("ENCODER_POOL_CRASH_MARKER"))
+
+
+@pytest.mark.slow
+def test_encoder_pool_matches_in_process_encoding_across_chunks():
+    texts = [f"задача {i}" for i in range(7)]
+    pool = EncoderPool(2, 4, "torch", chunk_size=2, factory=hash_encoder)
+    try:
+        pooled = pool.encode(texts)
+    finally:
+        pool.close()
+
+    assert np.array_equal(pooled, HashEncoder().encode_batch(texts))
+
+
+@pytest.mark.slow
+def test_encoder_pool_restarts_after_worker_crash(tmp_path, monkeypatch):
+    # Spawn воркеры наследуют окружение родителя
+    monkeypatch.setenv("ENCODER_POOL_CRASH_MARKER", str(tmp_path / "crashed"))
+    texts = ["задача", "сбой", "ещё задача"]
+    pool = EncoderPool(1, 4, "torch", chunk_size=2, factory=hash_encoder)
+    try:
+        broken = pool._executor
+        recovered = pool.encode(texts)
+        restarted = pool._executor is not broken
+        after = pool.encode(["задача"])
+    finally:
+        pool.close()
+
+    assert (tmp_path / "crashed").exists()
+    assert restarted
+    assert np.array_equal(recovered, HashEncoder().encode_batch(texts))
+    assert np.array_equal(after, HashEncoder().encode_batch(["задача"]))
@@ -0,0 +1,28 @@
+import asyncio
+
+import numpy as np
+
+from app.ml.nlp.micro_batcher import MicroBatcher
+
+
+def test_micro_batcher_merges_concurrent_requests_into_one_encode():
+    batches = []
+
+    def encode_batch(texts):
+        batches.append(list(texts))
+        if "сбой" in texts:
+            raise RuntimeError("encoder failed")
+        return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+    async def scenario():
+        batcher = MicroBatcher(encode_batch, max_batch_size=3, max_wait_ms=50)
+        results = await asyncio.gather(*(batcher.submit(text) for text in ["a", "bb", "ccc", "dddd"]))
+        failed = await asyncio.gather(batcher.submit("сбой"), return_exceptions=True)
+        await batcher.close()
+        return results, failed
+
+    results, [failed] = asyncio.run(scenario())
+
+    assert batches[:2] == [["a", "bb", "ccc"], ["dddd"]]
+    assert [float(result[0]) for result in results] == [1.0, 2.0, 3.0, 4.0]
+    assert isinstance(failed, RuntimeError)
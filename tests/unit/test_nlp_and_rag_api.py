@@ -1,3 +1,5 @@
+import json
+
 from fastapi.testclient import TestClient
 
 
@@ -26,6 +28,62 @@ def test_nlp_index_search_and_tag(unit_client_a: TestClient):
     assert "python" in tag_resp.json()["tags"]
 
 
+def test_nlp_search_batch(unit_client_a: TestClient):
+    unit_client_a.post("/nlp/index", json={"text": "Task about Python FastAPI Redis"})
+    batch_resp = unit_client_a.post("/nlp/search/batch", json={"queries": ["Python", "Redis"], "top_k": 3})
+    empty_resp = unit_client_a.post("/nlp/search/batch", json={"queries": []})
+
+    assert batch_resp.status_code == 200
+    assert batch_resp.json()["total"] == 2
+    assert all(row["total"] >= 1 for row in batch_resp.json()["results"])
+    assert empty_resp.status_code == 400
+
+
+def test_nlp_index_bulk_streams_ndjson(unit_client_a: TestClient):
+    lines = [
+        '{"text": "Task about Python FastAPI Redis", "item_id": 7}',
+        "",
+        "not json",
+        '{"text": "   "}',
+        '{"text": "Celery worker for Redis queue"}',
+    ]
+    bulk_resp = unit_client_a.post(
+        "/nlp/index/bulk",
+        content="\n".join(lines).encode(),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    search_resp = unit_client_a.post("/nlp/search", json={"query": "Redis", "top_k": 5})
+
+    progress = [json.loads(line) for line in bulk_resp.text.splitlines()]
+    summary = progress[-1]
+
+    assert bulk_resp.status_code == 200
+    assert bulk_resp.headers["content-type"].startswith("application/x-ndjson")
+    assert progress[:-1] == [{"batch": 1, "indexed": 2}]
+    assert summary["indexed"] == 2
+    assert summary["batches"] == 1
+    assert summary["failed"] == 2
+    assert [error.split(":")[0] for error in summary["errors"]] == ["строка 3", "строка 4"]
+    assert search_resp.json()["total"] >= 2
+
+
+def test_nlp_index_bulk_reports_error_as_last_line(unit_client_a: TestClient, monkeypatch):
+    monkeypatch.setattr("app.routers.nlp.MAX_BULK_LINE_BYTES", 64)
+    lines = ['{"text": "Task about Python FastAPI Redis"}', '{"text": "' + "x" * 200 + '"}']
+
+    bulk_resp = unit_client_a.post(
+        "/nlp/index/bulk",
+        content="\n".join(lines).encode(),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+
+    assert bulk_resp.status_code == 200
+    assert json.loads(bulk_resp.text.splitlines()[-1]) == {
+        "error": "Строка NDJSON длиннее 64 байт",
+        "indexed": 0,
+    }
+
+
 def test_rag_ask_and_reindex(unit_client_a: TestClient):
     ask_resp = unit_client_a.post("/rag/ask", json={"query": "What is in my tasks?", "top_k": 3, "use_cache": True})
     reindex_resp = unit_client_a.post("/rag/reindex")
@@ -0,0 +1,47 @@
+import pytest
+import torch
+from sentence_transformers import SentenceTransformer, models
+from transformers import BertConfig, BertModel, BertTokenizer
+
+from app.ml.nlp.onnx_text_encoder import OnnxTextEncoder, export_onnx, parity_check
+
+
+def _tiny_model(path) -> SentenceTransformer:
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *"abcdefghijklmnopqrstuvwxyzабвгдеёжзийклмнопрстуфхцчшщъыьэюя"]
+    (path / "vocab.txt").write_text("\n".join(vocab), encoding="utf-8")
+    BertTokenizer(str(path / "vocab.txt")).save_pretrained(path)
+    torch.manual_seed(0)
+    BertModel(
+        BertConfig(vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2, num_attention_heads=2, intermediate_size=64)
+    ).save_pretrained(path)
+    return SentenceTransformer(modules=[models.Transformer(str(path)), models.Pooling(32, "mean")])
+
+
+def test_onnx_text_encoder_matches_sentence_transformer(tmp_path):
+    model = _tiny_model(tmp_path)
+
+    int8_path = export_onnx(model, tmp_path / "encoder.onnx", tmp_path / "encoder-int8.onnx")
+    fp32 = OnnxTextEncoder(tmp_path / "encoder.onnx", model.tokenizer, model.max_seq_length, batch_size=2)
+    int8 = OnnxTextEncoder(int8_path, model.tokenizer, model.max_seq_length)
+
+    assert fp32.encode(["a", "bb", "ccc"]).shape == (3, 32)
+    assert parity_check(model, fp32) > 0.9999
+    assert parity_check(model, int8) > 0.99
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_failed_export_leaves_no_partial_model(tmp_path, monkeypatch):
+    model = _tiny_model(tmp_path)
+
+    def broken_export(module, inputs, path, **kwargs):
+        with open(path, "wb") as partial:
+            partial.write(b"partial")
+        raise RuntimeError("export interrupted")
+
+    monkeypatch.setattr(torch.onnx, "export", broken_export)
+    with pytest.raises(RuntimeError):
+        export_onnx(model, tmp_path / "encoder.onnx")
+
+    # Следующий запуск не примет обрывок за готовую модель и экспортирует заново
+    assert not (tmp_path / "encoder.onnx").exists()
+    assert not list(tmp_path.glob("*.tmp"))
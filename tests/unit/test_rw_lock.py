@@ -0,0 +1,30 @@
+import asyncio
+
+from app.ml.nlp.rw_lock import AsyncRWLock
+
+
+def test_rw_lock_runs_readers_together_and_writers_alone():
+    lock = AsyncRWLock()
+    events: list[str] = []
+
+    async def reader(name: str):
+        async with lock.read():
+            events.append(f"{name}+")
+            await asyncio.sleep(0.01)
+            events.append(f"{name}-")
+
+    async def writer():
+        await asyncio.sleep(0.001)
+        async with lock.write():
+            events.append("w+")
+            await asyncio.sleep(0.01)
+            events.append("w-")
+
+    async def scenario():
+        await asyncio.gather(reader("r1"), reader("r2"), writer())
+
+    asyncio.run(scenario())
+
+    assert events[:2] == ["r1+", "r2+"]
+    assert events.index("w+") > max(events.index("r1-"), events.index("r2-"))
+    assert events.index("w-") == events.index("w+") + 1
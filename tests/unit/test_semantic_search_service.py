@@ -0,0 +1,144 @@
+import asyncio
+
+import numpy as np
+
+from app.ml.nlp.lexical_index import tokenize
+from app.ml.nlp.semantic_search_service import SemanticSearchService
+from app.ml.nlp.vector_db import VectorDB
+from tests.unit.mocks import DummyEmbeddingService, DummyRedis, with_session
+
+
+def _unit_vector(dim: int, hot: int) -> np.ndarray:
+    vector = np.zeros(dim, dtype=np.float32)
+    vector[hot] = 1.0
+    return vector
+
+
+def test_hybrid_search_boosts_exact_terms_and_skips_encoder_for_keywords():
+    texts = ["Сервис на FastAPI", "Миграции PostgreSQL", "Очередь задач Celery", "Кеш на Redis"]
+    vectors = np.stack([_unit_vector(4, i) for i in range(4)])
+
+    class KeywordOnlyEncoder(DummyEmbeddingService):
+        calls = 0
+
+        def encode_one(self, text):
+            KeywordOnlyEncoder.calls += 1
+            return _unit_vector(4, 2)
+
+    async def scenario(session):
+        vector_db = VectorDB(dim=4)
+        await vector_db.add(vectors, session=session, item_id=["a", "b", "c", "d"], text=texts)
+        service = SemanticSearchService(KeywordOnlyEncoder(), vector_db=vector_db)
+        keyword = await service.search("postgresql", session=session, top_k=1, mode="auto")
+        hybrid = await service.search("миграции postgresql", session=session, top_k=2, mode="hybrid")
+        dense = await service.search("миграции postgresql", session=session, top_k=1, mode="dense")
+        return keyword, hybrid, dense
+
+    keyword, hybrid, dense = asyncio.run(with_session(scenario))
+
+    assert [item["text_id"] for item in keyword] == ["b"]
+    # BM25 не подменяет косинусную похожесть: у лексических попаданий её нет
+    assert keyword[0]["similarity"] is None and keyword[0]["lexical_score"] > 0
+    assert hybrid[1]["similarity"] == 1.0
+    assert KeywordOnlyEncoder.calls == 2
+    # Плотный поиск находит «c», но точное совпадение терминов поднимает «b» на первое место
+    assert dense[0]["text_id"] == "c"
+    assert [item["text_id"] for item in hybrid] == ["b", "c"]
+    assert tokenize("C++, Node.js и C#.") == ["c++", "node.js", "и", "c#"]
+
+
+def test_cached_search_skips_encoder_until_index_changes():
+    class CountingEncoder(DummyEmbeddingService):
+        calls = 0
+
+        async def encode_one_async(self, text):
+            CountingEncoder.calls += 1
+            return _unit_vector(4, 0)
+
+    async def scenario(session):
+        vector_db = VectorDB(dim=4, redis_client=DummyRedis())
+        await vector_db.add(_unit_vector(4, 0), session=session, item_id="a", text="Первая задача")
+        service = SemanticSearchService(CountingEncoder(), vector_db=vector_db)
+        first = await service.search("похожая задача", session=session, top_k=1, mode="dense")
+        cached = await service.search("похожая задача", session=session, top_k=1, mode="dense")
+        calls_before_write = CountingEncoder.calls
+        await vector_db.add(_unit_vector(4, 1), session=session, item_id="b", text="Вторая задача")
+        await service.search("похожая задача", session=session, top_k=1, mode="dense")
+        return first, cached, calls_before_write
+
+    first, cached, calls_before_write = asyncio.run(with_session(scenario))
+
+    assert cached == first
+    assert calls_before_write == 1
+    assert CountingEncoder.calls == 2
+
+
+def test_cached_hybrid_search_skips_bm25_and_reads_cache_once_per_miss():
+    class CountingRedis(DummyRedis):
+        def __init__(self):
+            super().__init__()
+            self.reads = []
+
+        async def get(self, key):
+            self.reads.append("get")
+            return await super().get(key)
+
+        async def mget(self, keys):
+            self.reads.append("mget")
+            return await super().mget(keys)
+
+    class CountingEncoder(DummyEmbeddingService):
+        calls = 0
+
+        async def encode_one_async(self, text):
+            CountingEncoder.calls += 1
+            return _unit_vector(4, 0)
+
+    redis_client = CountingRedis()
+    lexical_calls = []
+
+    async def scenario(session):
+        vector_db = VectorDB(dim=4, redis_client=redis_client)
+        await vector_db.add(_unit_vector(4, 0), session=session, item_id="a", text="Миграции PostgreSQL")
+        search_lexical = vector_db.lexical_search_many
+
+        async def counting_lexical(*args, **kwargs):
+            lexical_calls.append(args[0])
+            return await search_lexical(*args, **kwargs)
+
+        vector_db.lexical_search_many = counting_lexical
+        service = SemanticSearchService(CountingEncoder(), vector_db=vector_db)
+        redis_client.reads.clear()
+        first = await service.search("миграции базы", session=session, top_k=1, mode="hybrid")
+        miss_reads = list(redis_client.reads)
+        cached = await service.search("миграции базы", session=session, top_k=1, mode="hybrid")
+        return first, cached, miss_reads
+
+    first, cached, miss_reads = asyncio.run(with_session(scenario))
+
+    assert cached == first
+    assert miss_reads == ["get", "mget"]
+    assert len(lexical_calls) == 1
+    assert CountingEncoder.calls == 1
+
+
+def test_search_with_mmr_skips_near_duplicate_documents():
+    near_duplicate = _unit_vector(4, 0) + 0.05 * _unit_vector(4, 1)
+    vectors = np.stack([_unit_vector(4, 0), near_duplicate / np.linalg.norm(near_duplicate), _unit_vector(4, 2)])
+
+    class DuplicateEncoder(DummyEmbeddingService):
+        async def encode_one_async(self, text):
+            return _unit_vector(4, 0)
+
+    async def scenario(session):
+        vector_db = VectorDB(dim=4)
+        await vector_db.add(vectors, session=session, item_id=["a", "a-copy", "c"], text=["Задача", "Задача (копия)", "Другая"])
+        service = SemanticSearchService(DuplicateEncoder(), vector_db=vector_db)
+        plain = await service.search("задача", session=session, top_k=2, mode="dense")
+        diverse = await service.search("задача", session=session, top_k=2, mode="dense", mmr_lambda=0.7)
+        return plain, diverse
+
+    plain, diverse = asyncio.run(with_session(scenario))
+
+    assert [item["text_id"] for item in plain] == ["a", "a-copy"]
+    assert [item["text_id"] for item in diverse] == ["a", "c"]
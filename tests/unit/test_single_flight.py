@@ -0,0 +1,89 @@
+import asyncio
+
+import numpy as np
+
+from app.ml.nlp.rag_service import RAGService
+from app.ml.nlp.semantic_search_service import SemanticSearchService
+from app.ml.nlp.single_flight import SingleFlight
+from app.ml.nlp.vector_db import VectorDB
+from tests.unit.mocks import DummyEmbeddingService, DummyRedis, with_session
+
+
+def test_single_flight_shares_one_result_and_error_between_waiters():
+    calls = []
+
+    async def compute(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        if value == "сбой":
+            raise RuntimeError("compute failed")
+        return {"value": value}
+
+    async def scenario():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(*(flight.run("ключ", lambda: compute("ответ")) for _ in range(3)))
+        failed = await asyncio.gather(
+            *(flight.run("ошибка", lambda: compute("сбой")) for _ in range(2)), return_exceptions=True
+        )
+        # После ошибки ключ освобождён и считается заново
+        retried = await flight.run("ошибка", lambda: compute("повтор"))
+        return results, failed, retried
+
+    results, failed, retried = asyncio.run(scenario())
+
+    assert calls == ["ответ", "сбой", "повтор"]
+    assert results[0] is results[1] is results[2]
+    assert all(isinstance(error, RuntimeError) for error in failed)
+    assert retried == {"value": "повтор"}
+
+
+def test_single_flight_waits_for_result_of_another_process():
+    redis_client = DummyRedis()
+    shared_cache: dict[str, str] = {}
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        shared_cache["ключ"] = "ответ"
+        return "ответ"
+
+    async def fetch():
+        return shared_cache.get("ключ")
+
+    async def scenario():
+        # Два экземпляра с общим Redis — как два процесса
+        flights = [SingleFlight("test", redis_client=redis_client, poll_interval=0.005) for _ in range(2)]
+        return await asyncio.gather(*(flight.run("ключ", compute, fetch=fetch) for flight in flights))
+
+    assert asyncio.run(scenario()) == ["ответ", "ответ"]
+    assert len(calls) == 1
+    assert not [key for key in redis_client.data if key.startswith("single_flight:")]
+
+def test_concurrent_identical_rag_questions_call_llm_once_across_processes():
+    class SlowLLM:
+        calls = 0
+
+        async def generate(self, prompt, system=None):
+            SlowLLM.calls += 1
+            await asyncio.sleep(0.05)
+            return "ответ"
+
+    async def scenario(session):
+        redis_client = DummyRedis()
+        vector_db = VectorDB(dim=4, redis_client=redis_client)
+        await vector_db.add(np.eye(4, dtype=np.float32)[0], session=session, item_id="a", text="Подготовить отчёт")
+        search = SemanticSearchService(DummyEmbeddingService(), vector_db=vector_db)
+        # Два экземпляра с общим Redis — как два воркера API
+        workers = [RAGService(SlowLLM(), search, redis=redis_client) for _ in range(2)]
+        for worker in workers:
+            worker._single_flight.poll_interval = 0.005
+        return await asyncio.gather(
+            *(workers[i % 2].ask("Как подготовить отчёт?", session=session, top_k=1) for i in range(6))
+        )
+
+    responses = asyncio.run(with_session(scenario))
+
+    assert SlowLLM.calls == 1
+    assert {response["answer"] for response in responses} == {"ответ"}
+    assert sum(response["cached"] for response in responses) == 3
@@ -0,0 +1,555 @@
+import asyncio
+import multiprocessing
+import pickle
+import threading
+
+import numpy as np
+import pytest
+from sqlalchemy import delete, select
+
+from app.core import config
+from app.db_models import Text
+from app.ml.nlp.faiss_index import read_index_mmap
+from app.ml.nlp.id_store import IdStore
+from app.ml.nlp.sharded_vector_db import ShardedVectorDB, serve_shard
+from app.ml.nlp.vector_db import VectorDB
+from tests.unit.mocks import DummyRedis, with_session
+
+
+def _unit_vector(dim: int, hot: int) -> np.ndarray:
+    vector = np.zeros(dim, dtype=np.float32)
+    vector[hot] = 1.0
+    return vector
+
+
+def test_delete_hides_vector_without_rebuild():
+    async def scenario(session):
+        vector_db = VectorDB(dim=4)
+        await vector_db.add(np.stack([_unit_vector(4, i) for i in range(3)]), session=session, item_id=["a", "b", "c"])
+        await vector_db.delete("b")
+
+        results = await vector_db.search(_unit_vector(4, 1), session=session, top_k=3)
+        return vector_db, results
+
+    vector_db, results = asyncio.run(with_session(scenario))
+
+    assert {item["text_id"] for item in results} == {"a", "c"}
+    assert "b" not in vector_db
+    assert len(vector_db) == 2
+    assert vector_db.index.ntotal == 3
+
+
+def test_compact_removes_tombstones():
+    async def scenario(session):
+        vector_db = VectorDB(dim=4)
+        await vector_db.add(np.stack([_unit_vector(4, i) for i in range(3)]), session=session, item_id=["a", "b", "c"])
+        await vector_db.delete("a")
+        removed = await vector_db.compact()
+
+        results = await vector_db.search(_unit_vector(4, 2), session=session, top_k=1)
+        return vector_db, removed, results
+
+    vector_db, removed, results = asyncio.run(with_session(scenario))
+
+    assert removed == 1
+    assert vector_db.index.ntotal == 2
+    assert results[0]["text_id"] == "c"
+
+
+def test_promotes_to_hnsw_and_keeps_ids(monkeypatch):
+    monkeypatch.setattr("app.ml.nlp.vector_db.config.VECTOR_DB_PROMOTION_THRESHOLD", 3)
+
+    async def scenario(session):
+        vector_db = VectorDB(dim=4, index_type="hnsw")
+        await vector_db.add(np.stack([_unit_vector(4, i) for i in range(4)]), session=session, item_id=["a", "b", "c", "d"])
+        await vector_db.delete("a")
+        promoted = await vector_db.maybe_promote()
+
+        results = await vector_db.search(_unit_vector(4, 3), session=session, top_k=1, ef_search=16)
+        return vector_db, promoted, results
+
+    vector_db, promoted, results = asyncio.run(with_session(scenario))
+
+    assert promoted
+    assert vector_db.index_type == "hnsw"
+    assert vector_db.index.ntotal == 3
+    assert results[0]["text_id"] == "d"
+
+
+def test_hnsw_search_caps_tombstone_overfetch_and_compacts_past_threshold(monkeypatch):
+    monkeypatch.setattr("app.ml.nlp.vector_db.config.VECTOR_DB_PROMOTION_THRESHOLD", 3)
+    monkeypatch.setattr("app.ml.nlp.vector_db.config.VECTOR_DB_COMPACTION_MIN_TOMBSTONES", 10**6)
+    vectors = np.random.default_rng(0).normal(size=(60, 8)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    nearest = np.argsort(-(vectors @ vectors[0])).tolist()
+
+    async def scenario(session):
+        vector_db = VectorDB(dim=8, index_type="hnsw")
+        await vector_db.add(vectors, session=session, item_id=[str(i) for i in range(60)])
+        await vector_db.maybe_promote()
+        # Удаляем ближайших соседей запроса: ограниченный запас целиком состоит из удалённых
+        for position in nearest[:30]:
+            await vector_db.delete(str(position))
+        results = await vector_db.search(vectors[0], session=session, top_k=5, ef_search=64)
+
+        monkeypatch.setattr("app.ml.nlp.vector_db.config.VECTOR_DB_COMPACTION_MIN_TOMBSTONES", 1)
+        await vector_db.delete(str(nearest[30]))
+        await vector_db._compaction
+
+        # Воркер Celery не запускает компактизацию в loop, который закроется после задачи
+        worker_db = VectorDB(dim=8, index_type="hnsw", background_compaction=False)
+        await worker_db.add(vectors[:4], session=session, item_id=["a", "b", "c", "d"])
+        await worker_db.maybe_promote()
+        await worker_db.delete("a")
+        return vector_db, results, worker_db
+
+    vector_db, results, worker_db = asyncio.run(with_session(scenario))
+
+    assert [item["text_id"] for item in results] == [str(position) for position in nearest[30:35]]
+    assert not vector_db._tombstones
+    assert vector_db.index.ntotal == 29
+    assert worker_db._compaction is None and worker_db._tombstones
+
+
+def test_sq8_compression_after_training_size(monkeypatch):
+    monkeypatch.setattr("app.ml.nlp.vector_db.config.VECTOR_DB_COMPRESSION_TRAIN_SIZE", 8)
+    vectors = np.random.default_rng(0).normal(size=(16, 8)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    async def scenario(session):
+        vector_db = VectorDB(dim=8, index_type="flat", compression="sq8")
+        await vector_db.add(vectors, session=session, item_id=[str(i) for i in range(16)])
+        uncompressed = vector_db.index_compression
+        promoted = await vector_db.maybe_promote()
+
+        results = await vector_db.search(vectors[3], session=session, top_k=1)
+        return vector_db, uncompressed, promoted, results
+
+    vector_db, uncompressed, promoted, results = asyncio.run(with_session(scenario))
+
+    assert uncompressed == "fp16"
+    assert promoted
+    assert vector_db.index_compression == "sq8"
+    assert results[0]["text_id"] == "3"
+
+
+def test_load_replays_log_after_checkpoint():
+    redis_client = DummyRedis()
+
+    async def scenario(session):
+        writer = VectorDB(dim=4, redis_client=redis_client)
+        await writer.add(np.stack([_unit_vector(4, i) for i in range(2)]), session=session, item_id=["a", "b"])
+        await writer.save_to_redis()
+        await writer.add(_unit_vector(4, 2), session=session, item_id="c")
+        await writer.delete("a")
+
+        reader = VectorDB(dim=4, redis_client=redis_client)
+        loaded = await reader.load_from_redis()
+        results = await reader.search(_unit_vector(4, 2), session=session, top_k=1)
+        return reader, loaded, results
+
+    reader, loaded, results = asyncio.run(with_session(scenario))
+
+    assert loaded
+    assert sorted(reader.ids) == ["b", "c"]
+    assert results[0]["text_id"] == "c"
+    # XTRIM MINID оставляет запись на смещении снапшота, более ранние обрезаются
+    assert len(redis_client.data[reader.log_key]) == 3
+
+
+def test_load_backfills_lexical_index_for_snapshot_without_it():
+    redis_client = DummyRedis()
+
+    async def scenario(session):
+        writer = VectorDB(dim=4, redis_client=redis_client)
+        await writer.add(
+            np.stack([_unit_vector(4, i) for i in range(2)]),
+            session=session,
+            item_id=["a", "b"],
+            text=["Сервис на FastAPI", "Миграции PostgreSQL"],
+        )
+        await session.commit()
+        await writer.save_to_redis()
+        # Снапшот, записанный до появления лексического индекса
+        metadata = pickle.loads(redis_client.data[writer.ids_key])
+        del metadata["lexical"]
+        redis_client.data[writer.ids_key] = pickle.dumps(metadata)
+
+        reader = VectorDB(dim=4, redis_client=redis_client)
+        await reader.load_from_redis()
+        return await reader.lexical_search_many(["postgresql"], session=session, top_k=1)
+
+    [results] = asyncio.run(with_session(scenario))
+
+    assert [item["text_id"] for item in results] == ["b"]
+
+
+def test_load_retries_when_snapshot_file_disappears_while_opening(monkeypatch, tmp_path):
+    monkeypatch.setattr("app.ml.nlp.vector_db.config.VECTOR_DB_SNAPSHOT_DIR", str(tmp_path))
+    redis_client = DummyRedis()
+    opened = []
+
+    def flaky_read_index_mmap(path):
+        opened.append(path)
+        if len(opened) == 1:
+            # Ротация чужой контрольной точки удалила файл между чтением метаданных и открытием
+            raise RuntimeError(f"Error: could not open {path} for reading")
+        return read_index_mmap(path)
+
+    async def scenario(session):
+        writer = VectorDB(dim=4, redis_client=redis_client)
+        await writer.add(np.stack([_unit_vector(4, i) for i in range(2)]), session=session, item_id=["a", "b"])
+        await writer.save_to_redis()
+        monkeypatch.setattr("app.ml.nlp.vector_db.read_index_mmap", flaky_read_index_mmap)
+        reader = VectorDB(dim=4, redis_client=redis_client)
+        loaded = await reader.load_from_redis()
+        return reader, loaded
+
+    reader, loaded = asyncio.run(with_session(scenario))
+
+    assert loaded
+    assert len(opened) == 2
+    assert reader._snapshot_path is not None
+    assert sorted(reader.ids) == ["a", "b"]
+
+
+def test_stale_checkpoint_does_not_overwrite_newer_snapshot():
+    redis_client = DummyRedis()
+
+    async def scenario(session):
+        lagging = VectorDB(dim=4, redis_client=redis_client)
+        current = VectorDB(dim=4, redis_client=redis_client)
+        await lagging.add(_unit_vector(4, 0), session=session, item_id="a")
+        await current.sync()
+        await current.add(_unit_vector(4, 1), session=session, item_id="b")
+        saved_current = await current.save_to_redis()
+        # Снапшот отстающего процесса старше: его запись затёрла бы "b", чьи записи журнала уже обрезаны
+        saved_lagging = await lagging.save_to_redis()
+        restarted = VectorDB(dim=4, redis_client=redis_client)
+        await restarted.load_from_redis()
+        return saved_current, saved_lagging, restarted
+
+    saved_current, saved_lagging, restarted = asyncio.run(with_session(scenario))
+
+    assert saved_current and not saved_lagging
+    assert sorted(restarted.ids) == ["a", "b"]
+
+
+def test_load_maps_disk_snapshot_and_keeps_new_vectors_in_delta(monkeypatch, tmp_path):
+    monkeypatch.setattr("app.ml.nlp.vector_db.config.VECTOR_DB_SNAPSHOT_DIR", str(tmp_path))
+    redis_client = DummyRedis()
+
+    async def scenario(session):
+        writer = VectorDB(dim=4, redis_client=redis_client)
+        await writer.add(np.stack([_unit_vector(4, i) for i in range(2)]), session=session, item_id=["a", "b"])
+        await writer.save_to_redis()
+
+        reader = VectorDB(dim=4, redis_client=redis_client)
+        loaded = await reader.load_from_redis()
+        mapped = reader._snapshot_path is not None
+        await reader.add(_unit_vector(4, 2), session=session, item_id="c")
+        await reader.delete("a")
+        results = await reader.search(_unit_vector(4, 2), session=session, top_k=3)
+        removed = await reader.compact()
+        return reader, loaded, mapped, results, removed
+
+    reader, loaded, mapped, results, removed = asyncio.run(with_session(scenario))
+
+    assert loaded and mapped
+    assert len(list(tmp_path.rglob("*.faiss"))) == 1
+    assert [item["text_id"] for item in results][:2] == ["c", "b"]
+    assert removed == 1
+    assert reader.index.ntotal == 2
+
+
+def test_search_many_matches_single_searches_and_uses_cache():
+    redis_client = DummyRedis()
+
+    async def scenario(session):
+        vector_db = VectorDB(dim=4, redis_client=redis_client)
+        await vector_db.add(
+            np.stack([_unit_vector(4, i) for i in range(4)]),
+            session=session,
+            item_id=["a", "b", "c", "d"],
+            text=["A", "B", "C", "D"],
+        )
+        queries = np.stack([_unit_vector(4, 2), _unit_vector(4, 0)])
+        batch = await vector_db.search_many(queries, session=session, top_k=2, queries=["c", "a"])
+        single = [await vector_db.search(query, session=session, top_k=2) for query in queries]
+        cached = await vector_db.search_many(queries, session=session, top_k=2, queries=["c", "a"])
+        return batch, single, cached
+
+    batch, single, cached = asyncio.run(with_session(scenario))
+
+    assert batch == single
+    assert [row[0]["text"] for row in batch] == ["C", "A"]
+    assert cached == batch
+
+
+def test_filtered_search_returns_full_top_k_for_selected_author(monkeypatch):
+    monkeypatch.setattr("app.ml.nlp.vector_db.config.VECTOR_DB_FILTER_EXACT_LIMIT", 3)
+    vectors = np.random.default_rng(1).normal(size=(40, 8)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    attributes = [{"author_id": i % 10, "tags": ["python"] if i % 2 else ["go"]} for i in range(40)]
+
+    async def scenario(session):
+        vector_db = VectorDB(dim=8)
+        await vector_db.add(vectors, session=session, item_id=[str(i) for i in range(40)], attributes=attributes)
+        await vector_db.delete("13")
+        by_author = await vector_db.search(vectors[0], session=session, top_k=3, filters={"author_id": 3})
+        no_match = await vector_db.search(vectors[0], session=session, top_k=2, filters={"author_id": 4, "tags": ["python"]})
+        by_tag = await vector_db.search(vectors[0], session=session, top_k=5, filters={"author_id": 5, "tags": "python"})
+        return by_author, no_match, by_tag
+
+    by_author, no_match, by_tag = asyncio.run(with_session(scenario))
+
+    # Три подходящих вектора ищутся точным перебором, четыре — через IDSelector в FAISS
+    assert sorted(item["text_id"] for item in by_author) == ["23", "3", "33"]
+    assert no_match == []
+    assert {item["text_id"] for item in by_tag} == {"5", "15", "25", "35"}
+
+
+def test_set_attributes_backfills_filters_and_replicates_through_log():
+    redis_client = DummyRedis()
+
+    async def scenario(session):
+        writer = VectorDB(dim=4, redis_client=redis_client)
+        replica = VectorDB(dim=4, redis_client=redis_client)
+        # Векторы, проиндексированные до появления атрибутов
+        await writer.add(np.eye(4, dtype=np.float32)[:3], session=session, item_id=["1", "2", "3"])
+        before = await writer.search(_unit_vector(4, 0), session=session, top_k=3, filters={"author_id": 7})
+        missing = await writer.ids_without_attributes()
+        updated = await writer.set_attributes({"1": {"author_id": 7}, "3": {"author_id": 7, "tags": ["redis"]}, "9": {}})
+        await replica.sync()
+        by_author = await replica.search(_unit_vector(4, 0), session=session, top_k=3, filters={"author_id": 7})
+        by_tag = await replica.search(_unit_vector(4, 0), session=session, top_k=3, filters={"tags": ["redis"]})
+        return before, missing, updated, by_author, by_tag, await replica.ids_without_attributes()
+
+    before, missing, updated, by_author, by_tag, still_missing = asyncio.run(with_session(scenario))
+
+    assert before == []
+    assert sorted(missing) == ["1", "2", "3"]
+    assert updated == 2
+    assert [item["text_id"] for item in by_author] == ["1", "3"]
+    assert [item["text_id"] for item in by_tag] == ["3"]
+    assert still_missing == ["2"]
+
+
+def test_id_store_round_trip_and_replacement():
+    store = IdStore.from_mapping({0: "a", 1: "b", 2: "c"})
+    replaced = store.set_many(["b", "d"], [3, 4])
+    store.pop("a")
+
+    loaded = IdStore.from_bytes(store.to_bytes())
+    loaded.set("e", 5)
+
+    assert replaced == [1]
+    assert "a" not in loaded and "b" in loaded
+    assert loaded.get("b") == 3 and loaded.id_of(1) is None
+    assert loaded.ids() == ["c", "b", "d", "e"]
+    assert loaded.alive_mask(np.array([-1, 0, 2, 3])).tolist() == [False, False, True, True]
+    assert store.get("e") is None
+
+
+def test_mutation_bumps_search_cache_generation():
+    redis_client = DummyRedis()
+
+    async def scenario(session):
+        vector_db = VectorDB(dim=4, redis_client=redis_client)
+        await vector_db.add(np.stack([_unit_vector(4, i) for i in range(2)]), session=session, item_id=["a", "b"])
+        first = await vector_db.search(_unit_vector(4, 2), session=session, top_k=1, query="c")
+        cached = await vector_db.search(_unit_vector(4, 2), session=session, top_k=1, query="c")
+        await vector_db.add(_unit_vector(4, 2), session=session, item_id="c")
+        fresh = await vector_db.search(_unit_vector(4, 2), session=session, top_k=1, query="c")
+        return vector_db, first, cached, fresh
+
+    vector_db, first, cached, fresh = asyncio.run(with_session(scenario))
+
+    assert cached == first
+    assert fresh[0]["text_id"] == "c"
+    assert redis_client.data[vector_db.generation_key] == 2
+
+
+def test_lagging_replica_does_not_poison_search_cache_of_new_generation():
+    redis_client = DummyRedis()
+
+    async def scenario(session):
+        writer = VectorDB(dim=4, redis_client=redis_client)
+        lagging = VectorDB(dim=4, redis_client=redis_client)
+        await writer.add(_unit_vector(4, 0), session=session, item_id="a")
+        await lagging.sync()
+        await writer.add(_unit_vector(4, 1), session=session, item_id="b")
+        # Реплика видит новое поколение, но запись журнала с "b" ещё не применила
+        stale = await lagging.search(_unit_vector(4, 1), session=session, top_k=1, query="b")
+        fresh = await writer.search(_unit_vector(4, 1), session=session, top_k=1, query="b")
+        return stale, fresh
+
+    stale, fresh = asyncio.run(with_session(scenario))
+
+    assert stale[0]["text_id"] == "a"
+    assert fresh[0]["text_id"] == "b"
+
+
+def test_sync_applies_other_process_changes_and_reloads_after_trim():
+    redis_client = DummyRedis()
+
+    async def scenario(session):
+        api = VectorDB(dim=4, redis_client=redis_client)
+        worker = VectorDB(dim=4, redis_client=redis_client)
+        await api.add(_unit_vector(4, 0), session=session, item_id="a")
+        await worker.add(_unit_vector(4, 1), session=session, item_id="b")
+        await api.add(_unit_vector(4, 2), session=session, item_id="c")
+        tailed = await worker.sync()
+        await worker.delete("a")
+        await worker.save_to_redis()
+        await worker.add(_unit_vector(4, 3), session=session, item_id="d")
+        reloaded = await api.sync()
+        results = await api.search(_unit_vector(4, 3), session=session, top_k=1)
+        return api, worker, tailed, reloaded, results
+
+    api, worker, tailed, reloaded, results = asyncio.run(with_session(scenario))
+
+    assert tailed and reloaded
+    assert sorted(worker.ids) == ["b", "c", "d"]
+    assert sorted(api.ids) == ["b", "c", "d"]
+    assert results[0]["text_id"] == "d"
+    # Метки выделяются общим счётчиком и не пересекаются между процессами
+    assert sorted(api.id_store.get(item_id) for item_id in api.ids) == [1, 2, 3]
+
+
+def test_published_maintenance_snapshot_reaches_caught_up_replicas(monkeypatch):
+    monkeypatch.setattr("app.ml.nlp.vector_db.config.VECTOR_DB_PROMOTION_THRESHOLD", 3)
+    monkeypatch.setattr("app.ml.nlp.vector_db.config.VECTOR_DB_COMPACTION_MIN_TOMBSTONES", 10**6)
+    redis_client = DummyRedis()
+
+    async def scenario(session):
+        api = VectorDB(dim=4, redis_client=redis_client, index_type="hnsw")
+        worker = VectorDB(dim=4, redis_client=redis_client, index_type="hnsw")
+        await api.add(np.eye(4, dtype=np.float32)[[0, 1, 2, 3, 0, 1]], session=session, item_id=list("abcdef"))
+        await worker.sync()
+        await worker.maybe_promote()
+        await worker.save_to_redis(publish=True)
+        promoted = await api.sync()
+        index_type = api.index_type
+
+        await api.delete("a")
+        await api.delete("e")
+        await worker.sync()
+        await worker.compact()
+        await worker.save_to_redis(publish=True)
+        compacted = await api.sync()
+        restarted = VectorDB(dim=4, redis_client=redis_client, index_type="hnsw")
+        await restarted.load_from_redis()
+        return api, restarted, promoted, index_type, compacted
+
+    api, restarted, promoted, index_type, compacted = asyncio.run(with_session(scenario))
+
+    assert promoted and compacted
+    assert index_type == "hnsw"
+    for replica in (api, restarted):
+        assert not replica._tombstones
+        assert replica.index.ntotal == 4
+        assert sorted(replica.ids) == ["b", "c", "d", "f"]
+    # Своя отметка не заставляет перезагружать индекс
+    assert not api._reload_pending
+
+
+def test_hydration_cache_skips_database_and_drops_deleted_texts():
+    async def scenario(session):
+        vector_db = VectorDB(dim=4)
+        await vector_db.add(
+            np.stack([_unit_vector(4, i) for i in range(2)]), session=session, item_id=["a", "b"], text=["A", "B"]
+        )
+        first = await vector_db.search(_unit_vector(4, 0), session=session, top_k=2)
+        # Повторный поиск берёт тексты из LRU кеша, даже если строки в базе изменились
+        await session.execute(delete(Text))
+        cached = await vector_db.search(_unit_vector(4, 0), session=session, top_k=2)
+        await vector_db.delete("b")
+        return vector_db, first, cached
+
+    vector_db, first, cached = asyncio.run(with_session(scenario))
+
+    assert cached == first
+    assert [item["text"] for item in cached] == ["A", "B"]
+    assert vector_db.text_cache.get_many(["a", "b"]) == {"a": "A"}
+
+
+def test_sharded_vector_db_merges_top_k_across_shards():
+    vectors = np.random.default_rng(2).normal(size=(30, 8)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    item_ids = [str(i) for i in range(30)]
+
+    # Шарды поднимаются в потоках этого процесса: RPC тот же, но без долгого старта процессов
+    authkey = b"test-shards"
+    addresses = []
+    for shard in range(2):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        threading.Thread(
+            target=serve_shard,
+            args=(("127.0.0.1", 0), authkey, 8, f"test:shard{shard}", "flat", None, None, sender),
+            daemon=True,
+        ).start()
+        addresses.append(receiver.recv())
+
+    async def scenario(session):
+        single = VectorDB(dim=8, index_type="flat")
+        sharded = ShardedVectorDB(dim=8, shard_addresses=addresses, authkey=authkey)
+        try:
+            for vector_db in (single, sharded):
+                await vector_db.add(vectors, session=session, item_id=item_ids)
+                await vector_db.delete("7")
+            expected = await single.search_many(vectors[:3], session=session, top_k=5)
+            merged = await sharded.search_many(vectors[:3], session=session, top_k=5)
+            reconstructed = await sharded.get_vectors(["3", "7", "12"])
+            contained = await sharded.contains_many(["7", "8", "missing", "29"])
+            return merged, expected, await sharded.size(), contained, reconstructed
+        finally:
+            sharded.close()
+
+    merged, expected, size, contained, reconstructed = asyncio.run(with_session(scenario))
+
+    assert [[item["text_id"] for item in row] for row in merged] == [[item["text_id"] for item in row] for row in expected]
+    assert size == 29
+    assert contained == [False, True, False, True]
+    assert np.allclose(reconstructed, np.stack([vectors[3], np.zeros(8), vectors[12]]))
+
+
+def test_sharded_vector_db_refuses_blocking_accessors_and_spawn_in_daemon(monkeypatch):
+    sharded = ShardedVectorDB(dim=8, shard_addresses=[("127.0.0.1", 1)], authkey=b"test-shards")
+    try:
+        assert sharded
+        for blocking in (len, lambda vector_db: "1" in vector_db, lambda vector_db: vector_db.ids):
+            with pytest.raises(TypeError):
+                blocking(sharded)
+    finally:
+        sharded.close()
+
+    # Без отдельного ключа шардов координатор не подключается, SECRET_KEY для этого не берётся
+    monkeypatch.setattr(config, "VECTOR_DB_SHARD_AUTHKEY", "")
+    with pytest.raises(RuntimeError, match="VECTOR_DB_SHARD_AUTHKEY"):
+        ShardedVectorDB(dim=8, shard_addresses=[("127.0.0.1", 1)])
+
+    monkeypatch.setattr(multiprocessing.current_process(), "daemon", True, raising=False)
+    with pytest.raises(RuntimeError, match="VECTOR_DB_SHARD_ADDRESSES"):
+        ShardedVectorDB.spawn(dim=8, shard_count=2)
+
+
+def test_upsert_replaces_vector_and_text_in_place():
+    async def scenario(session):
+        vector_db = VectorDB(dim=4)
+        await vector_db.add(np.stack([_unit_vector(4, i) for i in range(2)]), session=session, item_id=["a", "b"], text=["A", "B"])
+        await vector_db.search(_unit_vector(4, 0), session=session, top_k=1)
+        await vector_db.upsert("a", _unit_vector(4, 2), session=session, text="A2")
+        await vector_db.upsert_many(["c", "b", "c"], np.stack([_unit_vector(4, 3)] * 3), session=session, texts=["C", "B2", "C2"])
+
+        moved = await vector_db.search(_unit_vector(4, 2), session=session, top_k=1)
+        texts = await session.execute(select(Text.text_id, Text.text).order_by(Text.text_id))
+        return vector_db, moved, texts.all()
+
+    vector_db, moved, texts = asyncio.run(with_session(scenario))
+
+    assert moved[0]["text_id"] == "a" and moved[0]["text"] == "A2"
+    assert texts == [("a", "A2"), ("b", "B2"), ("c", "C2")]
+    assert sorted(vector_db.ids) == ["a", "b", "c"]
+    assert len(vector_db._tombstones) == 3
+